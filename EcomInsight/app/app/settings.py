@@ -51,6 +51,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',
+    'django.contrib.postgres',
     'debug_toolbar',
 
     #my apps
@@ -249,10 +250,89 @@ LOGGING = {
     },
 }
 
+# Arithmetic used for calculations: 'fixed_point' (integer cents) or 'decimal'.
+CALCULATOR_ARITHMETIC = os.environ.get('CALCULATOR_ARITHMETIC', 'fixed_point')
+# Number of additional field names whose classification is cached per process.
+CALCULATOR_FIELD_CACHE_SIZE = 10_000
+# Memoized results of the anonymous calculate endpoint.
+CALCULATOR_RESULT_CACHE = {
+    'ENABLED': bool(int(os.environ.get('CALCULATOR_RESULT_CACHE', 1))),
+    'MAX_SIZE': 4096,
+    'TIMEOUT': 60 * 60 * 24,
+}
+# Seconds between log lines with the hit and miss counters of a process's caches, 0 disables them.
+CALCULATOR_CACHE_STATS_INTERVAL = 60 * 5
+# Lifetime of rendered item list pages, they are also invalidated on writes.
+CALCULATOR_LIST_CACHE_TIMEOUT = 60 * 15
+# Default and maximum number of items per page.
+CALCULATOR_PAGE_SIZE = 100
+CALCULATOR_MAX_PAGE_SIZE = 1000
+# Products recalculated per transaction when repricing a catalog.
+CALCULATOR_REPRICE_BATCH_SIZE = 5000
+# Rows fetched per round trip from the server-side cursor of CSV exports.
+CALCULATOR_EXPORT_CHUNK_SIZE = 2000
+# Rows validated and loaded per transaction by CSV imports.
+CALCULATOR_IMPORT_CHUNK_SIZE = 5000
+# Invalid rows reported back by imports and syncs, further ones are only counted.
+CALCULATOR_IMPORT_MAX_ERRORS = 1000
+# Feed items upserted per transaction by catalog syncs.
+CALCULATOR_SYNC_BATCH_SIZE = 1000
+# Maximum number of products created, updated or deleted by one bulk request.
+CALCULATOR_BULK_MAX_ITEMS = 1000
+# Products deleted per transaction by bulk deletes.
+CALCULATOR_BULK_DELETE_CHUNK_SIZE = 200
+# Seconds deleted products are reported by the changes feed, older cursors must resync.
+CALCULATOR_TOMBSTONE_RETENTION = 60 * 60 * 24 * 30
+# Tombstones deleted per transaction when purging expired ones.
+CALCULATOR_TOMBSTONE_PURGE_BATCH_SIZE = 10_000
+# Seconds the owner of an import is kept, as long as Celery keeps the task's result.
+CALCULATOR_IMPORT_TTL = 60 * 60 * 24
+# Directory of uploaded CSV imports, written by the app and read by workers.
+CALCULATOR_IMPORT_ROOT = os.path.join(MEDIA_ROOT, 'imports')
+# Directory of CSV export files, written by workers and read by the app.
+CALCULATOR_EXPORT_ROOT = os.path.join(MEDIA_ROOT, 'exports')
+# Seconds a finished export is kept for downloads and reuse after it was last requested.
+CALCULATOR_EXPORT_TTL = 60 * 60 * 24
+# How export files are downloaded: 'accel' hands them to the proxy with X-Accel-Redirect,
+# 'stream' streams them from the app, for deployments without the proxy.
+CALCULATOR_EXPORT_SERVE = os.environ.get('CALCULATOR_EXPORT_SERVE', 'stream')
+# Internal proxy location serving CALCULATOR_EXPORT_ROOT.
+CALCULATOR_EXPORT_ACCEL_URL = MEDIA_URL + 'exports/'
+# Seconds export leases are kept without renewal, they outlive a crashed task by at most this.
+CALCULATOR_EXPORT_LEASE = 60 * 10
+# Exports of one user written at the same time, others wait for a free slot.
+CALCULATOR_EXPORT_USER_CONCURRENCY = 1
+# Seconds an export waits before trying again for a free slot.
+CALCULATOR_EXPORT_RETRY_DELAY = 10
+# Seconds a running export's leases are kept while its shards wait in the queue.
+CALCULATOR_EXPORT_TIMEOUT = 60 * 60 * 6
+# Exports of more products are split into shards of at least this many, written in parallel
+# in the user's slots.
+CALCULATOR_EXPORT_SHARD_ROWS = 200_000
+# Maximum number of shards of one export, also capped by the user's export slots.
+CALCULATOR_EXPORT_MAX_SHARDS = 8
+
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
 CELERY_TASK_TRACK_STARTED = True
+# Workers reserve one task at a time, so queued exports of one user don't
+# hold back those of others.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BEAT_SCHEDULE = {
+    'purge-tombstones': {
+        'task': 'calculator.tasks.purge_tombstones_task',
+        'schedule': 60 * 60 * 24,
+    },
+    'renew-export-leases': {
+        'task': 'calculator.tasks.renew_export_leases_task',
+        'schedule': CALCULATOR_EXPORT_LEASE / 3,
+    },
+    'purge-exports': {
+        'task': 'calculator.tasks.purge_exports_task',
+        'schedule': 60 * 60,
+    },
+}
 
 CACHES = {
     "default": {
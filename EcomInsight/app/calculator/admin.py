@@ -1,6 +1,5 @@
 from django.contrib import admin
-from .models import ProductInformation, ProductInformationAdditionalFields
+from .models import ProductInformation
 
 # Register your models here.
 admin.site.register(ProductInformation)
-admin.site.register(ProductInformationAdditionalFields)
@@ -0,0 +1,139 @@
+"""
+Analytics of a user's catalog.
+
+CatalogSummary keeps per-user totals: product count, inventory value,
+projected profit, margin distribution and the most and least profitable
+products. Statement triggers on products add the difference of every
+write to the summaries of the affected owners, see migration 0008, so
+reading a summary is a single primary key lookup.
+
+Summaries can be rebuilt from a full aggregate, and drift between the two
+can be detected like drift of stored totals.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+
+from .models import CatalogSummary, ProductInformation
+
+PRODUCTS = ProductInformation._meta.db_table
+SUMMARIES = CatalogSummary._meta.db_table
+USERS = get_user_model()._meta.db_table
+
+# Number of most and least profitable products kept, the triggers use the same.
+RANKED_PRODUCTS = 5
+
+# Label and column of margin percent ranges, lower bound included.
+MARGIN_BUCKETS = [
+    ('<0', 'margin_below_0'),
+    ('0-25', 'margin_0_25'),
+    ('25-50', 'margin_25_50'),
+    ('50-100', 'margin_50_100'),
+    ('>=100', 'margin_100_up'),
+    ('unknown', 'margin_unknown'),
+]
+
+# Full aggregate of the catalogs of a batch of users, including users
+# without products.
+AGGREGATE_SQL = f"""
+    SELECT u.id AS user_id,
+           count(p.id) AS product_count,
+           COALESCE(sum(COALESCE(p.quantity, 0) * COALESCE(p.expenses, 0)), 0) AS inventory_value,
+           COALESCE(sum(COALESCE(p.quantity, 0) * COALESCE(p.net_profit, 0)), 0) AS projected_profit,
+           count(p.id) FILTER (WHERE p.margin_percent < 0) AS margin_below_0,
+           count(p.id) FILTER (WHERE p.margin_percent >= 0 AND p.margin_percent < 25) AS margin_0_25,
+           count(p.id) FILTER (WHERE p.margin_percent >= 25 AND p.margin_percent < 50) AS margin_25_50,
+           count(p.id) FILTER (WHERE p.margin_percent >= 50 AND p.margin_percent < 100) AS margin_50_100,
+           count(p.id) FILTER (WHERE p.margin_percent >= 100) AS margin_100_up,
+           count(p.id) FILTER (WHERE p.margin_percent IS NULL) AS margin_unknown,
+           calculator_ranked_products(u.id, true, {RANKED_PRODUCTS}) AS top_products,
+           calculator_ranked_products(u.id, false, {RANKED_PRODUCTS}) AS bottom_products
+    FROM {USERS} u
+    LEFT JOIN {PRODUCTS} p ON p.product_owner_id = u.id
+    WHERE u.id = ANY(%(user_ids)s)
+    GROUP BY u.id
+"""
+
+SUMMARY_COLUMNS = ['product_count', 'inventory_value', 'projected_profit',
+                   *(column for _, column in MARGIN_BUCKETS),
+                   'top_products', 'bottom_products']
+
+# Summaries are locked before the aggregate is read: writers of the batch
+# wait for the rebuild, or the rebuild waits for them and sees their rows.
+REBUILD_SQL = f"""
+    INSERT INTO {SUMMARIES} (user_id, {', '.join(SUMMARY_COLUMNS)}, updated_at)
+    SELECT id, 0, 0, 0, {', '.join(['0'] * len(MARGIN_BUCKETS))}, '[]', '[]', now()
+    FROM unnest(%(user_ids)s::bigint[]) AS id
+    ON CONFLICT (user_id) DO NOTHING;
+
+    SELECT 1 FROM {SUMMARIES}
+    WHERE user_id = ANY(%(user_ids)s)
+    ORDER BY user_id
+    FOR UPDATE;
+
+    UPDATE {SUMMARIES} s
+    SET {', '.join(f'{column} = a.{column}' for column in SUMMARY_COLUMNS)},
+        updated_at = now()
+    FROM ({AGGREGATE_SQL}) a
+    WHERE s.user_id = a.user_id;
+"""
+
+DRIFT_SQL = f"""
+    SELECT a.user_id
+    FROM ({AGGREGATE_SQL}) a
+    LEFT JOIN {SUMMARIES} s ON s.user_id = a.user_id
+    WHERE ({', '.join(f's.{column}' for column in SUMMARY_COLUMNS)})
+          IS DISTINCT FROM
+          ({', '.join(f'a.{column}' for column in SUMMARY_COLUMNS)})
+      AND NOT (s.user_id IS NULL AND a.product_count = 0)
+    ORDER BY a.user_id
+"""
+
+
+def user_batches(user_id=None, batch_size: int = None):
+    """Yield lists of ids of the user, or of all users, in batches."""
+    if user_id is not None:
+        yield [user_id]
+        return
+    batch_size = batch_size or settings.CALCULATOR_REPRICE_BATCH_SIZE
+    after = 0
+    while True:
+        user_ids = list(get_user_model().objects.
+                        filter(pk__gt=after).
+                        order_by('pk').
+                        values_list('pk', flat=True)[:batch_size])
+        if user_ids:
+            yield user_ids
+        if len(user_ids) < batch_size:
+            return
+        after = user_ids[-1]
+
+
+def get_summary(user_id: int) -> CatalogSummary:
+    """Return summary of user's catalog, an empty one for users without products."""
+    return (CatalogSummary.objects.filter(pk=user_id).first()
+            or CatalogSummary(user_id=user_id))
+
+
+def rebuild_summaries(user_id=None, batch_size: int = None) -> int:
+    """
+    Replace summaries of the user, or of all users, with a full aggregate.
+    Every batch of users is committed separately. Returns the number of
+    rebuilt summaries.
+    """
+    rebuilt = 0
+    for user_ids in user_batches(user_id, batch_size):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(REBUILD_SQL, {'user_ids': user_ids})
+        rebuilt += len(user_ids)
+    return rebuilt
+
+
+def find_summary_drift(user_id=None, batch_size: int = None) -> list:
+    """Return ids of users whose summary differs from a full aggregate of their catalog."""
+    drifted = []
+    for user_ids in user_batches(user_id, batch_size):
+        with connection.cursor() as cursor:
+            cursor.execute(DRIFT_SQL, {'user_ids': user_ids})
+            drifted.extend(user_id for user_id, in cursor.fetchall())
+    return drifted
@@ -1,28 +1,47 @@
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import Q
+from django.db.models.functions import Upper
+
 from .models import ProductInformation
 
 
 def get_all_items():
     """Get all records from database."""
-    return (ProductInformation.objects.
-            prefetch_related('other_fields').all())
+    return ProductInformation.objects.all()
+
+
+def get_items_by_name(name: str, user: int):
+    """Filter user's products by name."""
+    return ProductInformation.objects.filter(product_owner=user, name__icontains=name)
 
 
-def get_items_by_name(name: str):
-    """Filter result by name."""
-    return (ProductInformation.objects.prefetch_related('other_fields').
-            select_related('product_owner').
-            filter(name__icontains=name))
+def get_items_by_sku(sku: str, user: int):
+    """Filter user's products by sku."""
+    return ProductInformation.objects.filter(product_owner=user, sku=sku)
 
 
-def get_items_by_sku(sku: str):
-    """Filter result by sku."""
-    return (ProductInformation.objects.prefetch_related('other_fields').
-            select_related('product_owner').
-            filter(sku=sku))
+def search_items(query: str, user: int):
+    """
+    Search user's products by name, ranked by trigram similarity.
+    Matches substrings and similar names, both served by the
+    pg_trgm GIN index on UPPER(name).
+    """
+    return (ProductInformation.objects.
+            annotate(upper_name=Upper('name'),
+                     similarity=TrigramSimilarity('name', query)).
+            filter(Q(name__icontains=query) | Q(upper_name__trigram_similar=query),
+                   product_owner=user))
 
 
 def get_all_items_for_auth_user(user: int):
     """Get all times for authenticated user."""
-    return (ProductInformation.objects.
-            filter(product_owner=user).
-            prefetch_related('other_fields').all())
+    return ProductInformation.objects.filter(product_owner=user).all()
+
+
+def only_item_fields(queryset, fields: list):
+    """
+    Load only product columns of the selected item fields. Additional
+    fields are a column of the product too.
+    """
+    # created_at is kept for cursor positions of list pages.
+    return queryset.only('created_at', *fields)
@@ -0,0 +1,229 @@
+"""
+Bulk creation, partial update and deletion of a user's products.
+
+A batch is validated as a whole before anything is written, then products
+with their additional fields are written with bulk_create and bulk_update
+and repriced with one set-based statement, so the number of queries
+doesn't grow with the batch. Deletes run in chunks committed one by one.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .caching import items_cache
+from .models import ProductInformation
+from .other_fields import add_field_ids, merge_fields, new_field
+from .repricing import reprice_batch
+from .schema import OUTPUT_FIELDS
+from .serializers import SKU_TAKEN, CreateProductSerializer, ProductInfoSerializer
+
+
+class BulkCreateProductSerializer(CreateProductSerializer):
+    """
+    Product of a bulk create.
+    """
+
+    def validate_sku(self, sku):
+        """Skus are checked for the whole batch at once."""
+        return sku
+
+
+class BulkUpdateProductSerializer(ProductInfoSerializer):
+    """
+    Product of a bulk partial update, identified by its id.
+    """
+
+    id = serializers.IntegerField()
+
+    def validate_sku(self, sku):
+        """Skus are checked for the whole batch at once."""
+        return sku
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    """
+    Ids of products to delete.
+    """
+
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+    def validate_ids(self, ids):
+        """Check the batch size."""
+        check_batch_size(ids)
+        return ids
+
+
+def check_batch_size(items) -> None:
+    """Raise ValidationError unless items is a list within the batch limit."""
+    if not isinstance(items, list) or not items:
+        raise ValidationError({'non_field_errors': ['Expected a non-empty list.']})
+    if len(items) > settings.CALCULATOR_BULK_MAX_ITEMS:
+        raise ValidationError({'non_field_errors': [
+            f'At most {settings.CALCULATOR_BULK_MAX_ITEMS} items are allowed.']})
+
+
+def raise_for_errors(errors: list) -> None:
+    """Raise errors listed by item index, if any item failed."""
+    if any(errors):
+        raise ValidationError(errors)
+
+
+def sku_errors(user, skus: dict, kept=(), exclude=()) -> dict:
+    """
+    Return errors by item index for skus already used by other products of
+    user or repeated within the batch. skus maps item index to its new sku,
+    kept are skus the batch doesn't change and exclude ids of its products.
+    """
+    taken = set(ProductInformation.objects.
+                filter(product_owner=user, sku__in=skus.values()).
+                exclude(pk__in=exclude).
+                values_list('sku', flat=True))
+    seen = set(kept)
+    errors = {}
+    for index, sku in sorted(skus.items()):
+        if sku in taken or sku in seen:
+            errors[index] = {'sku': [SKU_TAKEN]}
+        seen.add(sku)
+    return errors
+
+
+def fetch_products(product_ids: list) -> list:
+    """Return products in the order of ids."""
+    products = ProductInformation.objects.in_bulk(product_ids)
+    return [products[product_id] for product_id in product_ids]
+
+
+def bulk_create_products(user, items, context: dict) -> list:
+    """
+    Validate and create products with their additional fields.
+    Nothing is created when any item is invalid; errors are raised as a
+    list by item index. Returns the created products with their totals.
+    """
+    check_batch_size(items)
+    validator = BulkCreateProductSerializer(context=context)
+    products = []
+    errors = []
+    for item in items:
+        try:
+            products.append(validator.run_validation(item))
+            errors.append({})
+        except ValidationError as error:
+            products.append(None)
+            errors.append(error.detail)
+    skus = {index: product['sku'] for index, product in enumerate(products)
+            if product and product.get('sku') is not None}
+    for index, error in sku_errors(user, skus).items():
+        errors[index] = error
+    raise_for_errors(errors)
+
+    other_fields = add_field_ids([[new_field(field) for field in product.pop('other_fields', [])]
+                                  for product in products])
+    with transaction.atomic():
+        created = ProductInformation.objects.bulk_create(
+            ProductInformation(product_owner=user, other_fields=fields, **product)
+            for product, fields in zip(products, other_fields))
+        product_ids = [product.pk for product in created]
+        reprice_batch(0, len(product_ids), product_ids=product_ids)
+    items_cache.invalidate(user.pk)
+    return fetch_products(product_ids)
+
+
+def bulk_update_products(user, items, context: dict) -> list:
+    """
+    Validate and partially update products of user identified by id.
+    Additional fields with an id update that field of the product, ones
+    without an id are added, like in ProductInfoSerializer.update.
+    Products are locked from being read until they are written, so
+    concurrent updates of them aren't overwritten. Nothing is updated
+    when any item is invalid; errors are raised as a list by item index.
+    Returns the updated products with their totals.
+    """
+    check_batch_size(items)
+    ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+    with transaction.atomic():
+        # Locked in id order, so concurrent batches don't deadlock.
+        instances = {instance.pk: instance for instance in
+                     ProductInformation.objects.
+                     select_for_update().
+                     filter(product_owner=user,
+                            pk__in=[product_id for product_id in ids if isinstance(product_id, int)]).
+                     order_by('pk')}
+        products = []
+        errors = []
+        seen = set()
+        for product_id, item in zip(ids, items):
+            instance = instances.get(product_id) if isinstance(product_id, int) else None
+            if instance is None or product_id in seen:
+                products.append(None)
+                errors.append({'id': ['Product not found.' if instance is None
+                                      else 'Product is repeated in the batch.']})
+                continue
+            seen.add(product_id)
+            serializer = BulkUpdateProductSerializer(instance, data=item, partial=True, context=context)
+            if serializer.is_valid():
+                products.append((instance, serializer.validated_data))
+                errors.append({})
+            else:
+                products.append(None)
+                errors.append(serializer.errors)
+        skus = {}
+        kept = set()
+        for index, product in enumerate(products):
+            if product is None:
+                continue
+            instance, data = product
+            if 'sku' not in data:
+                kept.add(instance.sku)
+            elif data['sku'] is not None:
+                skus[index] = data['sku']
+        kept.discard(None)
+        for index, error in sku_errors(user, skus, kept, exclude=list(instances)).items():
+            errors[index] = error
+        raise_for_errors(errors)
+
+        columns = set()
+        for instance, data in products:
+            other_fields = merge_fields(instance.other_fields, data.pop('other_fields', []))
+            if other_fields != instance.other_fields:
+                instance.other_fields = other_fields
+                columns.add('other_fields')
+            # Totals are recalculated from the stored inputs below.
+            for name, value in data.items():
+                if name not in OUTPUT_FIELDS and name != 'id':
+                    setattr(instance, name, value)
+                    columns.add(name)
+        add_field_ids([instance.other_fields for instance, _ in products])
+
+        # bulk_update doesn't set auto_now fields.
+        now = timezone.now()
+        for instance, _ in products:
+            instance.updated_at = now
+        columns.add('updated_at')
+
+        product_ids = [instance.pk for instance, _ in products]
+        ProductInformation.objects.bulk_update([instance for instance, _ in products],
+                                               sorted(columns))
+        reprice_batch(0, len(product_ids), product_ids=product_ids)
+    items_cache.invalidate(user.pk)
+    return fetch_products(product_ids)
+
+
+def bulk_delete_products(user, product_ids: list, chunk_size: int = None) -> int:
+    """
+    Delete products of user by id, committing every chunk so row locks
+    are held briefly. Ids of missing or other users' products are ignored.
+    Returns the number of deleted products.
+    """
+    chunk_size = chunk_size or settings.CALCULATOR_BULK_DELETE_CHUNK_SIZE
+    product_ids = list(dict.fromkeys(product_ids))
+    deleted = 0
+    for start in range(0, len(product_ids), chunk_size):
+        with transaction.atomic():
+            _, counts = (ProductInformation.objects.
+                         filter(product_owner=user, pk__in=product_ids[start:start + chunk_size]).
+                         delete())
+        deleted += counts.get(ProductInformation._meta.label, 0)
+    items_cache.invalidate(user.pk)
+    return deleted
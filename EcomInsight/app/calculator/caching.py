@@ -0,0 +1,252 @@
+"""Caches used by the calculator app."""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+_missing = object()
+
+# Sets a timestamp to now, or one second after its previous value when that
+# isn't earlier, so every write gets a later timestamp than the one before.
+ADVANCE_SCRIPT = """
+local value = math.max(tonumber(redis.call('GET', KEYS[1]) or 0) + 1, tonumber(ARGV[1]))
+redis.call('SET', KEYS[1], value)
+return value
+"""
+
+
+class StatsLog:
+    """
+    Logs the counters of a process's cache, at most every
+    settings.CALCULATOR_CACHE_STATS_INTERVAL seconds, so hit ratios of
+    every worker can be followed in the logs.
+    """
+
+    def __init__(self, name: str, stats) -> None:
+        self.name = name
+        self.stats = stats
+        self.logged = time.monotonic()
+
+    def tick(self) -> None:
+        """Log the counters when the interval passed since the last time."""
+        interval = settings.CALCULATOR_CACHE_STATS_INTERVAL
+        now = time.monotonic()
+        if interval and now - self.logged >= interval:
+            self.logged = now
+            logger.info('%s cache of process %s: %s', self.name, os.getpid(),
+                        json.dumps(self.stats(), sort_keys=True))
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache with a size bound.
+    Counts hits, misses and evictions, and logs them when named.
+    """
+
+    def __init__(self, maxsize: int, name: str = None) -> None:
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stats_log = StatsLog(name, self.stats) if name else None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return cached value and mark it as recently used."""
+        if self.stats_log is not None:
+            self.stats_log.tick()
+        with self._lock:
+            value = self._data.get(key, _missing)
+            if value is _missing:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        """Cache value, evicting the least recently used entries."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all entries and reset counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """Return size, hit, miss and eviction counters."""
+        lookups = self.hits + self.misses
+        return {'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+
+class ResultCache:
+    """
+    Two-tier cache of calculation results keyed on a canonical hash of the
+    validated input: an in-process LRU in front of the shared Django cache.
+    Configured by settings.CALCULATOR_RESULT_CACHE.
+    """
+
+    # Bump when calculations change so shared entries from old code are not read.
+    version = 1
+
+    def __init__(self, prefix: str) -> None:
+        self.prefix = prefix
+        self.local = LRUCache(maxsize=settings.CALCULATOR_RESULT_CACHE['MAX_SIZE'])
+        self.shared_hits = 0
+        self.stats_log = StatsLog(prefix, self.stats)
+
+    @property
+    def enabled(self) -> bool:
+        return settings.CALCULATOR_RESULT_CACHE['ENABLED']
+
+    def make_key(self, data) -> str:
+        """Return cache key for validated input."""
+        payload = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+        digest = hashlib.sha256(payload.encode()).hexdigest()
+        return f'{self.prefix}:v{self.version}:{digest}'
+
+    def get_or_calculate(self, data, calculate):
+        """Return cached result for data, calling calculate(data) on a miss."""
+        if not self.enabled:
+            return calculate(data)
+
+        self.stats_log.tick()
+        key = self.make_key(data)
+        result = self.local.get(key)
+        if result is not None:
+            return result
+
+        result = cache.get(key)
+        if result is not None:
+            self.shared_hits += 1
+        else:
+            result = calculate(data)
+            cache.set(key, result, timeout=settings.CALCULATOR_RESULT_CACHE['TIMEOUT'])
+        self.local.set(key, result)
+        return result
+
+    def clear(self) -> None:
+        """Clear the local tier and counters."""
+        self.local.clear()
+        self.shared_hits = 0
+
+    def stats(self) -> dict:
+        """Return hit ratio and eviction counters of this process."""
+        local = self.local.stats()
+        lookups = local['hits'] + local['misses']
+        hits = local['hits'] + self.shared_hits
+        return {'local_hits': local['hits'],
+                'shared_hits': self.shared_hits,
+                'misses': local['misses'] - self.shared_hits,
+                'evictions': local['evictions'],
+                'size': local['size'],
+                'hit_ratio': hits / lookups if lookups else 0.0}
+
+
+calculation_cache = ResultCache(prefix='calculate')
+
+
+class UserListCache:
+    """
+    Per-user cache of rendered list responses and change metadata.
+
+    Every page key contains the user's generation counter. Writes bump the
+    counter, so pages rendered before the write are never read again and
+    expire on their own instead of being deleted. The counter and the time
+    of the last write also validate conditional reads.
+    """
+
+    def __init__(self, prefix: str) -> None:
+        self.prefix = prefix
+
+    def generation_key(self, user_id) -> str:
+        return f'{self.prefix}:generation:{user_id}'
+
+    def modified_key(self, user_id) -> str:
+        return f'{self.prefix}:modified:{user_id}'
+
+    def generation(self, user_id) -> int:
+        """Return user's current generation, starting a new counter if needed."""
+        key = self.generation_key(user_id)
+        generation = cache.get(key)
+        if generation is None:
+            # Start from the clock so pages of an evicted counter are not reused.
+            cache.add(key, time.time_ns(), timeout=None)
+            generation = cache.get(key)
+        return generation
+
+    def last_modified(self, user_id) -> int:
+        """Return timestamp of user's last write, now when it is not known."""
+        key = self.modified_key(user_id)
+        modified = cache.get(key)
+        if modified is None:
+            cache.add(key, int(time.time()), timeout=None)
+            modified = cache.get(key)
+        return modified
+
+    def bump(self, user_id) -> None:
+        """
+        Move user to a new generation. The time of the last write has a
+        resolution of a second, like Last-Modified, and is advanced past the
+        previous one, so a client that read between two writes in the same
+        second doesn't have a copy as recent as the second write.
+        """
+        # Set before the counter, so a reader seeing the old time also sees
+        # the old generation.
+        get_redis_connection().eval(ADVANCE_SCRIPT, 1, cache.make_key(self.modified_key(user_id)),
+                                    int(time.time()))
+        try:
+            cache.incr(self.generation_key(user_id))
+        except ValueError:
+            pass  # No counter yet, the next read starts a new one.
+
+    def invalidate(self, user_id) -> None:
+        """Bump user's generation once the current transaction commits."""
+        transaction.on_commit(lambda: self.bump(user_id))
+
+    @staticmethod
+    def digest(parts) -> str:
+        payload = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def page_key(self, user_id, *parts) -> str:
+        """Return key of a page rendered for user with the given parameters."""
+        return f'{self.prefix}:{user_id}:{self.generation(user_id)}:{self.digest(parts)}'
+
+    def etag(self, user_id, *parts) -> str:
+        """Return strong ETag of a response rendered for user with the given parameters."""
+        return f'"{self.digest([user_id, self.generation(user_id), *parts])[:32]}"'
+
+    def get(self, key):
+        return cache.get(key)
+
+    def set(self, key, content: bytes) -> None:
+        cache.set(key, content, timeout=settings.CALCULATOR_LIST_CACHE_TIMEOUT)
+
+
+items_cache = UserListCache(prefix='items')
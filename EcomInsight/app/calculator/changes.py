@@ -0,0 +1,151 @@
+"""
+Changes feed of a user's products.
+
+Triggers stamp every inserted or changed product with the id of the
+writing transaction and keep a tombstone of every deleted one. Changes of
+additional fields bump updated_at of their product, so they are stamped
+too. A product only keeps its latest stamp, so the feed is compacted by
+construction: a product changed many times is reported once. Tombstones
+are kept for settings.CALCULATOR_TOMBSTONE_RETENTION and then purged.
+
+Transaction ids are assigned when a transaction starts writing, not when
+it commits. The feed only returns changes of transactions older than every
+running one, so a change committed late can't end up behind a cursor a
+client already has.
+"""
+import base64
+import binascii
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .listing import ITEM_FIELDS, product_values, serialize_items
+from .models import ProductInformation, ProductTombstone
+
+PRODUCTS = ProductInformation._meta.db_table
+TOMBSTONES = ProductTombstone._meta.db_table
+
+CHANGES_SQL = f"""
+    WITH horizon AS (
+        SELECT txid_snapshot_xmin(txid_current_snapshot()) AS txid
+    )
+    (SELECT p.change_txid, p.id, false AS deleted
+     FROM {PRODUCTS} p, horizon
+     WHERE p.product_owner_id = %(user_id)s
+       AND (p.change_txid, p.id) > (%(txid)s, %(id)s)
+       AND p.change_txid < horizon.txid
+     ORDER BY p.change_txid, p.id
+     LIMIT %(limit)s)
+    UNION ALL
+    (SELECT t.change_txid, t.product_id, true
+     FROM {TOMBSTONES} t, horizon
+     WHERE %(tombstones)s
+       AND t.product_owner_id = %(user_id)s
+       AND (t.change_txid, t.product_id) > (%(txid)s, %(id)s)
+       AND t.change_txid < horizon.txid
+     ORDER BY t.change_txid, t.product_id
+     LIMIT %(limit)s)
+    ORDER BY 1, 2
+    LIMIT %(limit)s
+"""
+
+PURGE_SQL = f"""
+    DELETE FROM {TOMBSTONES}
+    WHERE id IN (SELECT id FROM {TOMBSTONES} WHERE deleted_at < %s LIMIT %s)
+"""
+
+
+class CursorExpired(APIException):
+    """Raised for cursors whose deletes may be purged already."""
+
+    status_code = status.HTTP_410_GONE
+    default_detail = 'Cursor is older than the tombstone retention, sync the whole catalog again.'
+    default_code = 'cursor_expired'
+
+
+class ChangesQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the changes feed.
+    """
+
+    cursor = serializers.CharField(required=False)
+    page_size = serializers.IntegerField(min_value=1, required=False)
+
+
+def encode_cursor(txid: int, product_id: int, issued: int) -> str:
+    """Return opaque cursor positioned after the change of product_id in txid."""
+    return base64.urlsafe_b64encode(f'{txid}:{product_id}:{issued}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Return (txid, product_id) of cursor. Raises ValidationError for invalid
+    cursors and CursorExpired for ones issued before the retention period,
+    whose tombstones may be purged.
+    """
+    try:
+        txid, product_id, issued = map(int, base64.urlsafe_b64decode(cursor.encode()).split(b':'))
+    except (binascii.Error, UnicodeEncodeError, ValueError):
+        raise ValidationError({'cursor': ['Invalid cursor.']})
+    if issued < time.time() - settings.CALCULATOR_TOMBSTONE_RETENTION:
+        raise CursorExpired()
+    return txid, product_id
+
+
+def changes_since(user_id: int, cursor: str = None, limit: int = None) -> dict:
+    """
+    Return up to limit changes of user's products after cursor, ordered by
+    the writing transaction, with the cursor of the next page. Changed
+    products are returned as items, deleted ones by id. Without a cursor
+    all products are returned and deleted ones are left out.
+    """
+    limit = min(limit or settings.CALCULATOR_PAGE_SIZE, settings.CALCULATOR_MAX_PAGE_SIZE)
+    txid, product_id = decode_cursor(cursor) if cursor else (0, 0)
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(CHANGES_SQL, {'user_id': user_id, 'txid': txid, 'id': product_id,
+                                        'tombstones': cursor is not None, 'limit': limit + 1})
+        rows = db_cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    changed = [product_id for _, product_id, deleted in rows if not deleted]
+    items = {item['id']: item for item in serialize_items(
+        ProductInformation.objects.
+        filter(pk__in=changed).
+        values(*product_values(ITEM_FIELDS)))}
+    # Products deleted since the changes were read are left out, their
+    # tombstones follow on a later page.
+    results = []
+    for _, product_id, deleted in rows:
+        if deleted:
+            results.append({'id': product_id, 'deleted': True})
+        elif product_id in items:
+            results.append({'id': product_id, 'deleted': False, 'item': items[product_id]})
+    if rows:
+        txid, product_id, _ = rows[-1]
+    return {'results': results,
+            'cursor': encode_cursor(txid, product_id, int(time.time())),
+            'has_more': has_more}
+
+
+def purge_tombstones(retention: int = None, batch_size: int = None) -> int:
+    """
+    Delete tombstones older than retention seconds in batches.
+    Returns the number of deleted tombstones.
+    """
+    retention = retention if retention is not None else settings.CALCULATOR_TOMBSTONE_RETENTION
+    batch_size = batch_size or settings.CALCULATOR_TOMBSTONE_PURGE_BATCH_SIZE
+    before = timezone.now() - timedelta(seconds=retention)
+    purged = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(PURGE_SQL, [before, batch_size])
+            deleted = cursor.rowcount
+        purged += deleted
+        if deleted < batch_size:
+            return purged
@@ -0,0 +1,106 @@
+"""
+Downloads of export files.
+
+Behind the proxy, the app only checks access and answers with an
+X-Accel-Redirect header, nginx then sends the file from an internal
+location, with Range requests for resumed downloads. Deployments without
+the proxy set CALCULATOR_EXPORT_SERVE to 'stream' and the file is streamed
+by the app, which handles a single byte range itself.
+
+Export files are never rewritten under the same name, so a range of a
+file is valid for as long as the file exists and If-Range needs no check.
+"""
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def byte_range(header: str, size: int):
+    """
+    Return (start, end) of the single byte range of a Range header, end
+    included, or None for the whole file: without a header, for
+    malformed ones and for multiple ranges. Raises ValueError for ranges
+    outside the file.
+    """
+    match = RANGE_RE.match(header.replace(' ', '')) if header else None
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last bytes of the file.
+        length = int(last)
+        if not length or not size:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def iter_file_range(file, start: int, length: int):
+    """Yield length bytes of file from start in chunks, then close it."""
+    with file:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(CHUNK_SIZE, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+
+
+def accel_response(file_path: str) -> HttpResponse:
+    """Return response handing file under CALCULATOR_EXPORT_ROOT to the proxy."""
+    name = os.path.relpath(file_path, settings.CALCULATOR_EXPORT_ROOT)
+    response = HttpResponse()
+    response['X-Accel-Redirect'] = settings.CALCULATOR_EXPORT_ACCEL_URL + quote(name)
+    return response
+
+
+def stream_response(request, file_path: str) -> HttpResponse:
+    """Return response streaming file, or the requested byte range of it."""
+    file = open(file_path, 'rb')
+    size = os.fstat(file.fileno()).st_size
+    try:
+        requested = byte_range(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        file.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if requested is None:
+        response = FileResponse(file)
+    else:
+        start, end = requested
+        response = StreamingHttpResponse(iter_file_range(file, start, end - start + 1), status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def download_response(request, file_path: str, filename: str, content_type: str) -> HttpResponse:
+    """
+    Return response downloading file as an attachment, the way set by
+    CALCULATOR_EXPORT_SERVE. Raises FileNotFoundError when the app streams
+    a file that is gone, the proxy answers 404 itself.
+    """
+    if settings.CALCULATOR_EXPORT_SERVE == 'accel':
+        response = accel_response(file_path)
+    else:
+        response = stream_response(request, file_path)
+        if response.status_code == 416:
+            return response
+    response['Content-Type'] = content_type
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,484 @@
+"""
+Registry of CSV exports.
+
+Every export is an ExportJob of its owner, recording the file it is
+written to and a fingerprint of the owner's products when it was
+requested. A request for products with the same fingerprint reuses the
+file of an earlier finished job and extends its expiry. Files have unique
+names and are written to temporary files that are renamed when complete,
+so concurrent exports never overwrite each other and downloads never see
+partial files. Expired jobs and their files are deleted periodically.
+
+Large catalogs are split into id ranges of at least
+settings.CALCULATOR_EXPORT_SHARD_ROWS products, into no more shards than
+the owner has export slots, so users with one slot get one task writing
+the whole file. Every shard is written to
+its own file by its own task, reading its own snapshot, and the files are
+concatenated in id order. The additional field columns are chosen before
+the shards are written, and only the first shard writes the header, so
+the merged file has one header and the same columns in every row.
+
+The fingerprint is taken from the changes feed stamps: every write of a
+product gives it a new change_txid, creates and deletes change the count.
+It's read before the export, so a file can hold newer products than its
+fingerprint, which only costs an extra export later.
+
+Identical requests arriving while an export runs are collapsed onto it:
+the first one takes a Redis lock on the user and fingerprint, holding the
+job's task id, and later ones get that task id back. Every user has
+settings.CALCULATOR_EXPORT_USER_CONCURRENCY slots, also Redis locks, and
+a task that finds them taken goes back to the queue, so one user's
+exports can't occupy more slots. Shards written by tasks of their own take
+a slot each, an export is written by at most as many workers as its owner
+has slots. Locks are leases: tasks renew them while writing or waiting for
+a slot, and a periodic task renews the flight locks of running exports
+while their shards wait in the queue, for at most
+settings.CALCULATOR_EXPORT_TIMEOUT. They expire if a task dies.
+"""
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+from redis.exceptions import LockError
+
+from .import_export import additional_field_names, iter_product_rows, product_field_names
+from .models import ExportJob, ProductInformation
+
+PRODUCTS = ProductInformation._meta.db_table
+
+FINGERPRINT_SQL = f"""
+    SELECT count(*), COALESCE(sum(change_txid), 0)
+    FROM {PRODUCTS}
+    WHERE product_owner_id = %s
+"""
+
+SHARDS_SQL = f"""
+    SELECT id FROM (
+        SELECT id, row_number() OVER (ORDER BY id) AS n
+        FROM {PRODUCTS}
+        WHERE product_owner_id = %(user_id)s
+    ) numbered
+    WHERE (n - 1) %% %(shard_rows)s = 0
+    ORDER BY id
+"""
+
+PROGRESS_SQL = f"""
+    UPDATE {ExportJob._meta.db_table}
+    SET progress = jsonb_set(progress, %s, %s::jsonb)
+    WHERE id = %s
+"""
+
+# Suffix of files being written, shards are numbered before it.
+PARTIAL_SUFFIX = '.part'
+PARTIAL_RE = re.compile(r'(\.\d+)?\.part$')
+
+# Bytes copied at a time when merging shards.
+MERGE_BUFFER_SIZE = 1024 * 1024
+
+
+class ExportSlotsFull(Exception):
+    """Raised when every export slot of the user is taken."""
+
+
+class Lease:
+    """
+    Redis lock held by an export job, identified by its task id, so it can
+    be renewed and released by another process than the one acquiring it.
+    Expires after settings.CALCULATOR_EXPORT_LEASE seconds without renewal.
+    """
+
+    def __init__(self, key: str, task_id: str) -> None:
+        self.key = key
+        self.lock = cache.lock(key, timeout=settings.CALCULATOR_EXPORT_LEASE, thread_local=False)
+        self.lock.local.token = task_id.encode()
+        self.renewed = time.monotonic()
+
+    def acquire(self) -> bool:
+        """Take the lock if it's free, returns whether it was taken."""
+        return self.lock.acquire(blocking=False, token=self.lock.local.token)
+
+    def holder(self):
+        """Return task id of the job holding the lock, None when it's free."""
+        token = self.lock.redis.get(self.lock.name)
+        return token.decode() if token else None
+
+    def renew(self, force: bool = False) -> None:
+        """Restart the lease, at most every third of its length unless forced."""
+        if force or time.monotonic() - self.renewed >= settings.CALCULATOR_EXPORT_LEASE / 3:
+            try:
+                self.lock.reacquire()
+            except LockError:
+                pass  # Expired and maybe taken by another job, nothing to keep.
+            self.renewed = time.monotonic()
+
+    def release(self) -> None:
+        """Release the lock unless it expired and was taken by another job."""
+        try:
+            self.lock.release()
+        except LockError:
+            pass
+
+
+def flight_lease(job) -> Lease:
+    """Return lease collapsing exports of the same products of the job's owner."""
+    return Lease(f'exports:flight:{job.owner_id}:{job.fingerprint}', job.task_id)
+
+
+def acquire_slot(owner_id: int, token: str) -> Lease:
+    """Return a taken export slot of the user, raises ExportSlotsFull if none is free."""
+    for slot in range(settings.CALCULATOR_EXPORT_USER_CONCURRENCY):
+        lease = Lease(f'exports:slot:{owner_id}:{slot}', token)
+        if lease.acquire():
+            return lease
+    raise ExportSlotsFull(owner_id)
+
+
+def export_fingerprint(user) -> str:
+    """Return fingerprint of user's products and the exported columns."""
+    with connection.cursor() as cursor:
+        cursor.execute(FINGERPRINT_SQL, [user.pk])
+        count, txids = cursor.fetchone()
+    # The owner column holds the user's string representation.
+    key = f'{count}:{txids}:{user}:{",".join(product_field_names())}'
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def export_path(user_id: int) -> str:
+    """Return a new unique path of an export file of user."""
+    return os.path.join(settings.CALCULATOR_EXPORT_ROOT, f'products_{user_id}_{uuid.uuid4().hex}.csv')
+
+
+def expiry():
+    """Return expiry of an export requested now."""
+    return timezone.now() + timedelta(seconds=settings.CALCULATOR_EXPORT_TTL)
+
+
+def start_export(user, run) -> tuple:
+    """
+    Return export job of user's current products and whether it was created.
+    A finished or running job with the same fingerprint is reused, otherwise
+    a pending job is created and passed to run(job), which should start
+    write_export. Jobs must be committed when created, for concurrent
+    requests to find them.
+    """
+    fingerprint = export_fingerprint(user)
+    finished = (ExportJob.objects.
+                filter(owner=user, fingerprint=fingerprint, status=ExportJob.Status.SUCCESS,
+                       expires_at__gt=timezone.now()).
+                order_by('-created_at').
+                first())
+    if finished is not None and os.path.exists(finished.file_path):
+        finished.expires_at = expiry()
+        # Not reused when it expired and is being purged meanwhile.
+        if (ExportJob.objects.
+                filter(pk=finished.pk, expires_at__gt=timezone.now()).
+                update(expires_at=finished.expires_at)):
+            return finished, False
+
+    job = ExportJob.objects.create(owner=user,
+                                   task_id=str(uuid.uuid4()),
+                                   fingerprint=fingerprint,
+                                   file_path=export_path(user.pk),
+                                   expires_at=expiry())
+    flight = flight_lease(job)
+    if not flight.acquire():
+        running = ExportJob.objects.filter(task_id=flight.holder()).first()
+        if running is not None:
+            job.delete()
+            return running, False
+    try:
+        run(job)
+    except Exception:
+        ExportJob.objects.filter(pk=job.pk).update(status=ExportJob.Status.FAILURE)
+        flight.release()
+        raise
+    return job, True
+
+
+def shard_path(file_path: str, index: int) -> str:
+    """Return path of a shard of an export file while it's written."""
+    return f'{file_path}.{index}{PARTIAL_SUFFIX}'
+
+
+def plan_shards(user) -> list:
+    """
+    Return [first_id, last_id, rows] of the shards of user's products,
+    last_id excluded and None for the last shard, which also gets products
+    created meanwhile. Shards have at least CALCULATOR_EXPORT_SHARD_ROWS
+    rows, at most CALCULATOR_EXPORT_MAX_SHARDS are made and no more than
+    the user's CALCULATOR_EXPORT_USER_CONCURRENCY slots.
+    """
+    count = ProductInformation.objects.filter(product_owner=user).count()
+    max_shards = min(settings.CALCULATOR_EXPORT_MAX_SHARDS,
+                     settings.CALCULATOR_EXPORT_USER_CONCURRENCY)
+    shard_rows = max(settings.CALCULATOR_EXPORT_SHARD_ROWS, -(-count // max_shards))
+    if count <= shard_rows:
+        return [[None, None, count]]
+    with connection.cursor() as cursor:
+        cursor.execute(SHARDS_SQL, {'user_id': user.pk, 'shard_rows': shard_rows})
+        first_ids = [first_id for first_id, in cursor.fetchall()]
+    last_ids = first_ids[1:] + [None]
+    rows = [shard_rows] * (len(first_ids) - 1) + [count - shard_rows * (len(first_ids) - 1)]
+    return [list(shard) for shard in zip(first_ids, last_ids, rows)]
+
+
+def begin_export(job_id: int):
+    """
+    Take a free export slot of the job's owner and return the plan of the
+    export: the job, its leases, the additional field columns and the
+    shards. Returns None for finished jobs. Raises ExportSlotsFull,
+    keeping the job pending, when no slot is free.
+    """
+    job = ExportJob.objects.select_related('owner').get(pk=job_id)
+    if job.status == ExportJob.Status.SUCCESS:
+        return None
+    flight = flight_lease(job)
+    try:
+        slot = acquire_slot(job.owner_id, job.task_id)
+    except ExportSlotsFull:
+        flight.renew(force=True)
+        raise
+
+    try:
+        # Columns are fixed for all shards, fields added meanwhile are left out.
+        other_names = additional_field_names(job.owner)
+        shards = plan_shards(job.owner)
+        ExportJob.objects.filter(pk=job_id).update(
+            status=ExportJob.Status.RUNNING,
+            progress=[{'rows': rows, 'written': 0, 'done': False} for _, _, rows in shards])
+    except Exception:
+        flight.release()
+        slot.release()
+        raise
+    return {'job_id': job.pk,
+            'owner_id': job.owner_id,
+            'task_id': job.task_id,
+            'file_path': job.file_path,
+            'leases': [flight.key, slot.key],
+            'other_names': other_names,
+            'shards': shards}
+
+
+def plan_leases(plan) -> list:
+    """Return the leases held by the job of a plan."""
+    return [Lease(key, plan['task_id']) for key in plan['leases']]
+
+
+def release_planning_slot(plan):
+    """
+    Release the slot taken by begin_export, for shards written by tasks of
+    their own to take one each. Returns the plan holding the flight lease.
+    """
+    flight_key, slot_key = plan['leases']
+    Lease(slot_key, plan['task_id']).release()
+    return {**plan, 'leases': [flight_key]}
+
+
+def acquire_shard_slot(plan, index: int) -> Lease:
+    """
+    Return a taken export slot of the plan's owner for a shard. Raises
+    ExportSlotsFull when no slot is free, renewing the plan's leases.
+    """
+    try:
+        return acquire_slot(plan['owner_id'], f"{plan['task_id']}:{index}")
+    except ExportSlotsFull:
+        for lease in plan_leases(plan):
+            lease.renew(force=True)
+        raise
+
+
+def progress_key(job_id: int, index: int) -> str:
+    """Return cache key of the progress of a running shard."""
+    return f'exports:progress:{job_id}:{index}'
+
+
+def report_shard(plan, index: int, written: int, done: bool = False) -> None:
+    """
+    Record rows written by a shard. Shards read their rows in a
+    transaction, so the progress of a running shard is kept in the cache
+    and the job's progress is updated when the shard is done.
+    """
+    progress = {'rows': plan['shards'][index][2], 'written': written, 'done': done}
+    key = progress_key(plan['job_id'], index)
+    if not done:
+        cache.set(key, progress, settings.CALCULATOR_EXPORT_LEASE)
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(PROGRESS_SQL, [[str(index)], json.dumps(progress), plan['job_id']])
+    cache.delete(key)
+
+
+def job_progress(job) -> list:
+    """Return progress of every shard of a job, with rows written by running shards."""
+    keys = [progress_key(job.pk, index) for index in range(len(job.progress))]
+    running = cache.get_many(keys)
+    return [running.get(key, shard) for key, shard in zip(keys, job.progress)]
+
+
+def write_export_shard(plan, index: int, slot: Lease = None) -> int:
+    """
+    Write the rows of a shard of an export to its own file, the first shard
+    with the header, renewing the plan's leases and the shard's own slot.
+    Returns the number of written rows.
+    """
+    job = ExportJob.objects.select_related('owner').get(pk=plan['job_id'])
+    first_id, last_id, _ = plan['shards'][index]
+    leases = plan_leases(plan) + ([slot] if slot is not None else [])
+    chunk_size = settings.CALCULATOR_EXPORT_CHUNK_SIZE
+    written = 0
+    os.makedirs(os.path.dirname(job.file_path), exist_ok=True)
+    with open(shard_path(job.file_path, index), 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        if index == 0:
+            writer.writerow(product_field_names() + plan['other_names'])
+        for row_data in iter_product_rows(job.owner, plan['other_names'], chunk_size,
+                                          first_id, last_id):
+            writer.writerow(row_data)
+            written += 1
+            if written % chunk_size == 0:
+                for lease in leases:
+                    lease.renew()
+                report_shard(plan, index, written)
+    report_shard(plan, index, written, done=True)
+    return written
+
+
+def write_slotted_shard(plan, index: int) -> int:
+    """
+    Write a shard of an export in a slot of its own, returns the number of
+    written rows. Raises ExportSlotsFull like acquire_shard_slot.
+    """
+    slot = acquire_shard_slot(plan, index)
+    try:
+        return write_export_shard(plan, index, slot)
+    finally:
+        slot.release()
+
+
+def merge_export_shards(plan) -> str:
+    """
+    Append the shard files of an export to the first one in order, then
+    publish it under the job's path and release the job's leases. Returns
+    the path.
+    """
+    file_path = plan['file_path']
+    first_path = shard_path(file_path, 0)
+    with open(first_path, 'ab') as destination:
+        for index in range(1, len(plan['shards'])):
+            with open(shard_path(file_path, index), 'rb') as source:
+                shutil.copyfileobj(source, destination, MERGE_BUFFER_SIZE)
+            remove_file(shard_path(file_path, index))
+    os.replace(first_path, file_path)
+    ExportJob.objects.filter(pk=plan['job_id']).update(status=ExportJob.Status.SUCCESS,
+                                                       size=os.path.getsize(file_path),
+                                                       expires_at=expiry())
+    # Identical requests find the finished job from now on.
+    for lease in plan_leases(plan):
+        lease.release()
+    return file_path
+
+
+def fail_export(plan) -> None:
+    """Mark an export failed, delete its shard files and release its leases."""
+    ExportJob.objects.filter(pk=plan['job_id']).update(status=ExportJob.Status.FAILURE)
+    for index in range(len(plan['shards'])):
+        remove_file(shard_path(plan['file_path'], index))
+    for lease in plan_leases(plan):
+        lease.release()
+
+
+def write_export(job_id: int) -> str:
+    """
+    Write the file of an export job shard by shard in this process,
+    returns its path. Raises ExportSlotsFull like begin_export.
+    """
+    plan = begin_export(job_id)
+    if plan is None:
+        return ExportJob.objects.get(pk=job_id).file_path
+    return write_shards(plan)
+
+
+def write_shards(plan) -> str:
+    """Write and merge the shards of an export one after another, returns its path."""
+    try:
+        for index in range(len(plan['shards'])):
+            write_export_shard(plan, index)
+        return merge_export_shards(plan)
+    except Exception:
+        fail_export(plan)
+        raise
+
+
+def renew_export_leases() -> int:
+    """
+    Renew the flight leases of running exports, whose shards may wait in
+    the queue longer than a lease, returns the number of exports. Exports
+    running for longer than settings.CALCULATOR_EXPORT_TIMEOUT are left to
+    expire.
+    """
+    since = timezone.now() - timedelta(seconds=settings.CALCULATOR_EXPORT_TIMEOUT)
+    jobs = (ExportJob.objects.
+            filter(status=ExportJob.Status.RUNNING, created_at__gt=since).
+            only('owner_id', 'fingerprint', 'task_id'))
+    renewed = 0
+    for job in jobs.iterator():
+        flight_lease(job).renew(force=True)
+        renewed += 1
+    return renewed
+
+
+def remove_file(file_path: str) -> None:
+    """Delete a file unless it's gone already."""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def purge_expired_exports() -> int:
+    """
+    Delete expired export jobs with their files, and files left without a
+    job for longer than the export lifetime, e.g. of deleted users.
+    Returns the number of deleted jobs and stray files.
+    """
+    deleted = 0
+    now = timezone.now()
+    for job in ExportJob.objects.filter(expires_at__lte=now).only('file_path').iterator():
+        # Skipped when it was reused meanwhile.
+        if ExportJob.objects.filter(pk=job.pk, expires_at__lte=now).delete()[0]:
+            for path in glob.glob(glob.escape(job.file_path) + '*'):
+                remove_file(path)
+            deleted += 1
+
+    if not os.path.isdir(settings.CALCULATOR_EXPORT_ROOT):
+        return deleted
+    oldest = time.time() - settings.CALCULATOR_EXPORT_TTL
+    old_paths = [entry.path for entry in os.scandir(settings.CALCULATOR_EXPORT_ROOT)
+                 if file_mtime(entry) < oldest]
+    kept = set(ExportJob.objects.
+               filter(file_path__in=[PARTIAL_RE.sub('', path) for path in old_paths]).
+               values_list('file_path', flat=True))
+    for path in old_paths:
+        if PARTIAL_RE.sub('', path) not in kept:
+            remove_file(path)
+            deleted += 1
+    return deleted
+
+
+def file_mtime(entry) -> float:
+    """Return modification time of a directory entry, infinity when it's gone."""
+    try:
+        return entry.stat().st_mtime
+    except FileNotFoundError:
+        return float('inf')
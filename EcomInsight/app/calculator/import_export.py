@@ -1,36 +1,292 @@
 import csv
-from .api_queries import get_all_items_for_auth_user
-from .models import ProductInformation
+import io
+import os
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from .caching import items_cache
+from .models import AdditionalField, ProductInformation
+from .other_fields import add_field_ids, new_field
+from .repricing import reprice_batch
+from .schema import INTERNAL_FIELDS, OUTPUT_FIELDS
+from .serializers import CreateProductSerializer
+
+# Flush streamed CSV output in pieces of about this many characters.
+CSV_BUFFER_SIZE = 64 * 1024
+
+# Exported columns that are assigned or calculated on import, not read.
+IGNORED_IMPORT_COLUMNS = {'id', 'created_at', 'product_owner', *OUTPUT_FIELDS}
+
+PRODUCTS = ProductInformation._meta.db_table
+
+# Additional field values are exported with the places of their column.
+VALUE_PLACES = Decimal(1).scaleb(-AdditionalField._meta.get_field('value').decimal_places)
+
+
+def product_field_names():
+    """Return names of product columns in CSV order."""
+    return [field.name for field in ProductInformation._meta.get_fields()
+            if field.name != 'other_fields' and field.name not in INTERNAL_FIELDS]
+
+
+def additional_field_names(user):
+    """Return distinct names of additional fields of user's products."""
+    return list(AdditionalField.objects.
+                filter(product_owner=user, field_name__isnull=False).
+                values_list('field_name', flat=True).
+                distinct().
+                order_by('field_name'))
+
+
+def iter_csv_rows(user, chunk_size=None):
+    """
+    Yield CSV header and one row per product of user. The header and the
+    rows are read in one REPEATABLE READ transaction, so the header has
+    the additional fields of exactly the exported rows. Inside a caller's
+    transaction they share its isolation level instead.
+    """
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if outermost:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        field_names = product_field_names()
+        other_names = additional_field_names(user)
+        yield field_names + other_names
+        yield from iter_product_rows(user, other_names, chunk_size)
+
+
+def iter_product_rows(user, other_names, chunk_size=None, first_id=None, last_id=None):
+    """
+    Yield one CSV row per product of user, with ids from first_id up to
+    but excluding last_id when given, and values of the additional fields
+    other_names. Products are read in id order through a server-side
+    cursor, so memory is bounded by chunk size. The cursor is read in a
+    transaction: outside of one it's declared WITH HOLD, and Postgres
+    computes all rows before returning the first.
+    """
+    chunk_size = chunk_size or settings.CALCULATOR_EXPORT_CHUNK_SIZE
+    field_names = product_field_names()
+    # Every product belongs to user, so the owner column is the same for all rows.
+    columns = [name for name in field_names if name != 'product_owner']
+    owner_index = field_names.index('product_owner')
+    products = ProductInformation.objects.filter(product_owner=user)
+    if first_id is not None:
+        products = products.filter(id__gte=first_id)
+    if last_id is not None:
+        products = products.filter(id__lt=last_id)
+    rows = (products.
+            order_by('id').
+            values_list(*columns, 'other_fields').
+            iterator(chunk_size=chunk_size))
+
+    with transaction.atomic():
+        for row in rows:
+            row_data = list(row[:-1])
+            row_data.insert(owner_index, user)
+            additional_data = {field['field_name']: field['value'] for field in row[-1]}
+            row_data.extend(export_value(additional_data.get(name)) for name in other_names)
+            yield row_data
+
+
+def export_value(value):
+    """Format additional field value for CSV, missing values as empty cells."""
+    if value is None:
+        return ''
+    return Decimal(value).quantize(VALUE_PLACES)
+
+
+def iter_csv(user, chunk_size=None):
+    """Yield CSV text of user's products in pieces of bounded size."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row_data in iter_csv_rows(user, chunk_size):
+        writer.writerow(row_data)
+        if buffer.tell() >= CSV_BUFFER_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
 
 
 def write_to_csv(user, file_path):
     """
     Write authorised user's products to CSV file.
     """
-    # Fetch products and prefetch related fields
-    products = get_all_items_for_auth_user(user)
-    additional_field_names = set()
-    for product in products:
-        for field in product.other_fields.all():
-            additional_field_names.add(field.field_name)
-
-    # Prepare file path for CSV
     with open(file_path, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
+        for data in iter_csv(user):
+            csvfile.write(data)
+
 
-        # Write CSV headers
-        field_names = [field.name for field in ProductInformation._meta.get_fields() if field.name != 'other_fields']
-        writer.writerow(field_names + list(additional_field_names))
+def copy_value(value) -> str:
+    """Format value for COPY text format."""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t').
+            replace('\n', '\\n').replace('\r', '\\r'))
 
-        # Write data rows
-        for product in products:
-            row_data = [getattr(product, field) for field in field_names]
 
-            # Dynamically add additional field data
-            additional_data = {field.field_name: field.value for field in product.other_fields.all()}
-            for field_name in additional_field_names:
-                row_data.append(additional_data.get(field_name, ''))
+def copy_rows(cursor, table: str, columns: list, rows) -> None:
+    """COPY rows into table."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(map(copy_value, row)))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', buffer)
+
+
+def load_products(user_id: int, products: list, fields: list) -> tuple:
+    """
+    Insert validated products with their additional fields of one chunk.
+    Rows are copied into a temporary staging table, then inserted and
+    repriced with set-based statements. Products whose sku is already used
+    are skipped. Every row gets its own creation time, as rows sharing one
+    would be paged by offset. Returns number of inserted products and
+    indexes of skipped ones.
+    """
+    if not products:
+        return 0, []
+
+    columns = {name: ProductInformation._meta.get_field(name) for name in fields}
+    with transaction.atomic(), connection.cursor() as cursor:
+        definitions = ', '.join(f'{field.column} {field.db_type(connection)}'
+                                for field in columns.values())
+        cursor.execute(f"""
+            CREATE TEMPORARY TABLE import_products (
+                row_number integer PRIMARY KEY,
+                id bigint NOT NULL DEFAULT nextval(pg_get_serial_sequence('{PRODUCTS}', 'id')),
+                other_fields jsonb NOT NULL,
+                {definitions}
+            ) ON COMMIT DROP;
+        """)
+        documents = add_field_ids([[new_field(field) for field in product.get('other_fields', [])]
+                                   for product in products])
+        document_field = ProductInformation._meta.get_field('other_fields')
+        copy_rows(cursor.cursor, 'import_products',
+                  ['row_number', 'other_fields', *(field.column for field in columns.values())],
+                  ([number, document_field.get_prep_value(document),
+                    *(product.get(name) for name in fields)]
+                   for number, (product, document) in enumerate(zip(products, documents))))
+
+        cursor.execute(f"""
+            DELETE FROM import_products s
+            WHERE s.sku IS NOT NULL AND (
+                EXISTS (SELECT 1 FROM {PRODUCTS} p
+                        WHERE p.product_owner_id = %(user_id)s AND p.sku = s.sku)
+                OR EXISTS (SELECT 1 FROM import_products d
+                           WHERE d.sku = s.sku AND d.row_number < s.row_number))
+            RETURNING row_number
+        """, {'user_id': user_id})
+        skipped = [row_number for row_number, in cursor.fetchall()]
+
+        column_list = ', '.join(['other_fields', *(field.column for field in columns.values())])
+        cursor.execute(f"""
+            INSERT INTO {PRODUCTS} (id, created_at, updated_at, product_owner_id, {column_list})
+            SELECT id, clock_timestamp(), clock_timestamp(), %(user_id)s, {column_list}
+            FROM import_products
+            ORDER BY row_number
+        """, {'user_id': user_id})
+        cursor.execute('SELECT id FROM import_products')
+        product_ids = [product_id for product_id, in cursor.fetchall()]
+
+        # Dropped here too as the chunk may run in an outer transaction.
+        cursor.execute('DROP TABLE import_products')
+
+        reprice_batch(0, len(product_ids), product_ids=product_ids)
+        items_cache.invalidate(user_id)
+    return len(product_ids), skipped
+
+
+def parse_import_row(row: dict, fields: list) -> dict:
+    """Map CSV row to CreateProductSerializer input, empty cells are omitted."""
+    data = {}
+    other_fields = []
+    for column, value in row.items():
+        if column is None or column in IGNORED_IMPORT_COLUMNS or value in (None, ''):
+            continue
+        if column in fields:
+            data[column] = value
+        else:
+            other_fields.append({'field_name': column, 'value': value})
+    if other_fields:
+        data['other_fields'] = other_fields
+    return data
+
+
+def iter_import_chunks(csvfile, chunk_size: int):
+    """Yield lists of (line number, row) read from an open CSV file."""
+    reader = csv.DictReader(csvfile)
+    rows = ((reader.line_num, row) for row in reader)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_owner_key(task_id: str) -> str:
+    """Return cache key of the owner of an import task."""
+    return f'imports:owner:{task_id}'
+
+
+def register_import(user_id: int, task_id: str) -> None:
+    """Record the owner of an import task, before the task is started."""
+    cache.set(import_owner_key(task_id), user_id, settings.CALCULATOR_IMPORT_TTL)
+
+
+def import_owner(task_id: str):
+    """Return id of the user who started an import task, None for unknown tasks."""
+    return cache.get(import_owner_key(task_id))
+
+
+def add_error(report: dict, line: int, errors) -> None:
+    """Count failed row, keeping its errors up to the configured maximum."""
+    report['failed'] += 1
+    if len(report['errors']) < settings.CALCULATOR_IMPORT_MAX_ERRORS:
+        report['errors'].append({'line': line, 'errors': errors})
+
+
+def import_from_csv(user_id: int, file_path: str, chunk_size=None, on_progress=None) -> dict:
+    """
+    Import products from CSV file in chunks.
+    Columns named after product fields are read into them, other columns
+    become additional fields. Rows are validated like CreateProductSerializer
+    input; invalid rows are skipped and reported with their line number.
+    Every chunk is committed separately and reported to on_progress.
+    """
+    chunk_size = chunk_size or settings.CALCULATOR_IMPORT_CHUNK_SIZE
+    validator = CreateProductSerializer()
+    fields = [name for name, field in validator.fields.items()
+              if name != 'other_fields' and not field.read_only]
+    report = {'processed': 0, 'imported': 0, 'failed': 0, 'errors': [],
+              'bytes_read': 0, 'bytes_total': 0}
 
-            writer.writerow(row_data)
+    with open(file_path, 'rb') as binary:
+        report['bytes_total'] = os.fstat(binary.fileno()).st_size
+        csvfile = io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+        for chunk in iter_import_chunks(csvfile, chunk_size):
+            lines = []
+            products = []
+            for line, row in chunk:
+                try:
+                    products.append(validator.run_validation(parse_import_row(row, fields)))
+                    lines.append(line)
+                except ValidationError as error:
+                    add_error(report, line, error.detail)
 
-# TODO: Change the order of the fields in the CSV file.
+            imported, skipped = load_products(user_id, products, fields)
+            report['imported'] += imported
+            for index in skipped:
+                add_error(report, lines[index], {'sku': ['Product with this sku already exists.']})
+            report['processed'] += len(chunk)
+            report['bytes_read'] = binary.tell()
+            if on_progress:
+                on_progress(report)
+    return report
@@ -0,0 +1,116 @@
+"""
+Django command to benchmark sequential and sharded CSV exports.
+Rows are committed, for worker processes to read them, and deleted at the end.
+"""
+import filecmp
+import multiprocessing
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import override_settings
+
+from calculator.exports import (begin_export, merge_export_shards, release_planning_slot,
+                                remove_file, start_export, write_export, write_slotted_shard)
+from calculator.models import ExportJob, ProductTombstone
+from calculator.other_fields import FIELD_ID_SEQUENCE
+
+SEED_SQL = f"""
+    INSERT INTO calculator_productinformation
+        (name, sku, created_at, updated_at, product_owner_id, quantity, margin_percent,
+         buying_price, transportation, packaging, warehouse,
+         marketplace_commission_percent, other_fields)
+    SELECT 'Product ' || i, 'SKU-' || i, now(), now(), %(owner)s,
+           i %% 100, 25, 10 + i %% 500, 5, 10, 20, 6,
+           jsonb_build_array(
+               jsonb_build_object('id', nextval('{FIELD_ID_SEQUENCE}'),
+                                  'field_name', 'advertising', 'value', (i %% 1000) / 100.0),
+               jsonb_build_object('id', nextval('{FIELD_ID_SEQUENCE}'),
+                                  'field_name', 'storage', 'value', (i %% 300) / 10.0))
+    FROM generate_series(1, %(rows)s) AS i
+"""
+
+
+class Command(BaseCommand):
+    """Django command to benchmark sharded exports written by local workers."""
+
+    help = 'Seed products, then export them in one process and in shards written by worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--slots', type=int, default=settings.CALCULATOR_EXPORT_USER_CONCURRENCY,
+                            help="Export slots of the user, which cap the shards, "
+                                 "by default CALCULATOR_EXPORT_USER_CONCURRENCY.")
+        parser.add_argument('--shard-rows', type=int, default=settings.CALCULATOR_EXPORT_SHARD_ROWS,
+                            help='Minimum rows per shard, by default CALCULATOR_EXPORT_SHARD_ROWS.')
+
+    def seed(self, rows):
+        """Create benchmark user and its products."""
+        user = get_user_model().objects.create(email='export-benchmark@example.com')
+        with connection.cursor() as cursor:
+            cursor.execute(SEED_SQL, {'owner': user.pk, 'rows': rows})
+            cursor.execute('ANALYZE calculator_productinformation')
+        return user
+
+    def new_job(self, user):
+        """Return a new export job of user, deleting earlier ones."""
+        for job in ExportJob.objects.filter(owner=user):
+            remove_file(job.file_path)
+            job.delete()
+        return start_export(user, lambda job: None)[0]
+
+    def sequential(self, user, rows):
+        """Export user's products in one shard in this process, returns the file path."""
+        with override_settings(CALCULATOR_EXPORT_SHARD_ROWS=rows):
+            return write_export(self.new_job(user).pk)
+
+    def sharded(self, user, workers):
+        """
+        Export user's products in shards written by a pool of worker
+        processes, each taking one of the user's slots like shard tasks.
+        """
+        plan = release_planning_slot(begin_export(self.new_job(user).pk))
+        # Forked workers open their own connections.
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            pool.starmap(write_slotted_shard, [(plan, index) for index in range(len(plan['shards']))])
+        return merge_export_shards(plan), len(plan['shards'])
+
+    def handle(self, *args, **options):
+        rows, workers = options['rows'], options['workers']
+        start = time.perf_counter()
+        user = self.seed(rows)
+        self.stdout.write(f'Seeded {rows:,} rows in {time.perf_counter() - start:.1f}s.\n')
+        try:
+            start = time.perf_counter()
+            sequential_path = self.sequential(user, rows)
+            sequential = time.perf_counter() - start
+            sequential_copy = f'{sequential_path}.sequential'
+            os.replace(sequential_path, sequential_copy)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'sequential: {sequential:.2f}s, {rows / sequential:,.0f} rows/s'))
+
+            with override_settings(CALCULATOR_EXPORT_SHARD_ROWS=options['shard_rows'],
+                                   CALCULATOR_EXPORT_USER_CONCURRENCY=options['slots']):
+                start = time.perf_counter()
+                sharded_path, shards = self.sharded(user, workers)
+                sharded = time.perf_counter() - start
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{shards} shards, {workers} workers, {options["slots"]} slots: '
+                f'{sharded:.2f}s, {rows / sharded:,.0f} rows/s'))
+            self.stdout.write(f'Speedup: {sequential / sharded:.2f}x, '
+                              f'size {os.path.getsize(sharded_path) / 2 ** 20:.1f} MiB')
+            if not filecmp.cmp(sequential_copy, sharded_path, shallow=False):
+                self.stdout.write(self.style.ERROR('Sharded file differs from the sequential one.'))
+            remove_file(sequential_copy)
+        finally:
+            for job in ExportJob.objects.filter(owner=user):
+                remove_file(job.file_path)
+            user_id = user.pk
+            user.delete()
+            ProductTombstone.objects.filter(product_owner_id=user_id).delete()
+            self.stdout.write(self.style.SUCCESS('Seeded rows and exports deleted.'))
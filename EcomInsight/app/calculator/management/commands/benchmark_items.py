@@ -0,0 +1,118 @@
+"""
+Django command to benchmark latency of item list, create and update requests.
+Rows are seeded inside a transaction that is rolled back at the end.
+"""
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from calculator.bulk import bulk_create_products
+from calculator.caching import items_cache
+from calculator.serializers import ProductInfoSerializer
+from calculator.views import ItemsViewSet
+
+
+class Rollback(Exception):
+    """Raised to discard seeded rows."""
+
+
+def additional_fields(count: int, offset: int = 0) -> list:
+    """Return additional fields of a benchmark product."""
+    return [{'field_name': f'field_{j}', 'value': str(offset + j)} for j in range(count)]
+
+
+class Command(BaseCommand):
+    """Django command to time item requests through the views."""
+
+    help = 'Seed products with additional fields, then time list, create and update requests.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--fields', type=int, default=5,
+                            help='Additional fields per product.')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests timed per kind.')
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def seed(self, rows, fields):
+        """Create benchmark user with products and additional fields."""
+        user = get_user_model().objects.create(email='items-benchmark@example.com')
+        items = [{'name': f'Product {i}', 'sku': f'SKU-{i}', 'quantity': i % 100,
+                  'margin_percent': '25', 'buying_price': '50', 'transportation': '5',
+                  'marketplace_commission_percent': '6',
+                  'other_fields': additional_fields(fields, i % 10)}
+                 for i in range(rows)]
+        products = []
+        for start in range(0, rows, settings.CALCULATOR_BULK_MAX_ITEMS):
+            products.extend(bulk_create_products(
+                user, items[start:start + settings.CALCULATOR_BULK_MAX_ITEMS], {}))
+        return user, products
+
+    def measure(self, label, send, requests, before=None):
+        """Print latency percentiles and queries per request of send(index)."""
+        timings = []
+        queries = 0
+        for index in range(requests):
+            if before:
+                before()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = send(index)
+                timings.append(time.perf_counter() - start)
+            queries += len(captured)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{label} failed: {response.status_code} {response.data}')
+        timings.sort()
+        self.stdout.write(f'{label}: mean {statistics.mean(timings) * 1000:.2f} ms, '
+                          f'p50 {timings[len(timings) // 2] * 1000:.2f} ms, '
+                          f'p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} ms, '
+                          f'{queries / requests:.1f} queries')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        requests = options['requests']
+        fields = options['fields']
+        factory = APIRequestFactory()
+        list_view = ItemsViewSet.as_view({'get': 'list', 'post': 'create'})
+        detail_view = ItemsViewSet.as_view({'patch': 'partial_update'})
+        url = reverse('calculator:item-list')
+
+        def send(view, request, **kwargs):
+            force_authenticate(request, user=user)
+            return view(request, **kwargs)
+
+        try:
+            # Requests are built by the test request factory.
+            with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+                user, products = self.seed(rows, fields)
+                field_ids = [ProductInfoSerializer(product).data['other_fields'][0]['id']
+                             for product in products]
+
+                self.measure(
+                    f'list {options["page_size"]} items',
+                    lambda index: send(list_view, factory.get(url, {'page_size': options['page_size']})),
+                    requests, before=lambda: items_cache.invalidate(user.pk))
+                self.measure(
+                    'create item',
+                    lambda index: send(list_view, factory.post(url, {
+                        'name': f'New {index}', 'quantity': 1, 'buying_price': '10',
+                        'margin_percent': '25', 'other_fields': additional_fields(fields)},
+                        format='json')),
+                    requests)
+                self.measure(
+                    'update item',
+                    lambda index: send(detail_view, factory.patch(url, {
+                        'name': f'Renamed {index}',
+                        'other_fields': [{'id': field_ids[index % rows], 'value': str(index)}]},
+                        format='json'), pk=products[index % rows].pk),
+                    requests)
+                raise Rollback
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('Seeded rows rolled back.'))
@@ -0,0 +1,86 @@
+"""
+Django command to benchmark serialization of item lists.
+Rows are seeded inside a transaction that is rolled back at the end.
+"""
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from calculator.api_queries import get_all_items_for_auth_user
+from calculator.listing import ITEM_FIELDS, product_values, serialize_items
+from calculator.models import ProductInformation
+from calculator.other_fields import add_field_ids
+from calculator.repricing import reprice_products
+from calculator.serializers import ProductInfoSerializer
+
+
+class Rollback(Exception):
+    """Raised to discard seeded rows."""
+
+
+class Command(BaseCommand):
+    """Django command to compare the serializer and values() list paths."""
+
+    help = 'Seed products, then render them as JSON with both list paths.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000,
+                            help='Products rendered per list, like one page.')
+        parser.add_argument('--fields', type=int, default=5,
+                            help='Additional fields per product.')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def seed(self, rows, fields):
+        """Create benchmark user with products and additional fields."""
+        user = get_user_model().objects.create(email='list-benchmark@example.com')
+        documents = add_field_ids([[{'field_name': f'field_{j}', 'value': Decimal(j)}
+                                    for j in range(fields)]
+                                   for _ in range(rows)])
+        ProductInformation.objects.bulk_create(
+            ProductInformation(name=f'Product {i}', sku=f'SKU-{i}', product_owner=user,
+                               quantity=i % 100, margin_percent=25, buying_price=50,
+                               transportation=5, packaging=10, warehouse=20,
+                               marketplace_commission_percent=6, other_fields=document)
+            for i, document in enumerate(documents))
+        reprice_products(user.pk)
+        return user
+
+    def measure(self, label, render, rows, repeat):
+        """Print average time and rows per second of render()."""
+        content = render()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            render()
+        elapsed = (time.perf_counter() - start) / repeat
+        self.stdout.write(f'{label}: {elapsed * 1000:.1f} ms, {rows / elapsed:,.0f} rows/s, '
+                          f'{len(content):,} bytes')
+        return content
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        repeat = options['repeat']
+        renderer = JSONRenderer()
+        try:
+            with transaction.atomic():
+                user = self.seed(rows, options['fields'])
+                queryset = get_all_items_for_auth_user(user.pk).order_by('created_at', 'id')
+
+                serializer = self.measure(
+                    'ProductInfoSerializer',
+                    lambda: renderer.render(ProductInfoSerializer(queryset.all(), many=True).data),
+                    rows, repeat)
+                values = self.measure(
+                    'values() rows',
+                    lambda: renderer.render(serialize_items(
+                        list(queryset.prefetch_related(None).values(*product_values(ITEM_FIELDS))))),
+                    rows, repeat)
+
+                if serializer != values:
+                    self.stderr.write('Rendered JSON differs.')
+                raise Rollback
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('Seeded rows rolled back.'))
@@ -0,0 +1,101 @@
+"""
+Django command to compare per-product and batch pricing throughput.
+"""
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from calculator.services import (BatchCalculator, Calculator,
+                                 FixedPointCalculator, UserInputHandler)
+
+SUM_FIELDS = ['buying_price', 'transportation', 'packaging', 'warehouse']
+PERCENT_FIELDS = ['marketplace_commission_percent']
+
+
+def random_decimal(rng, low, high):
+    """Return random Decimal with 4 decimal places."""
+    return Decimal(rng.randint(low * 10000, high * 10000)).scaleb(-4)
+
+
+class Command(BaseCommand):
+    """Django command to benchmark pricing calculations."""
+
+    help = ('Compare rows per second of Calculator, FixedPointCalculator '
+            'and BatchCalculator.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def generate_rows(self, rows, seed):
+        """Generate random calculator inputs."""
+        rng = random.Random(seed)
+        data = []
+        for _ in range(rows):
+            row = {field: random_decimal(rng, 0, 500) for field in SUM_FIELDS}
+            row.update({field: random_decimal(rng, 0, 30) for field in PERCENT_FIELDS})
+            row['margin_percent'] = random_decimal(rng, -20, 200)
+            row['other_fields'] = [
+                {'field_name': 'advertising', 'value': random_decimal(rng, 0, 50)},
+                {'field_name': 'tax_percent', 'value': random_decimal(rng, 0, 20)},
+            ]
+            data.append(row)
+        return data
+
+    def run_scalar(self, rows):
+        """Calculate rows one at a time."""
+        results = []
+        for row in rows:
+            lists = UserInputHandler(row).parse_user_input()
+            calculate = Calculator(sum_values=lists.sum_values,
+                                   percent_values=lists.percent_values,
+                                   user_input=row)
+            expenses = calculate.get_total_expenses()
+            recommended_price = calculate.get_recommended_price(expenses)
+            net_profit = calculate.get_net_profit(expenses, recommended_price)
+            results.append((expenses, recommended_price, net_profit))
+        return results
+
+    def run_fixed_point(self, rows):
+        """Calculate rows one at a time in integer cents."""
+        return [tuple(FixedPointCalculator(row).get_totals()) for row in rows]
+
+    def run_batch(self, rows):
+        """Calculate all rows in one vectorized pass."""
+        columns = {field: [row[field] for row in rows]
+                   for field in SUM_FIELDS + PERCENT_FIELDS + ['margin_percent']}
+        for index, name in enumerate(['advertising', 'tax_percent']):
+            columns[name] = [row['other_fields'][index]['value'] for row in rows]
+        return BatchCalculator(columns).calculate()
+
+    def report(self, label, rows, seconds):
+        self.stdout.write(f'{label}: {rows / seconds:,.0f} rows/s ({seconds:.3f}s)')
+
+    def handle(self, *args, **options):
+        rows = self.generate_rows(options['rows'], options['seed'])
+
+        start = time.perf_counter()
+        scalar = self.run_scalar(rows)
+        scalar_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fixed_point = self.run_fixed_point(rows)
+        fixed_point_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = self.run_batch(rows)
+        batch_time = time.perf_counter() - start
+
+        if scalar != fixed_point:
+            raise CommandError('Fixed point results differ from Calculator results.')
+        if scalar != list(zip(*batch)):
+            raise CommandError('Batch results differ from Calculator results.')
+
+        self.report('Calculator', len(rows), scalar_time)
+        self.report('FixedPointCalculator', len(rows), fixed_point_time)
+        self.report('BatchCalculator', len(rows), batch_time)
+        self.stdout.write(self.style.SUCCESS(
+            f'Speedup: fixed point {scalar_time / fixed_point_time:.1f}x, '
+            f'batch {scalar_time / batch_time:.1f}x, results match.'))
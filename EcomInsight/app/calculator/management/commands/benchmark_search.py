@@ -0,0 +1,101 @@
+"""
+Django command to benchmark product search on a seeded catalog.
+Rows are seeded inside a transaction that is rolled back at the end.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from calculator.api_queries import get_items_by_name, get_items_by_sku, search_items
+
+ADJECTIVES = ['Red', 'Blue', 'Green', 'Black', 'White', 'Large', 'Small',
+              'Cotton', 'Leather', 'Wooden', 'Steel', 'Vintage']
+NOUNS = ['Shirt', 'Mug', 'Lamp', 'Chair', 'Table', 'Wallet', 'Backpack',
+         'Bottle', 'Jacket', 'Notebook', 'Pillow', 'Watch']
+
+SEED_SQL = """
+    INSERT INTO calculator_productinformation
+        (name, sku, created_at, updated_at, product_owner_id, quantity, margin_percent,
+         buying_price, transportation, packaging, warehouse,
+         marketplace_commission_percent)
+    SELECT (%(adjectives)s::text[])[1 + i %% %(adjective_count)s] || ' ' ||
+           (%(nouns)s::text[])[1 + (i / %(adjective_count)s) %% %(noun_count)s] ||
+           ' ' || i,
+           'SKU-' || i,
+           now() - i * interval '1 second',
+           now() - i * interval '1 second',
+           (%(owners)s::bigint[])[1 + (i / %(combinations)s) %% %(owner_count)s],
+           i %% 100, 25, 50, 5, 10, 20, 6
+    FROM generate_series(1, %(rows)s) AS i
+"""
+
+
+class Rollback(Exception):
+    """Raised to discard seeded rows."""
+
+
+class Command(BaseCommand):
+    """Django command to benchmark trigram and sku search."""
+
+    help = 'Seed products, then EXPLAIN ANALYZE owner-scoped search queries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=3_000_000)
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def seed(self, rows, users):
+        """Create benchmark users and their products."""
+        owners = get_user_model().objects.bulk_create(
+            get_user_model()(email=f'search-benchmark-{i}@example.com')
+            for i in range(users))
+        owner_ids = [owner.pk for owner in owners]
+        with connection.cursor() as cursor:
+            cursor.execute(SEED_SQL, {'adjectives': ADJECTIVES,
+                                      'adjective_count': len(ADJECTIVES),
+                                      'nouns': NOUNS,
+                                      'noun_count': len(NOUNS),
+                                      'owners': owner_ids,
+                                      'owner_count': len(owner_ids),
+                                      # Every owner gets every name combination.
+                                      'combinations': len(ADJECTIVES) * len(NOUNS),
+                                      'rows': rows})
+            cursor.execute('ANALYZE calculator_productinformation')
+        return owner_ids
+
+    def measure(self, label, queryset, repeat):
+        """Print query plan and average latency of the first page of 100 rows."""
+        page = queryset[:100]
+        plan = page.explain(analyze=True, buffers=True)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            list(page.all())
+        elapsed = (time.perf_counter() - start) / repeat
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{label}: {elapsed * 1000:.2f} ms'))
+        self.stdout.write(plan)
+        used = [index for index in ('product_name_trgm_idx', 'product_owner_sku_unique')
+                if index in plan]
+        self.stdout.write(f'Indexes used: {", ".join(used) or "none"}\n')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            with transaction.atomic():
+                owner = self.seed(options['rows'], options['users'])[0]
+                self.stdout.write(f'Seeded {options["rows"]:,} rows for {options["users"]} '
+                                  f'users in {time.perf_counter() - start:.1f}s.\n')
+                repeat = options['repeat']
+                # Order like the paginators do.
+                self.measure('search "blue lamp"',
+                             search_items('blue lamp', owner).order_by('-similarity', 'id'),
+                             repeat)
+                self.measure('name contains "Wallet 12"',
+                             get_items_by_name('Wallet 12', owner).order_by('created_at', 'id'),
+                             repeat)
+                self.measure('sku "SKU-1000"', get_items_by_sku('SKU-1000', owner), repeat)
+                raise Rollback
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('Seeded rows rolled back.'))
@@ -0,0 +1,82 @@
+"""
+Django command to benchmark catalog sync by sku.
+Rows are written inside a transaction that is rolled back at the end.
+"""
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from calculator.sync import sync_products
+
+
+class Rollback(Exception):
+    """Raised to discard synced rows."""
+
+
+def make_feed(rows: int, seed: int = 0) -> list:
+    """Return feed items with distinct skus and some additional fields."""
+    rng = random.Random(seed)
+    return [{'sku': f'SKU-{i}',
+             'name': f'Product {i}',
+             'quantity': rng.randint(0, 100),
+             'buying_price': str(rng.randint(100, 50000) / 100),
+             'transportation': '5',
+             'margin_percent': '25',
+             'marketplace_commission_percent': '6',
+             'other_fields': [{'field_name': 'advertising',
+                               'value': str(rng.randint(0, 1000) / 100)}]}
+            for i in range(rows)]
+
+
+class Command(BaseCommand):
+    """Django command to benchmark initial, repeated and partial syncs."""
+
+    help = 'Sync a generated feed three times and print timings and write counts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000)
+        parser.add_argument('--changed', type=float, default=0.1,
+                            help='Share of items changed before the last sync.')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def measure(self, label, user_id, feed, batch_size):
+        """Sync feed and print elapsed time with the report counts."""
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_xact_user_tables '
+                           "WHERE relname = 'calculator_productinformation'")
+            before = (cursor.fetchone() or [0])[0]
+        start = time.perf_counter()
+        report = sync_products(user_id, iter(feed), batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_xact_user_tables '
+                           "WHERE relname = 'calculator_productinformation'")
+            written = (cursor.fetchone() or [0])[0] - before
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{label}: {elapsed:.1f}s, {len(feed) / elapsed:,.0f} items/s'))
+        self.stdout.write(f'created {report["created"]:,}, updated {report["updated"]:,}, '
+                          f'unchanged {report["unchanged"]:,}, failed {report["failed"]:,}, '
+                          f'product rows written {written:,}\n')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        batch_size = options['batch_size']
+        feed = make_feed(rows)
+        rng = random.Random(1)
+        changed = [dict(item) for item in feed]
+        for item in rng.sample(changed, int(rows * options['changed'])):
+            item['buying_price'] = str(rng.randint(100, 50000) / 100)
+
+        try:
+            with transaction.atomic():
+                user = get_user_model().objects.create(email='sync-benchmark@example.com')
+                self.measure('initial sync', user.pk, feed, batch_size)
+                self.measure('same feed again', user.pk, feed, batch_size)
+                self.measure(f'{options["changed"]:.0%} changed', user.pk, changed, batch_size)
+                raise Rollback
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('Synced rows rolled back.'))
@@ -0,0 +1,34 @@
+"""
+Django command to find and repair drift of catalog summaries.
+"""
+from django.core.management.base import BaseCommand
+
+from calculator.analytics import find_summary_drift, rebuild_summaries
+
+
+class Command(BaseCommand):
+    """Django command to compare catalog summaries with a full aggregate."""
+
+    help = ('Find users whose catalog summary differs from a full aggregate '
+            'of their products, optionally rebuilding them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='Id of the user to check, all users if omitted.')
+        parser.add_argument('--repair', action='store_true',
+                            help='Rebuild summaries that drifted.')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        drifted = find_summary_drift(options['user'], options['batch_size'])
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
+            return
+
+        self.stdout.write(self.style.WARNING(
+            f'{len(drifted)} summaries drifted: {", ".join(map(str, drifted[:20]))}'
+            f'{" ..." if len(drifted) > 20 else ""}'))
+        if options['repair']:
+            for user_id in drifted:
+                rebuild_summaries(user_id)
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(drifted)} summaries.'))
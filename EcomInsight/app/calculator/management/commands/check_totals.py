@@ -0,0 +1,33 @@
+"""
+Django command to find and repair drift of stored product totals.
+"""
+from django.core.management.base import BaseCommand
+
+from calculator.repricing import find_drift, repair_drift
+
+
+class Command(BaseCommand):
+    """Django command to compare stored totals with stored inputs."""
+
+    help = ('Find products whose stored totals differ from a recalculation '
+            'of their stored inputs, optionally repairing them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='Id of the user to check, all users if omitted.')
+        parser.add_argument('--repair', action='store_true',
+                            help='Recalculate totals of drifted products.')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        drifted = find_drift(options['user'], options['batch_size'])
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
+            return
+
+        self.stdout.write(self.style.WARNING(
+            f'{len(drifted)} products drifted: {", ".join(map(str, drifted[:20]))}'
+            f'{" ..." if len(drifted) > 20 else ""}'))
+        if options['repair']:
+            repaired = repair_drift(drifted, options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} products.'))
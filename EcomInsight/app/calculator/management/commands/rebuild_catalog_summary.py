@@ -0,0 +1,31 @@
+"""
+Django command to rebuild catalog summaries from a full aggregate.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from calculator.analytics import rebuild_summaries
+
+
+class Command(BaseCommand):
+    """Django command to rebuild catalog summaries of a user or of all users."""
+
+    help = ('Replace catalog summaries with a full aggregate of the products, '
+            'in batches of users.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='Id of the user to rebuild, all users if omitted.')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        user_id = options['user']
+        if user_id is not None and not get_user_model().objects.filter(pk=user_id).exists():
+            raise CommandError(f'User {user_id} does not exist.')
+
+        start = time.perf_counter()
+        rebuilt = rebuild_summaries(user_id, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rebuilt} summaries in {time.perf_counter() - start:.2f}s.'))
@@ -0,0 +1,31 @@
+"""
+Django command to recalculate stored product totals in the database.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from calculator.repricing import reprice_products
+
+
+class Command(BaseCommand):
+    """Django command to reprice products of a user or of all users."""
+
+    help = ('Recalculate expenses, recommended price and net profit of '
+            'stored products in set-based batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='Id of the user to reprice, all users if omitted.')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        user_id = options['user']
+        if user_id is not None and not get_user_model().objects.filter(pk=user_id).exists():
+            raise CommandError(f'User {user_id} does not exist.')
+
+        start = time.perf_counter()
+        updated = reprice_products(user_id, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Repriced {updated} products in {time.perf_counter() - start:.2f}s.'))
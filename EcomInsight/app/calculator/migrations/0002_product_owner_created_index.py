@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productinformation',
+            index=models.Index(fields=['product_owner', 'created_at', 'id'], name='product_owner_created_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:19
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0002_product_owner_created_index'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='productinformation',
+            index=models.Index(fields=['product_owner', 'sku'], name='product_owner_sku_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinformation',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='product_name_trgm_idx'),
+        ),
+    ]
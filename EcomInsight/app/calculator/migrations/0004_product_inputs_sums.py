@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0003_product_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinformation',
+            name='inputs_percent',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True),
+        ),
+        migrations.AddField(
+            model_name='productinformation',
+            name='inputs_sum',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True),
+        ),
+    ]
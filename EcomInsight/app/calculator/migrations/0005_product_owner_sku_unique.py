@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 04:32
+
+from django.db import migrations, models
+
+# Keep the newest product of every duplicated (owner, sku) as is and suffix
+# the sku of older ones with their id, so no product is lost.
+RENAME_DUPLICATE_SKUS = """
+    UPDATE calculator_productinformation p
+    SET sku = left(p.sku, 200) || '-duplicate-' || p.id
+    FROM (
+        SELECT id, row_number() OVER (PARTITION BY product_owner_id, sku
+                                      ORDER BY id DESC) AS position
+        FROM calculator_productinformation
+        WHERE sku IS NOT NULL
+    ) duplicates
+    WHERE p.id = duplicates.id AND duplicates.position > 1
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0004_product_inputs_sums'),
+    ]
+
+    operations = [
+        migrations.RunSQL(RENAME_DUPLICATE_SKUS, migrations.RunSQL.noop),
+        migrations.RemoveIndex(
+            model_name='productinformation',
+            name='product_owner_sku_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='productinformation',
+            constraint=models.UniqueConstraint(fields=('product_owner', 'sku'), name='product_owner_sku_unique'),
+        ),
+    ]
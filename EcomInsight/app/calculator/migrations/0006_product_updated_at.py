@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0005_product_owner_sku_unique'),
+    ]
+
+    operations = [
+        # Existing rows get the time of the migration, a constant default
+        # that doesn't rewrite the table.
+        migrations.AddField(
+            model_name='productinformation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
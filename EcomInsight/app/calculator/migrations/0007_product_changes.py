@@ -0,0 +1,91 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Stamp inserted and changed products with the writing transaction and keep
+# a tombstone of deleted ones. Updates writing the same values don't count.
+CREATE_TRIGGERS = """
+    CREATE FUNCTION calculator_product_changed() RETURNS trigger AS $$
+    BEGIN
+        NEW.change_txid := txid_current();
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER product_inserted
+    BEFORE INSERT ON calculator_productinformation
+    FOR EACH ROW EXECUTE FUNCTION calculator_product_changed();
+
+    CREATE TRIGGER product_updated
+    BEFORE UPDATE ON calculator_productinformation
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE FUNCTION calculator_product_changed();
+
+    CREATE FUNCTION calculator_product_deleted() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO calculator_producttombstone
+            (product_owner_id, product_id, change_txid, deleted_at)
+        SELECT product_owner_id, id, txid_current(), now()
+        FROM deleted;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER product_deleted
+    AFTER DELETE ON calculator_productinformation
+    REFERENCING OLD TABLE AS deleted
+    FOR EACH STATEMENT EXECUTE FUNCTION calculator_product_deleted();
+"""
+
+DROP_TRIGGERS = """
+    DROP TRIGGER product_deleted ON calculator_productinformation;
+    DROP TRIGGER product_updated ON calculator_productinformation;
+    DROP TRIGGER product_inserted ON calculator_productinformation;
+    DROP FUNCTION calculator_product_deleted();
+    DROP FUNCTION calculator_product_changed();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('calculator', '0006_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.BigIntegerField()),
+                ('change_txid', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='productinformation',
+            name='change_txid',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='productinformation',
+            index=models.Index(fields=['product_owner', 'change_txid', 'id'], name='product_owner_change_idx'),
+        ),
+        migrations.AddField(
+            model_name='producttombstone',
+            name='product_owner',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='producttombstone',
+            index=models.Index(fields=['product_owner', 'change_txid', 'product_id'], name='tombstone_owner_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producttombstone',
+            index=models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
@@ -0,0 +1,172 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Catalog totals summed by the triggers, as column and expression of a
+# changed product row counted with sign 1 when added and -1 when removed.
+SUMMED_COLUMNS = [
+    ('product_count', 'sign'),
+    ('inventory_value', 'sign * COALESCE(quantity, 0) * COALESCE(expenses, 0)'),
+    ('projected_profit', 'sign * COALESCE(quantity, 0) * COALESCE(net_profit, 0)'),
+    ('margin_below_0', 'CASE WHEN margin_percent < 0 THEN sign ELSE 0 END'),
+    ('margin_0_25', 'CASE WHEN margin_percent >= 0 AND margin_percent < 25 THEN sign ELSE 0 END'),
+    ('margin_25_50', 'CASE WHEN margin_percent >= 25 AND margin_percent < 50 THEN sign ELSE 0 END'),
+    ('margin_50_100', 'CASE WHEN margin_percent >= 50 AND margin_percent < 100 THEN sign ELSE 0 END'),
+    ('margin_100_up', 'CASE WHEN margin_percent >= 100 THEN sign ELSE 0 END'),
+    ('margin_unknown', 'CASE WHEN margin_percent IS NULL THEN sign ELSE 0 END'),
+]
+COLUMNS = ', '.join(column for column, _ in SUMMED_COLUMNS)
+DELTAS = ', '.join(f'sum({expression}) AS {column}' for column, expression in SUMMED_COLUMNS)
+ADD_DELTAS = ', '.join(f'{column} = s.{column} + d.{column}' for column, _ in SUMMED_COLUMNS)
+ADD_EXCLUDED = ', '.join(f'{column} = s.{column} + EXCLUDED.{column}' for column, _ in SUMMED_COLUMNS)
+TOTALS = ', '.join(f"sum({expression.replace('sign', '1')})" for _, expression in SUMMED_COLUMNS)
+
+# Every write statement on products adds the difference of the changed rows
+# to the summaries of their owners, then ranks the owners' products again
+# through the owner/net_profit index. Deletes only update existing rows, so
+# deleting a user whose summary is already gone doesn't create a new one.
+CREATE_TRIGGERS = f"""
+    CREATE FUNCTION calculator_ranked_products(owner bigint, best boolean, size integer)
+    RETURNS jsonb AS $$
+        SELECT COALESCE(jsonb_agg(jsonb_build_object('id', id, 'name', name, 'net_profit', net_profit)
+                                  ORDER BY CASE WHEN best THEN -net_profit ELSE net_profit END,
+                                           CASE WHEN best THEN -id ELSE id END), '[]')
+        FROM (
+            (SELECT id, name, net_profit FROM calculator_productinformation
+             WHERE best AND product_owner_id = owner AND net_profit IS NOT NULL
+             ORDER BY net_profit DESC, id DESC
+             LIMIT size)
+            UNION ALL
+            (SELECT id, name, net_profit FROM calculator_productinformation
+             WHERE NOT best AND product_owner_id = owner AND net_profit IS NOT NULL
+             ORDER BY net_profit, id
+             LIMIT size)
+        ) ranked
+    $$ LANGUAGE sql STABLE;
+
+    CREATE FUNCTION calculator_catalog_changed() RETURNS trigger AS $$
+    DECLARE
+        changes text;
+        owners bigint[];
+    BEGIN
+        changes := CASE TG_OP
+            WHEN 'INSERT' THEN 'SELECT 1 AS sign, * FROM new_rows'
+            WHEN 'DELETE' THEN 'SELECT -1 AS sign, * FROM old_rows'
+            ELSE 'SELECT 1 AS sign, * FROM new_rows UNION ALL SELECT -1, * FROM old_rows'
+        END;
+        IF TG_OP = 'DELETE' THEN
+            EXECUTE format($sql$
+                WITH d AS (
+                    SELECT product_owner_id AS user_id, {DELTAS}
+                    FROM (%s) changes
+                    GROUP BY product_owner_id
+                ), changed AS (
+                    UPDATE calculator_catalogsummary s
+                    SET {ADD_DELTAS}
+                    FROM d
+                    WHERE s.user_id = d.user_id
+                    RETURNING s.user_id
+                )
+                SELECT array_agg(user_id) FROM changed
+            $sql$, changes) INTO owners;
+        ELSE
+            EXECUTE format($sql$
+                WITH d AS (
+                    SELECT product_owner_id AS user_id, {DELTAS}
+                    FROM (%s) changes
+                    GROUP BY product_owner_id
+                ), changed AS (
+                    INSERT INTO calculator_catalogsummary AS s
+                        (user_id, {COLUMNS}, top_products, bottom_products, updated_at)
+                    SELECT d.*, '[]', '[]', now()
+                    FROM d
+                    ORDER BY user_id
+                    ON CONFLICT (user_id) DO UPDATE
+                    SET {ADD_EXCLUDED}
+                    RETURNING s.user_id
+                )
+                SELECT array_agg(user_id) FROM changed
+            $sql$, changes) INTO owners;
+        END IF;
+
+        -- Same size as calculator.analytics.RANKED_PRODUCTS.
+        UPDATE calculator_catalogsummary
+        SET top_products = calculator_ranked_products(user_id, true, 5),
+            bottom_products = calculator_ranked_products(user_id, false, 5),
+            updated_at = now()
+        WHERE user_id = ANY(owners);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER catalog_inserted
+    AFTER INSERT ON calculator_productinformation
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION calculator_catalog_changed();
+
+    CREATE TRIGGER catalog_updated
+    AFTER UPDATE ON calculator_productinformation
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION calculator_catalog_changed();
+
+    CREATE TRIGGER catalog_deleted
+    AFTER DELETE ON calculator_productinformation
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION calculator_catalog_changed();
+
+    INSERT INTO calculator_catalogsummary
+        (user_id, {COLUMNS}, top_products, bottom_products, updated_at)
+    SELECT product_owner_id, {TOTALS},
+           calculator_ranked_products(product_owner_id, true, 5),
+           calculator_ranked_products(product_owner_id, false, 5),
+           now()
+    FROM calculator_productinformation
+    GROUP BY product_owner_id;
+"""
+
+DROP_TRIGGERS = """
+    DROP TRIGGER catalog_deleted ON calculator_productinformation;
+    DROP TRIGGER catalog_updated ON calculator_productinformation;
+    DROP TRIGGER catalog_inserted ON calculator_productinformation;
+    DROP FUNCTION calculator_catalog_changed();
+    DROP FUNCTION calculator_ranked_products(bigint, boolean, integer);
+    DELETE FROM calculator_catalogsummary;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('calculator', '0007_product_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='catalog_summary', serialize=False, to='core.user')),
+                ('product_count', models.BigIntegerField(default=0)),
+                ('inventory_value', models.DecimalField(decimal_places=4, default=0, max_digits=28)),
+                ('projected_profit', models.DecimalField(decimal_places=4, default=0, max_digits=28)),
+                ('margin_below_0', models.BigIntegerField(default=0)),
+                ('margin_0_25', models.BigIntegerField(default=0)),
+                ('margin_25_50', models.BigIntegerField(default=0)),
+                ('margin_50_100', models.BigIntegerField(default=0)),
+                ('margin_100_up', models.BigIntegerField(default=0)),
+                ('margin_unknown', models.BigIntegerField(default=0)),
+                ('top_products', models.JSONField(default=list)),
+                ('bottom_products', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'CatalogSummaries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productinformation',
+            index=models.Index(fields=['product_owner', 'net_profit', 'id'], name='product_owner_profit_idx'),
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
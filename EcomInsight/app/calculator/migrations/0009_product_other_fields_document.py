@@ -0,0 +1,66 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:02
+
+import calculator.models
+from django.db import migrations, models
+
+# Field ids are kept, new ones continue after the largest. Rows still written
+# to the table until it is dropped take their ids from the same sequence.
+CREATE_SEQUENCE = """
+    CREATE SEQUENCE calculator_additional_field_id_seq;
+    SELECT setval('calculator_additional_field_id_seq', COALESCE(max(id), 0) + 1, false)
+    FROM calculator_productinformationadditionalfields;
+    ALTER TABLE calculator_productinformationadditionalfields
+        ALTER COLUMN id SET DEFAULT nextval('calculator_additional_field_id_seq');
+"""
+
+DROP_SEQUENCE = """
+    ALTER TABLE calculator_productinformationadditionalfields
+        ALTER COLUMN id SET DEFAULT nextval('calculator_productinformationadditionalfields_id_seq');
+    SELECT setval('calculator_productinformationadditionalfields_id_seq',
+                  nextval('calculator_additional_field_id_seq'), false);
+    DROP SEQUENCE calculator_additional_field_id_seq;
+"""
+
+# Until the table is dropped, every change of its rows rebuilds the document
+# of the product, so fields written while documents are copied aren't lost.
+CREATE_TRIGGER = """
+    CREATE FUNCTION calculator_additional_fields_to_document() RETURNS trigger AS $$
+    BEGIN
+        UPDATE calculator_productinformation p
+        SET other_fields = COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('id', f.id, 'field_name', f.field_name,
+                                                'value', f.value)
+                             ORDER BY f.id)
+            FROM calculator_productinformationadditionalfields f
+            WHERE f.product_id = p.id), '[]')
+        WHERE p.id IN (NEW.product_id, OLD.product_id);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER additional_fields_to_document
+    AFTER INSERT OR UPDATE OR DELETE ON calculator_productinformationadditionalfields
+    FOR EACH ROW EXECUTE FUNCTION calculator_additional_fields_to_document();
+"""
+
+DROP_TRIGGER = """
+    DROP TRIGGER additional_fields_to_document ON calculator_productinformationadditionalfields;
+    DROP FUNCTION calculator_additional_fields_to_document();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0008_catalog_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinformation',
+            name='other_fields',
+            field=models.JSONField(blank=True, decoder=calculator.models.DecimalJSONDecoder, default=list, encoder=calculator.models.DecimalJSONEncoder),
+        ),
+        migrations.RunSQL(CREATE_SEQUENCE, DROP_SEQUENCE),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
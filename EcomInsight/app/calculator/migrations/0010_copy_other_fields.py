@@ -0,0 +1,56 @@
+from django.db import migrations, transaction
+
+# Products whose additional fields are copied per committed batch.
+BATCH_SIZE = 5000
+
+# Products with a document were copied by an earlier run, or got it from the
+# trigger of 0009, so a failed copy can be run again.
+COPY_FIELDS_SQL = """
+    WITH batch AS (
+        SELECT id FROM calculator_productinformation
+        WHERE id > %s
+        ORDER BY id
+        LIMIT %s
+    ), documents AS (
+        SELECT f.product_id,
+               jsonb_agg(jsonb_build_object('id', f.id, 'field_name', f.field_name, 'value', f.value)
+                         ORDER BY f.id) AS fields
+        FROM calculator_productinformationadditionalfields f
+        JOIN batch ON batch.id = f.product_id
+        GROUP BY f.product_id
+    ), copied AS (
+        UPDATE calculator_productinformation p
+        SET other_fields = documents.fields
+        FROM documents
+        WHERE p.id = documents.product_id
+        AND p.other_fields = '[]'
+    )
+    SELECT max(id), count(*) FROM batch
+"""
+
+
+def copy_fields(apps, schema_editor):
+    """Copy additional field rows into documents of their products, committing every batch."""
+    after = 0
+    while True:
+        with transaction.atomic(using=schema_editor.connection.alias), \
+                schema_editor.connection.cursor() as cursor:
+            cursor.execute(COPY_FIELDS_SQL, [after, BATCH_SIZE])
+            after, count = cursor.fetchone()
+        if count < BATCH_SIZE:
+            return
+
+
+class Migration(migrations.Migration):
+
+    # Batches are committed one by one.
+    atomic = False
+
+    dependencies = [
+        ('calculator', '0009_product_other_fields_document'),
+    ]
+
+    # The rows are kept until 0011, nothing to copy back.
+    operations = [
+        migrations.RunPython(copy_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+CREATE_TRIGGER = """
+    CREATE FUNCTION calculator_additional_fields_to_document() RETURNS trigger AS $$
+    BEGIN
+        UPDATE calculator_productinformation p
+        SET other_fields = COALESCE((
+            SELECT jsonb_agg(jsonb_build_object('id', f.id, 'field_name', f.field_name,
+                                                'value', f.value)
+                             ORDER BY f.id)
+            FROM calculator_productinformationadditionalfields f
+            WHERE f.product_id = p.id), '[]')
+        WHERE p.id IN (NEW.product_id, OLD.product_id);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER additional_fields_to_document
+    AFTER INSERT OR UPDATE OR DELETE ON calculator_productinformationadditionalfields
+    FOR EACH ROW EXECUTE FUNCTION calculator_additional_fields_to_document();
+"""
+
+DROP_TRIGGER = """
+    DROP TRIGGER additional_fields_to_document ON calculator_productinformationadditionalfields;
+    DROP FUNCTION calculator_additional_fields_to_document();
+"""
+
+COPY_FIELDS_BACK_SQL = """
+    INSERT INTO calculator_productinformationadditionalfields (id, field_name, value, product_id)
+    SELECT f.id, f.field_name, f.value, p.id
+    FROM calculator_productinformation p
+    CROSS JOIN LATERAL jsonb_to_recordset(p.other_fields)
+        AS f(id bigint, field_name varchar(255), value numeric(9, 4))
+"""
+
+CREATE_VIEW = """
+    CREATE VIEW calculator_additional_field AS
+    SELECT (f.field ->> 'id')::bigint AS id,
+           f.field ->> 'field_name' AS field_name,
+           (f.field ->> 'value')::numeric(9, 4) AS value,
+           p.id AS product_id
+    FROM calculator_productinformation p
+    CROSS JOIN LATERAL jsonb_array_elements(p.other_fields) AS f(field);
+"""
+
+DROP_VIEW = 'DROP VIEW calculator_additional_field;'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0010_copy_other_fields'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DROP_TRIGGER, CREATE_TRIGGER),
+        migrations.RunSQL(migrations.RunSQL.noop, COPY_FIELDS_BACK_SQL),
+        migrations.DeleteModel(
+            name='ProductInformationAdditionalFields',
+        ),
+        migrations.CreateModel(
+            name='AdditionalField',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('value', models.DecimalField(blank=True, decimal_places=4, max_digits=9, null=True)),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='calculator.productinformation')),
+            ],
+            options={
+                'db_table': 'calculator_additional_field',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_VIEW, DROP_VIEW),
+        migrations.AddIndex(
+            model_name='productinformation',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['other_fields'], name='product_other_fields_idx', opclasses=['jsonb_path_ops']),
+        ),
+    ]
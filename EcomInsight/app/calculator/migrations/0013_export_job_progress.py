@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 05:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0012_export_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='progress',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:21
+
+from django.db import migrations, models
+
+# The owner is added for listing a user's fields through the partial index on
+# products with fields, in product order, expanding only the listed products.
+CREATE_VIEW = """
+    CREATE OR REPLACE VIEW calculator_additional_field AS
+    SELECT (f.field ->> 'id')::bigint AS id,
+           f.field ->> 'field_name' AS field_name,
+           (f.field ->> 'value')::numeric(9, 4) AS value,
+           p.id AS product_id,
+           p.product_owner_id
+    FROM calculator_productinformation p
+    CROSS JOIN LATERAL jsonb_array_elements(p.other_fields) AS f(field)
+    WHERE NOT (p.other_fields = '[]');
+"""
+
+DROP_VIEW = """
+    DROP VIEW calculator_additional_field;
+    CREATE VIEW calculator_additional_field AS
+    SELECT (f.field ->> 'id')::bigint AS id,
+           f.field ->> 'field_name' AS field_name,
+           (f.field ->> 'value')::numeric(9, 4) AS value,
+           p.id AS product_id
+    FROM calculator_productinformation p
+    CROSS JOIN LATERAL jsonb_array_elements(p.other_fields) AS f(field);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0013_export_job_progress'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productinformation',
+            index=models.Index(condition=models.Q(('other_fields', []), _negated=True), fields=['product_owner', 'id'], name='product_owner_fields_idx'),
+        ),
+        migrations.RunSQL(CREATE_VIEW, DROP_VIEW),
+    ]
@@ -1,13 +1,39 @@
+import json
+from decimal import Decimal
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Upper
 from django.conf import settings
 
 
+class DecimalJSONEncoder(DjangoJSONEncoder):
+    """Encode decimals as JSON numbers."""
+
+    def default(self, o):
+        if isinstance(o, Decimal):
+            # Values have at most 9 digits, so the float's repr is exact.
+            return float(o)
+        return super().default(o)
+
+
+class DecimalJSONDecoder(json.JSONDecoder):
+    """Decode JSON numbers with a fraction as decimals."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, parse_float=Decimal, **kwargs)
+
+
 class ProductInformation(models.Model):
     """
     Product model that contains all information about product.
     """
     name = models.CharField(max_length=255, null=False, blank=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last change of the product or one of its additional fields.
+    updated_at = models.DateTimeField(auto_now=True)
     sku = models.CharField(max_length=255, null=True, blank=True)
     quantity = models.IntegerField(null=True, blank=True)
     margin_percent = models.DecimalField(max_digits=9, decimal_places=4, null=True, blank=True)
@@ -20,25 +46,168 @@ class ProductInformation(models.Model):
     recommended_price = models.DecimalField(max_digits=9, decimal_places=4, null=True, blank=True)
     expenses = models.DecimalField(max_digits=9, decimal_places=4, null=True, blank=True)
     net_profit = models.DecimalField(max_digits=9, decimal_places=4, null=True, blank=True)
+    # Sums of rounded sum and percent inputs behind the stored totals, kept to
+    # apply changes of additional fields incrementally. Null when unknown.
+    inputs_sum = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+    inputs_percent = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+    # Additional fields as a list of {"id", "field_name", "value"} in the
+    # order they were added, see calculator.other_fields.
+    other_fields = models.JSONField(default=list, blank=True,
+                                    encoder=DecimalJSONEncoder,
+                                    decoder=DecimalJSONDecoder)
+    # Id of the transaction that inserted or last changed the product, set by
+    # a trigger. Additional fields are part of the row, so their changes count.
+    change_txid = models.BigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return str(self.name)
 
     class Meta:
         verbose_name_plural = 'ProductInformation'
+        indexes = [
+            # Keyset pagination of a user's products.
+            models.Index(fields=['product_owner', 'created_at', 'id'],
+                         name='product_owner_created_idx'),
+            # Changes feed of a user's products.
+            models.Index(fields=['product_owner', 'change_txid', 'id'],
+                         name='product_owner_change_idx'),
+            # Most and least profitable products of a user.
+            models.Index(fields=['product_owner', 'net_profit', 'id'],
+                         name='product_owner_profit_idx'),
+            # Products having additional fields in id order, the rows of
+            # the additional field view are listed through it.
+            models.Index(fields=['product_owner', 'id'], condition=~Q(other_fields=[]),
+                         name='product_owner_fields_idx'),
+            # Products having an additional field, looked up by containment.
+            GinIndex(fields=['other_fields'], opclasses=['jsonb_path_ops'],
+                     name='product_other_fields_idx'),
+            # Case-insensitive substring and similarity search on name.
+            # Django's icontains compares UPPER(name), so index that.
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'),
+                     name='product_name_trgm_idx'),
+        ]
+        constraints = [
+            # Products are identified by sku within a user's catalog, also
+            # serves lookups by sku.
+            models.UniqueConstraint(fields=['product_owner', 'sku'],
+                                    name='product_owner_sku_unique'),
+        ]
 
 
-class ProductInformationAdditionalFields(models.Model):
-    """Table for additional fields that user might add for its products."""
+class AdditionalField(models.Model):
+    """
+    Additional field that user might add for its products. Fields are stored
+    in the other_fields document of their product, this is a read-only view
+    of them as rows.
+    """
 
     field_name = models.CharField(max_length=255, null=True, blank=True)
     value = models.DecimalField(max_digits=9, decimal_places=4, null=True, blank=True)
     product = models.ForeignKey(ProductInformation,
-                                related_name='other_fields',
-                                on_delete=models.CASCADE)
+                                related_name='+',
+                                on_delete=models.DO_NOTHING,
+                                db_constraint=False)
+    # Owner of the product, for listing a user's fields without a join.
+    product_owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                      related_name='+',
+                                      on_delete=models.DO_NOTHING,
+                                      db_constraint=False)
 
     def __str__(self):
         return str(self.field_name)
 
     class Meta:
-        verbose_name_plural = 'ProductInformationAdditionalFields'
+        managed = False
+        db_table = 'calculator_additional_field'
+
+
+class ProductTombstone(models.Model):
+    """Deleted product, reported by the changes feed until it is purged."""
+
+    # Without a constraint: tombstones are written by a trigger while the
+    # products of a deleted user are deleted, and are purged like others.
+    product_owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                      on_delete=models.DO_NOTHING,
+                                      db_constraint=False,
+                                      db_index=False)
+    product_id = models.BigIntegerField()
+    change_txid = models.BigIntegerField()
+    deleted_at = models.DateTimeField()
+
+    def __str__(self):
+        return str(self.product_id)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product_owner', 'change_txid', 'product_id'],
+                         name='tombstone_owner_change_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+
+
+class CatalogSummary(models.Model):
+    """
+    Totals across a user's catalog. Kept up to date by triggers on every
+    write of products, see calculator.analytics.
+    """
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                primary_key=True,
+                                related_name='catalog_summary',
+                                on_delete=models.CASCADE)
+    product_count = models.BigIntegerField(default=0)
+    # Sums of quantity times expenses and times net profit.
+    inventory_value = models.DecimalField(max_digits=28, decimal_places=4, default=0)
+    projected_profit = models.DecimalField(max_digits=28, decimal_places=4, default=0)
+    # Number of products by margin percent.
+    margin_below_0 = models.BigIntegerField(default=0)
+    margin_0_25 = models.BigIntegerField(default=0)
+    margin_25_50 = models.BigIntegerField(default=0)
+    margin_50_100 = models.BigIntegerField(default=0)
+    margin_100_up = models.BigIntegerField(default=0)
+    margin_unknown = models.BigIntegerField(default=0)
+    # Products with the highest and lowest net profit as id, name and net_profit.
+    top_products = models.JSONField(default=list)
+    bottom_products = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.user_id)
+
+    class Meta:
+        verbose_name_plural = 'CatalogSummaries'
+
+
+class ExportJob(models.Model):
+    """CSV export of a user's products and its file, see calculator.exports."""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        SUCCESS = 'success'
+        FAILURE = 'failure'
+
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              related_name='export_jobs',
+                              on_delete=models.CASCADE,
+                              db_index=False)
+    # Id of the Celery task writing the file, returned to the client.
+    task_id = models.CharField(max_length=255, unique=True)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    # Fingerprint of the owner's products when the export was requested.
+    fingerprint = models.CharField(max_length=64)
+    file_path = models.CharField(max_length=255)
+    size = models.BigIntegerField(null=True, blank=True)
+    # Rows planned and written per shard of the file, see calculator.exports.
+    progress = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.task_id
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'fingerprint'], name='export_owner_fingerprint_idx'),
+            models.Index(fields=['expires_at'], name='export_expires_idx'),
+        ]
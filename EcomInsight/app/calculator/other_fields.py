@@ -0,0 +1,63 @@
+"""
+Additional fields of products.
+
+Fields are stored in the other_fields JSONB document of their product as a
+list of {"id", "field_name", "value"}, in the order they were added, so
+they are read and written together with the product row. Ids come from a
+sequence and are unique across products; a field is found by id through
+the GIN index on the documents.
+"""
+from django.db import connection
+
+from .models import AdditionalField, ProductInformation
+
+FIELD_ID_SEQUENCE = 'calculator_additional_field_id_seq'
+
+
+def new_field(data: dict) -> dict:
+    """Return document entry of a new additional field, without an id yet."""
+    return {'field_name': data.get('field_name'), 'value': data.get('value')}
+
+
+def add_field_ids(documents: list) -> list:
+    """
+    Give new fields of the documents an id, with one query for all of them.
+    Returns the documents.
+    """
+    new_fields = [field for document in documents for field in document if 'id' not in field]
+    if new_fields:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT nextval('{FIELD_ID_SEQUENCE}') FROM generate_series(1, %s)",
+                           [len(new_fields)])
+            for field, (field_id,) in zip(new_fields, cursor.fetchall()):
+                field['id'] = field_id
+    return documents
+
+
+def merge_fields(document: list, changes: list) -> list:
+    """
+    Return a copy of document with changes applied. Changes with an id update
+    that field, if the product has it, others are added as new fields
+    without an id, see add_field_ids.
+    """
+    fields = [dict(field) for field in document]
+    by_id = {field['id']: field for field in fields}
+    for data in changes:
+        if 'id' not in data:
+            fields.append(new_field(data))
+        elif data['id'] in by_id:
+            by_id[data['id']].update((name, data[name]) for name in ('field_name', 'value')
+                                     if name in data)
+    return fields
+
+
+def find_field(user_id: int, field_id: int):
+    """Return additional field of user's products by id, None when there is none."""
+    product = (ProductInformation.objects.
+               filter(product_owner=user_id, other_fields__contains=[{'id': field_id}]).
+               values('id', 'other_fields').
+               first())
+    if product is None:
+        return None
+    field = next(field for field in product['other_fields'] if field['id'] == field_id)
+    return AdditionalField(product_id=product['id'], **field)
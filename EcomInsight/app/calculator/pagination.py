@@ -0,0 +1,32 @@
+"""Pagination classes for calculator app views."""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ItemsCursorPagination(CursorPagination):
+    """
+    Keyset pagination of products ordered by (created_at, id).
+    Pages are read through the owner/created_at index without counting rows,
+    and cursors stay stable while new products are inserted.
+    """
+
+    ordering = ('created_at', 'id')
+    page_size = settings.CALCULATOR_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.CALCULATOR_MAX_PAGE_SIZE
+
+
+class OtherFieldsCursorPagination(ItemsCursorPagination):
+    """
+    Keyset pagination of additional fields ordered by product, then id.
+    Products are read in order through the owner/id index on products with
+    fields, so only the documents of a page are expanded into rows.
+    """
+
+    ordering = ('product_id', 'id')
+
+
+class SearchCursorPagination(ItemsCursorPagination):
+    """Keyset pagination of search results ranked by similarity."""
+
+    ordering = ('-similarity', 'id')
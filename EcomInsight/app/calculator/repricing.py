@@ -0,0 +1,226 @@
+"""
+Set-based recalculation of stored product totals in the database.
+
+The SQL mirrors UserInputHandler and Calculator: every input is rounded
+half to even to cents, stored numeric inputs and the additional fields of
+the product's document are summed or treated as percents by name,
+expenses and recommended price are rounded half to even. Null inputs count
+as zero.
+
+Changes of a single additional field are applied incrementally from the
+sums of inputs stored on the product, and drift between stored totals and
+stored inputs can be detected and repaired.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import items_cache
+from .models import ProductInformation
+from .schema import INPUT_FIELDS, PERCENT, SUM, field_kind, other_field_kind
+from .services import FixedPointCalculator, from_cents, to_cents
+
+PRODUCTS = ProductInformation._meta.db_table
+
+
+def round_half_even(expression: str) -> str:
+    """Return SQL rounding expression half to even to cents."""
+    # Postgres round() rounds ties away from zero, on a tie with an even
+    # last cent the value is truncated instead.
+    value = f'({expression})::numeric'
+    return (f'(CASE WHEN abs({value} * 100 %% 1) = 0.5 '
+            f'AND trunc({value} * 100) %% 2 = 0 '
+            f'THEN trunc({value}, 2) ELSE round({value}, 2) END)')
+
+
+def sum_of_inputs(kind: str) -> str:
+    """Return SQL sum of the product's rounded inputs of kind."""
+    return ' + '.join(f'COALESCE({round_half_even(f"p.{name}")}, 0)'
+                      for name in INPUT_FIELDS if field_kind(name) == kind) or '0'
+
+
+# Same classification as schema.classify, names without 'percent' are sums.
+IS_PERCENT = "COALESCE(f.field_name LIKE '%%percent%%', false)"
+
+TOTALS_SQL = f"""
+    WITH batch AS (
+        SELECT p.id, p.product_owner_id, p.other_fields,
+               COALESCE(p.margin_percent, 0) AS margin,
+               {sum_of_inputs(SUM)} AS sum_values,
+               {sum_of_inputs(PERCENT)} AS percent_values
+        FROM {PRODUCTS} p
+        WHERE p.id > %(after)s {{conditions}}
+        ORDER BY p.id
+        LIMIT %(batch_size)s
+    ), expenses AS (
+        SELECT batch.id, batch.product_owner_id, batch.margin, s.sum_values, s.percent_values,
+               {round_half_even(
+                   's.sum_values + s.sum_values * s.percent_values / 100')} AS expenses
+        FROM batch
+        CROSS JOIN LATERAL (
+            SELECT SUM(CASE WHEN {IS_PERCENT} THEN 0
+                            ELSE COALESCE({round_half_even('f.value')}, 0) END) AS sum_values,
+                   SUM(CASE WHEN {IS_PERCENT}
+                            THEN COALESCE({round_half_even('f.value')}, 0) ELSE 0 END) AS percent_values
+            FROM jsonb_to_recordset(batch.other_fields) AS f(field_name text, value numeric)
+        ) other_fields
+        CROSS JOIN LATERAL (
+            SELECT batch.sum_values + COALESCE(other_fields.sum_values, 0) AS sum_values,
+                   batch.percent_values + COALESCE(other_fields.percent_values, 0) AS percent_values
+        ) s
+    ), totals AS (
+        SELECT id, product_owner_id, sum_values, percent_values, expenses,
+               {round_half_even('expenses + expenses * margin / 100')} AS recommended_price
+        FROM expenses
+    )
+"""
+
+# True when stored totals of p differ from the calculated ones.
+TOTALS_DIFFER = """
+    (p.expenses, p.recommended_price, p.net_profit, p.inputs_sum, p.inputs_percent)
+    IS DISTINCT FROM
+    (totals.expenses, totals.recommended_price,
+     totals.recommended_price - totals.expenses,
+     totals.sum_values, totals.percent_values)
+"""
+
+REPRICE_SQL = TOTALS_SQL + f"""
+    UPDATE {PRODUCTS} p
+    SET expenses = totals.expenses,
+        recommended_price = totals.recommended_price,
+        net_profit = totals.recommended_price - totals.expenses,
+        inputs_sum = totals.sum_values,
+        inputs_percent = totals.percent_values,
+        updated_at = CASE WHEN {TOTALS_DIFFER} THEN now() ELSE p.updated_at END
+    FROM totals
+    WHERE p.id = totals.id AND p.id = ANY(ARRAY(SELECT id FROM totals))
+    RETURNING p.id, p.product_owner_id
+"""
+
+
+DRIFT_SQL = TOTALS_SQL + f"""
+    SELECT p.id, {TOTALS_DIFFER}
+    FROM totals
+    JOIN {PRODUCTS} p ON p.id = totals.id
+    WHERE p.id = ANY(ARRAY(SELECT id FROM totals))
+    ORDER BY p.id
+"""
+
+
+def execute_batch(sql: str, after: int, batch_size: int, user_id=None, product_ids=None) -> list:
+    """Run sql on the next batch of products with id above after."""
+    conditions = ''
+    if user_id is not None:
+        conditions += ' AND p.product_owner_id = %(user_id)s'
+    if product_ids is not None:
+        conditions += ' AND p.id = ANY(%(product_ids)s)'
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(conditions=conditions),
+                       {'after': after, 'batch_size': batch_size,
+                        'user_id': user_id, 'product_ids': product_ids})
+        return cursor.fetchall()
+
+
+def reprice_batch(after: int, batch_size: int, user_id=None, product_ids=None) -> list:
+    """
+    Recalculate totals of the next batch of products with id above after.
+    Returns (id, product_owner_id) of updated products.
+    """
+    rows = execute_batch(REPRICE_SQL, after, batch_size, user_id, product_ids)
+    for owner_id in {owner_id for _, owner_id in rows}:
+        items_cache.invalidate(owner_id)
+    return rows
+
+
+def reprice_products(user_id=None, batch_size: int = None, product_ids=None) -> int:
+    """
+    Recalculate stored totals of user's products, or of all products.
+    Every batch is committed separately so row locks are held briefly.
+    Returns the number of updated products.
+    """
+    batch_size = batch_size or settings.CALCULATOR_REPRICE_BATCH_SIZE
+    updated = 0
+    after = 0
+    while True:
+        with transaction.atomic():
+            rows = reprice_batch(after, batch_size, user_id, product_ids)
+        updated += len(rows)
+        if len(rows) < batch_size:
+            return updated
+        after = max(product_id for product_id, _ in rows)
+
+
+def other_field_cents(field_name, value) -> tuple:
+    """Return (sum, percent) contribution of an additional field in cents."""
+    if value is None:
+        return 0, 0
+    cents = to_cents(value)
+    if field_name is not None and other_field_kind(field_name) == PERCENT:
+        return 0, cents
+    return cents, 0
+
+
+def change_other_field(product_id: int, field_id: int, changes: dict = None):
+    """
+    Change field_name and value of an additional field of the product, or
+    delete the field when changes is None, updating the product's totals
+    with the same write. Only the difference is applied to the stored sums;
+    products without stored sums are recalculated. Returns the field after
+    the change, None when the product has no such field any more.
+    """
+    with transaction.atomic():
+        product = (ProductInformation.objects.select_for_update().
+                   only('product_owner', 'margin_percent', 'inputs_sum', 'inputs_percent',
+                        'other_fields').
+                   filter(pk=product_id, other_fields__contains=[{'id': field_id}]).
+                   first())
+        if product is None:
+            return None
+        fields = product.other_fields
+        index = next(index for index, field in enumerate(fields) if field['id'] == field_id)
+        old = fields.pop(index)
+        new = None
+        if changes is not None:
+            new = {**old, **changes}
+            fields.insert(index, new)
+
+        updates = {'other_fields': fields, 'updated_at': timezone.now()}
+        old_sum, old_percent = other_field_cents(old['field_name'], old['value'])
+        new_sum, new_percent = other_field_cents(new['field_name'], new['value']) if new else (0, 0)
+        reprice = False
+        if (old_sum, old_percent) != (new_sum, new_percent):
+            if product.inputs_sum is None or product.inputs_percent is None:
+                reprice = True
+            else:
+                sum_cents = to_cents(product.inputs_sum) + new_sum - old_sum
+                percent_cents = to_cents(product.inputs_percent) + new_percent - old_percent
+                totals = FixedPointCalculator.from_sums(sum_cents, percent_cents,
+                                                        product.margin_percent or 0).get_totals()
+                updates.update(inputs_sum=from_cents(sum_cents),
+                               inputs_percent=from_cents(percent_cents),
+                               **totals._asdict())
+        ProductInformation.objects.filter(pk=product_id).update(**updates)
+        if reprice:
+            reprice_batch(0, 1, product_ids=[product_id])
+        items_cache.invalidate(product.product_owner_id)
+    return new
+
+
+def find_drift(user_id=None, batch_size: int = None) -> list:
+    """Return ids of products whose stored totals differ from their stored inputs."""
+    batch_size = batch_size or settings.CALCULATOR_REPRICE_BATCH_SIZE
+    drifted = []
+    after = 0
+    while True:
+        rows = execute_batch(DRIFT_SQL, after, batch_size, user_id)
+        drifted.extend(product_id for product_id, differs in rows if differs)
+        if len(rows) < batch_size:
+            return drifted
+        after = rows[-1][0]
+
+
+def repair_drift(product_ids: list, batch_size: int = None) -> int:
+    """Recalculate totals of drifted products, returns the number repaired."""
+    if not product_ids:
+        return 0
+    return reprice_products(batch_size=batch_size, product_ids=list(product_ids))
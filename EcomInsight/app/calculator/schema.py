@@ -0,0 +1,61 @@
+"""Classification of calculator input fields into sum, percent and margin."""
+from django.conf import settings
+from django.db import models
+
+from .caching import LRUCache
+from .models import ProductInformation
+
+SUM = 'sum'
+PERCENT = 'percent'
+MARGIN = 'margin'
+
+
+def classify(field_name: str) -> str:
+    """Classify field by its name."""
+    if 'percent' in field_name:  # Check for percentage values.
+        return PERCENT
+    return SUM
+
+
+# ProductInformation fields are classified once at import.
+MODEL_FIELD_KINDS = {field.name: classify(field.name)
+                     for field in ProductInformation._meta.concrete_fields}
+MODEL_FIELD_KINDS['margin_percent'] = MARGIN
+
+# Stored results of the calculation.
+OUTPUT_FIELDS = ('expenses', 'recommended_price', 'net_profit')
+
+# Stored sums of rounded inputs, used for recalculation, and the change
+# time and transaction, used for conditional reads and the changes feed.
+# Not exposed by the API.
+INTERNAL_FIELDS = ('inputs_sum', 'inputs_percent', 'updated_at', 'change_txid')
+
+# Stored numeric inputs of the calculation, other than the margin.
+INPUT_FIELDS = tuple(
+    field.name for field in ProductInformation._meta.concrete_fields
+    if isinstance(field, (models.DecimalField, models.IntegerField))
+    and not field.primary_key
+    and field.name not in OUTPUT_FIELDS + INTERNAL_FIELDS
+    and MODEL_FIELD_KINDS[field.name] != MARGIN)
+
+# Names of users' additional fields are classified on first use.
+field_kind_cache = LRUCache(maxsize=settings.CALCULATOR_FIELD_CACHE_SIZE, name='field_kind')
+
+
+def other_field_kind(field_name: str) -> str:
+    """Return kind of additional field, classifying the name once."""
+    kind = field_kind_cache.get(field_name)
+    if kind is None:
+        if not isinstance(field_name, str):
+            raise TypeError("Invalid type for field_name, expected string.")
+        kind = classify(field_name)
+        field_kind_cache.set(field_name, kind)
+    return kind
+
+
+def field_kind(field_name: str) -> str:
+    """Return kind of product input field."""
+    kind = MODEL_FIELD_KINDS.get(field_name)
+    if kind is None:
+        kind = other_field_kind(field_name)
+    return kind
@@ -1,9 +1,45 @@
 """Calculator app serializers."""
-from django.core.cache import cache
+from contextlib import contextmanager
+
+from django.db import IntegrityError, transaction
 from rest_framework import serializers, status
-from .models import ProductInformation, ProductInformationAdditionalFields
-from django.db import transaction
-from .services import UserInputHandler, Calculator
+from .analytics import MARGIN_BUCKETS
+from .caching import items_cache
+from .models import AdditionalField, CatalogSummary, ProductInformation
+from .other_fields import add_field_ids, merge_fields, new_field
+from .schema import INPUT_FIELDS, INTERNAL_FIELDS, OUTPUT_FIELDS
+from .services import FixedPointCalculator, calculate_product, from_cents
+
+# Columns whose change requires recalculating the totals.
+COST_FIELDS = (*INPUT_FIELDS, 'margin_percent')
+
+SKU_CONSTRAINT = 'product_owner_sku_unique'
+SKU_TAKEN = 'Product with this sku already exists.'
+
+
+@contextmanager
+def unique_sku():
+    """
+    Turn a write of a sku taken by a concurrent write into a validation
+    error of the sku. Skus are checked before writing, without a lock.
+    """
+    try:
+        with transaction.atomic():
+            yield
+    except IntegrityError as error:
+        if SKU_CONSTRAINT not in str(error):
+            raise
+        raise serializers.ValidationError({'sku': [SKU_TAKEN]}) from error
+
+
+class AdditionalFieldsListSerializer(serializers.ListSerializer):
+    """
+    Additional fields of a product, read from its other_fields document.
+    """
+
+    def get_attribute(self, instance):
+        """Return fields of the product as AdditionalField rows."""
+        return [AdditionalField(product_id=instance.pk, **field) for field in instance.other_fields]
 
 
 class ProductInformationAdditionalFieldsSerializer(serializers.ModelSerializer):
@@ -18,7 +54,8 @@ class ProductInformationAdditionalFieldsSerializer(serializers.ModelSerializer):
         Metaclass options.
         """
 
-        model = ProductInformationAdditionalFields
+        model = AdditionalField
+        list_serializer_class = AdditionalFieldsListSerializer
 
         fields = ['id',
                   'field_name',
@@ -44,27 +81,28 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         model = ProductInformation
 
         exclude = ['created_at',
-                   'product_owner']
+                   'product_owner',
+                   *INTERNAL_FIELDS]
 
         extra_kwargs = {'recommended_price': {'allow_null': True},
                         'expenses': {'allow_null': True},
                         'net_profit': {'allow_null': True},
                         }
 
-    def create_other_fields(self, fields, product):
+    def validate_sku(self, sku):
         """
-        Create other fields helper function for product.
+        Check sku is not used by another product of the user.
         """
 
-        for field in fields:
-            field_name = field['field_name']
-            value = field['value']
-            field_obj = ProductInformationAdditionalFields.objects.create(
-                product=product,
-                field_name=field_name,
-                value=value
-            )
-            product.other_fields.add(field_obj)
+        request = self.context.get('request')
+        if sku is None or request is None or not request.user.is_authenticated:
+            return sku
+        products = ProductInformation.objects.filter(product_owner=request.user, sku=sku)
+        if self.instance is not None:
+            products = products.exclude(pk=self.instance.pk)
+        if products.exists():
+            raise serializers.ValidationError(SKU_TAKEN)
+        return sku
 
     def create(self, validated_data):
         """
@@ -74,67 +112,61 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
 
         if user.is_authenticated:
-            other_fields = validated_data.pop('other_fields', [])
-            product_information = ProductInformation.objects.create(product_owner=user, **validated_data)
-
-            self.create_other_fields(other_fields, product_information)
-            product_information.save()
-            cache.delete('Items')
+            other_fields = [new_field(field) for field in validated_data.pop('other_fields', [])]
+            add_field_ids([other_fields])
+            with unique_sku():
+                product_information = ProductInformation.objects.create(product_owner=user,
+                                                                        other_fields=other_fields,
+                                                                        **validated_data)
+            items_cache.invalidate(user.pk)
             return product_information
 
         raise serializers.ValidationError('Unauthorized user.')
 
     def update(self, instance, validated_data):
         """
-        Update product information.
+        Update product information, writing only changed columns. Additional
+        fields with an id update that field of the product, others are added.
+        Totals are recalculated from the stored inputs when a cost input or
+        an additional field changed. The number of written rows is kept in
+        rows_touched.
         """
 
-        other_fields_data = validated_data.pop('other_fields', [])
-
-        # Extract the field ids and create a mapping of id to field_data
-        field_data_mapping = {field_data.get('id'): field_data for field_data in other_fields_data if
-                              field_data.get('id')}
-
-        # Fetch all existing fields related to the instance with prefetch_related
-        existing_fields = instance.other_fields.all()
-        # Proceed calculations for validated inputs from user.
-        lists = UserInputHandler(validated_data).parse_user_input()
-        sum_list, percent_list = lists.sum_values, lists.percent_values
-        calculate = Calculator(sum_values=sum_list,
-                               percent_values=percent_list,
-                               user_input=validated_data)
-
-        expenses = calculate.get_total_expenses()
-        recommended_price = calculate.get_recommended_price(expenses)
-        net_profit = calculate.get_net_profit(expenses, recommended_price)
-
-        with transaction.atomic():
-            # Update existing fields using bulk update
-            for field_instance in existing_fields:
-                field_data = field_data_mapping.get(field_instance.id)
-                if field_data:
-                    field_instance.field_name = field_data.get('field_name', field_instance.field_name)
-                    field_instance.value = field_data.get('value', field_instance.value)
-            # Update product information
-            validated_data['recommended_price'] = recommended_price
-            validated_data['expenses'] = expenses
-            validated_data['net_profit'] = net_profit
-            ProductInformationAdditionalFields.objects.bulk_update(existing_fields, ['field_name', 'value'])
-
-            # Create users custom added fields.
-            new_fields = [
-                ProductInformationAdditionalFields(
-                    product=instance,
-                    field_name=field_data.get('field_name'),
-                    value=field_data.get('value')
-                )
-                for field_data in other_fields_data if 'id' not in field_data
-            ]
-
-            # Bulk create users custom added fields.
-            ProductInformationAdditionalFields.objects.bulk_create(new_fields)
-        cache.delete('Items')
-        return super().update(instance, validated_data)
+        other_fields = merge_fields(instance.other_fields, validated_data.pop('other_fields', []))
+        # Totals are derived from the inputs, never taken from the request.
+        for name in OUTPUT_FIELDS:
+            validated_data.pop(name, None)
+
+        columns = [name for name, value in validated_data.items()
+                   if getattr(instance, name) != value]
+        for name in columns:
+            setattr(instance, name, validated_data[name])
+        if other_fields != instance.other_fields:
+            instance.other_fields = add_field_ids([other_fields])[0]
+            columns.append('other_fields')
+
+        if any(name in COST_FIELDS or name == 'other_fields' for name in columns):
+            user_input = {**{name: getattr(instance, name) for name in COST_FIELDS},
+                          'other_fields': instance.other_fields}
+            # Totals come from the configured arithmetic, the sums behind
+            # them are kept in cents for incremental repricing either way.
+            sums = FixedPointCalculator(user_input)
+            updates = {**calculate_product(user_input)._asdict(),
+                       'inputs_sum': from_cents(sums.sum_cents),
+                       'inputs_percent': from_cents(sums.percent_cents)}
+            for name, value in updates.items():
+                if getattr(instance, name) != value:
+                    setattr(instance, name, value)
+                    columns.append(name)
+
+        if columns:
+            with unique_sku():
+                instance.save(update_fields=[*columns, 'updated_at'])
+
+        self.rows_touched = int(bool(columns))
+        if self.rows_touched:
+            items_cache.invalidate(instance.product_owner_id)
+        return instance
 
 
 class CreateProductInformationAdditionalFieldsSerializer(serializers.ModelSerializer):
@@ -143,7 +175,8 @@ class CreateProductInformationAdditionalFieldsSerializer(serializers.ModelSerial
     """
 
     class Meta:
-        model = ProductInformationAdditionalFields
+        model = AdditionalField
+        list_serializer_class = AdditionalFieldsListSerializer
         fields = ['id',
                   'field_name',
                   'value',
@@ -173,7 +206,8 @@ class CreateProductSerializer(ProductInfoSerializer):
                    'id',
                    'recommended_price',
                    'expenses',
-                   'net_profit']
+                   'net_profit',
+                   *INTERNAL_FIELDS]
 
         extra_kwargs = {'id': {'read_only': True}}
 
@@ -183,3 +217,38 @@ class CsvSerializer(serializers.Serializer):
     Serializer for post request for creating csv file.
     """
     task_id = serializers.CharField(read_only=True)
+
+
+class CsvImportSerializer(serializers.Serializer):
+    """
+    Serializer for post request for importing products from csv file.
+    """
+    file = serializers.FileField(write_only=True)
+    task_id = serializers.CharField(read_only=True)
+
+
+class CatalogSummarySerializer(serializers.ModelSerializer):
+    """
+    Totals across user's catalog.
+    """
+
+    margin_distribution = serializers.SerializerMethodField()
+
+    class Meta:
+        """
+        Metaclass options.
+        """
+
+        model = CatalogSummary
+
+        fields = ['product_count',
+                  'inventory_value',
+                  'projected_profit',
+                  'margin_distribution',
+                  'top_products',
+                  'bottom_products',
+                  'updated_at']
+
+    def get_margin_distribution(self, summary) -> dict:
+        """Number of products by margin percent range."""
+        return {label: getattr(summary, column) for label, column in MARGIN_BUCKETS}
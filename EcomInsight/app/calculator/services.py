@@ -4,10 +4,37 @@ import decimal
 import logging
 from decimal import Decimal, InvalidOperation
 
+import numpy as np
+from django.conf import settings
+
+from .schema import MARGIN, PERCENT, SUM, field_kind, other_field_kind
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
+def iter_other_fields(other_fields: list):
+    """
+    Yield (field_name, value, kind) of additional fields, given as user input
+    or as the other_fields document of a stored product. Like in the
+    database, fields without a value count as zero and ones without a name
+    are summed.
+    """
+    if not isinstance(other_fields, list):
+        raise TypeError("Expected a list for 'other_fields'")
+    for item in other_fields:
+        if not isinstance(item, dict):
+            raise TypeError("Expected a dictionary in 'other_fields' list")
+        field_name = item.get('field_name')
+        field_value = item.get('value')
+        if field_value is None:
+            continue
+        kind = SUM if field_name is None else other_field_kind(field_name)
+        if not isinstance(field_value, Decimal):
+            raise TypeError("Invalid type for field_value, expected Decimal.")
+        yield field_name, field_value, kind
+
+
 class UserInputHandler:
     """Parse and prepare user input for further calculations."""
 
@@ -16,15 +43,18 @@ class UserInputHandler:
         self.percent_values = []
         self.sum_values = []
 
-    def append_list(self, field: str, value) -> None:
+    def append_list(self, field: str, value, kind: str = None) -> None:
         """Append lists of percent and non-percent values."""
         try:
-            decimal_value = round(Decimal(value), 2)
+            decimal_value = Decimal(value)
+            if not decimal_value.is_finite():
+                raise InvalidOperation(value)
+            decimal_value = round(decimal_value, 2)
         except InvalidOperation:
             logger.info(f"Invalid input for field '{field}': {value}")
             return
 
-        if 'percent' in field:  # Check for percentage values.
+        if (kind or field_kind(field)) == PERCENT:  # Check for percentage values.
             self.percent_values.append(decimal_value)
         else:
             self.sum_values.append(decimal_value)  # Append non-percent values.
@@ -34,21 +64,12 @@ class UserInputHandler:
 
         for field, value in self.user_inputs.items():
             if field == "other_fields":
-                if not isinstance(value, list):
-                    raise TypeError("Expected a list for 'other_fields'")
-                for item in value:
-                    if not isinstance(item, dict):
-                        raise TypeError("Expected a dictionary in 'other_fields' list")
-                    field_name = item.get('field_name')
-                    field_value = item.get('value')
-                    if not isinstance(field_name, str):
-                        raise TypeError("Invalid type for field_name, expected string.")
-                    if not isinstance(field_value, Decimal):
-                        raise TypeError("Invalid type for field_value, expected Decimal.")
-                    self.append_list(field_name, field_value)
-            else:
-                if 'margin_percent' != field:
-                    self.append_list(field, value)
+                for field_name, field_value, kind in iter_other_fields(value):
+                    self.append_list(field_name, field_value, kind)
+            elif value is not None:  # Missing inputs count as zero.
+                kind = field_kind(field)
+                if kind != MARGIN:
+                    self.append_list(field, value, kind)
 
         lists = namedtuple('lists', ['sum_values', 'percent_values'])
         output = lists(sum_values=self.sum_values,
@@ -80,7 +101,7 @@ class Calculator:
     def get_recommended_price(self, total_expenses: Decimal) -> Decimal:
         """Returns recommended price according to user margin input and expenses."""
 
-        margin = Decimal(self.user_input.get('margin_percent', Decimal(0)))
+        margin = Decimal(self.user_input.get('margin_percent') or 0)
         recommended_price = Decimal(
             total_expenses + total_expenses * (margin / 100))
         rounded_recommended_price = round(recommended_price, 2)
@@ -92,3 +113,231 @@ class Calculator:
 
         net_profit = round((recommended_price - total_expenses), 2)
         return net_profit
+
+
+Totals = namedtuple('Totals', ['expenses', 'recommended_price', 'net_profit'])
+
+
+def _div_half_even(numerator: int, denominator: int) -> int:
+    """Divide integers rounding half to even, as round(Decimal) does."""
+    quotient, remainder = divmod(numerator, denominator)
+    twice_remainder = remainder * 2
+    if twice_remainder > denominator or (twice_remainder == denominator and quotient % 2):
+        return quotient + 1
+    return quotient
+
+
+def to_cents(value) -> int:
+    """
+    Convert a number to integer cents, rounding half to even. Raises
+    InvalidOperation for non-numbers, infinities and NaNs.
+    """
+    if isinstance(value, int):
+        return value * 100
+    if isinstance(value, (str, float)):
+        value = Decimal(value)
+    if not value.is_finite():
+        raise InvalidOperation(value)
+    numerator, denominator = value.as_integer_ratio()
+    return _div_half_even(numerator * 100, denominator)
+
+
+def from_cents(cents: int) -> Decimal:
+    """Convert integer cents to Decimal with two decimal places."""
+    return Decimal(cents).scaleb(-2)
+
+
+class FixedPointCalculator:
+    """
+    Calculations in integer minor units (cents).
+
+    Rounding policy: ROUND_HALF_EVEN to whole cents, applied exactly where
+    the Decimal path rounds: to every input (as UserInputHandler does), to
+    total expenses and to the recommended price. The margin is used as an
+    exact ratio. Intermediate results are exact Python integers, so results
+    are identical to UserInputHandler and Calculator; amounts are converted
+    to Decimal only by get_totals().
+    """
+
+    def __init__(self, user_input: dict) -> None:
+        self.user_input = user_input
+        self.sum_cents = 0
+        self.percent_cents = 0
+        self.parse_user_input()
+
+    @classmethod
+    def from_sums(cls, sum_cents: int, percent_cents: int, margin) -> 'FixedPointCalculator':
+        """Create calculator for already summed inputs."""
+        calculator = cls({'margin_percent': margin})
+        calculator.sum_cents = sum_cents
+        calculator.percent_cents = percent_cents
+        return calculator
+
+    def add_value(self, field: str, value, kind: str) -> None:
+        """Add value to the sum or percent total."""
+        try:
+            cents = to_cents(value)
+        except InvalidOperation:
+            logger.info(f"Invalid input for field '{field}': {value}")
+            return
+
+        if kind == PERCENT:
+            self.percent_cents += cents
+        else:
+            self.sum_cents += cents
+
+    def parse_user_input(self) -> None:
+        """Split user input into sum and percent totals."""
+
+        for field, value in self.user_input.items():
+            if field == "other_fields":
+                for field_name, field_value, kind in iter_other_fields(value):
+                    self.add_value(field_name, field_value, kind)
+            elif value is not None:  # Missing inputs count as zero.
+                kind = field_kind(field)
+                if kind != MARGIN:
+                    self.add_value(field, value, kind)
+
+    def get_total_expenses(self) -> int:
+        """Calculate total expenses in cents."""
+        # sum * (1 + percent / 100) with both operands in cents.
+        return _div_half_even(self.sum_cents * (10_000 + self.percent_cents), 10_000)
+
+    def get_recommended_price(self, total_expenses: int) -> int:
+        """Returns recommended price in cents."""
+        margin = self.user_input.get('margin_percent') or 0
+        numerator, denominator = (margin if isinstance(margin, int)
+                                  else Decimal(margin)).as_integer_ratio()
+        scale = 100 * denominator
+        return _div_half_even(total_expenses * (scale + numerator), scale)
+
+    @staticmethod
+    def get_net_profit(total_expenses: int, recommended_price: int) -> int:
+        """Returns estimated net profit in cents."""
+        return recommended_price - total_expenses
+
+    def get_totals(self) -> Totals:
+        """Returns expenses, recommended price and net profit as Decimals."""
+
+        expenses = self.get_total_expenses()
+        recommended_price = self.get_recommended_price(expenses)
+        net_profit = self.get_net_profit(expenses, recommended_price)
+        return Totals(expenses=from_cents(expenses),
+                      recommended_price=from_cents(recommended_price),
+                      net_profit=from_cents(net_profit))
+
+
+def calculate_product(user_input: dict) -> Totals:
+    """
+    Returns expenses, recommended price and net profit for user input.
+    Uses the arithmetic backend selected by settings.CALCULATOR_ARITHMETIC.
+    """
+
+    if settings.CALCULATOR_ARITHMETIC == 'fixed_point':
+        return FixedPointCalculator(user_input).get_totals()
+
+    lists = UserInputHandler(user_input).parse_user_input()
+    calculate = Calculator(sum_values=lists.sum_values,
+                           percent_values=lists.percent_values,
+                           user_input=user_input)
+
+    expenses = calculate.get_total_expenses()
+    recommended_price = calculate.get_recommended_price(expenses)
+    net_profit = calculate.get_net_profit(expenses, recommended_price)
+    return Totals(expenses=expenses,
+                  recommended_price=recommended_price,
+                  net_profit=net_profit)
+
+
+BatchResults = namedtuple('BatchResults', ['expenses', 'recommended_price', 'net_profit'])
+
+# Inputs are taken at the precision of the DecimalField(decimal_places=4) columns.
+UNITS_PER_CENT = 100
+UNITS_SCALE = 10_000
+
+
+def _round_half_even_div(numerator, denominator: int):
+    """Divide integer arrays rounding half to even, as round(Decimal) does."""
+    quotient = numerator // denominator
+    twice_remainder = (numerator % denominator) * 2
+    round_up = ((twice_remainder > denominator) |
+                ((twice_remainder == denominator) & (quotient % 2 == 1)))
+    return np.where(round_up, quotient + 1, quotient)
+
+
+def _checked_product(left, right):
+    """Multiply integer arrays, falling back to Python ints on int64 overflow."""
+    if left.size and int(np.abs(left).max()) * int(np.abs(right).max()) >= 2 ** 63:
+        return left.astype(object) * right.astype(object)
+    return left * right
+
+
+class BatchCalculator:
+    """
+    Vectorized calculations for many products at once.
+
+    Columns are keyed by field name and classified the same way as in
+    UserInputHandler: 'margin_percent' is the margin, names containing
+    'percent' are percent values and everything else is summed. Missing
+    values (None) count as zero. Results match Calculator to the cent.
+    """
+
+    def __init__(self, columns: dict) -> None:
+        self.columns = columns
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError('All columns must have the same length.')
+        self.rows = lengths.pop() if lengths else 0
+
+    def _to_units(self, values) -> np.ndarray:
+        """Convert a column to integer ten-thousandths."""
+        if isinstance(values, np.ndarray) and values.dtype != object:
+            array = values.astype(np.float64)
+        else:
+            array = np.fromiter((0.0 if value is None else float(value) for value in values),
+                                dtype=np.float64, count=len(values))
+        return np.rint(array * UNITS_SCALE).astype(np.int64)
+
+    def _to_cents(self, values) -> np.ndarray:
+        """Convert a column to integer cents, rounding like UserInputHandler."""
+        return _round_half_even_div(self._to_units(values), UNITS_PER_CENT)
+
+    def calculate_cents(self) -> BatchResults:
+        """Returns expenses, recommended price and net profit in integer cents."""
+
+        sum_cents = np.zeros(self.rows, dtype=np.int64)
+        percent_cents = np.zeros(self.rows, dtype=np.int64)
+        margin_units = np.zeros(self.rows, dtype=np.int64)
+
+        for field, values in self.columns.items():
+            kind = field_kind(field)
+            if kind == MARGIN:
+                margin_units = self._to_units(values)
+            elif kind == PERCENT:
+                percent_cents += self._to_cents(values)
+            else:
+                sum_cents += self._to_cents(values)
+
+        # expenses = sum * (1 + percent / 100), in cents.
+        expenses = _round_half_even_div(
+            _checked_product(sum_cents, percent_cents + UNITS_SCALE), UNITS_SCALE)
+        # recommended price = expenses * (1 + margin / 100), margin in 1e-4 units.
+        price_scale = UNITS_SCALE * 100
+        recommended_price = _round_half_even_div(
+            _checked_product(expenses, margin_units + price_scale), price_scale)
+        net_profit = recommended_price - expenses
+
+        return BatchResults(expenses=expenses,
+                            recommended_price=recommended_price,
+                            net_profit=net_profit)
+
+    @staticmethod
+    def to_decimals(cents) -> list:
+        """Convert an array of integer cents to a list of Decimals."""
+        return [Decimal(int(value)).scaleb(-2) for value in cents]
+
+    def calculate(self) -> BatchResults:
+        """Returns expenses, recommended price and net profit as Decimal lists."""
+
+        results = self.calculate_cents()
+        return BatchResults(*(self.to_decimals(column) for column in results))
@@ -0,0 +1,138 @@
+"""Incremental parsing and rendering of streamed JSON request bodies."""
+import codecs
+import itertools
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+CHUNK_SIZE = 64 * 1024
+MAX_ITEM_SIZE = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+class StreamItemError(ValueError):
+    """Raised for an item of the stream that can not be decoded."""
+
+
+def _read_chunks(stream, chunk_size):
+    """Yield decoded text chunks read from a binary stream."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            return
+        yield decoder.decode(data)
+
+
+def _iter_lines(first, chunks):
+    """Yield NDJSON lines, keeping at most one line in memory."""
+    buffer = ''
+    for chunk in itertools.chain([first], chunks):
+        buffer += chunk
+        *lines, buffer = buffer.split('\n')
+        yield from lines
+        if len(buffer) > MAX_ITEM_SIZE:
+            raise StreamItemError('Item is too large.')
+    yield buffer
+
+
+def _iter_ndjson(first, chunks):
+    """Yield decoded NDJSON items or StreamItemError for invalid lines."""
+    for line in _iter_lines(first, chunks):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as error:
+            yield StreamItemError(f'Invalid JSON: {error.msg}.')
+
+
+def _iter_array(buffer, chunks):
+    """Yield items of a JSON array without loading the whole array."""
+    position = buffer.index('[') + 1
+    expect_item = True
+    eof = False
+
+    while True:
+        # Skip whitespace and item separators, reading more data as needed.
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            buffer, position = buffer[position:], 0
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+            else:
+                buffer += chunk
+
+        if position >= len(buffer):
+            raise StreamItemError('Unexpected end of JSON array.')
+        if buffer[position] == ']':
+            return
+        if not expect_item:
+            if buffer[position] != ',':
+                raise StreamItemError('Expected "," between array items.')
+            position += 1
+            expect_item = True
+            continue
+
+        try:
+            item, end = _decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as error:
+            item, end = error, None
+        # A value ending the buffer may be incomplete, e.g. a truncated number.
+        if end is None or (end == len(buffer) and not eof):
+            if eof:
+                raise StreamItemError(f'Invalid JSON: {item.msg}.')
+            if len(buffer) - position > MAX_ITEM_SIZE:
+                raise StreamItemError('Item is too large.')
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+            else:
+                buffer = buffer[position:] + chunk
+                position = 0
+            continue
+
+        yield item
+        position = end
+        expect_item = False
+        if position > CHUNK_SIZE:
+            buffer, position = buffer[position:], 0
+
+
+def iter_json_items(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yield items of a JSON array or NDJSON body read from a binary stream.
+
+    Only the current chunk and item are held in memory. Invalid NDJSON
+    lines are yielded as StreamItemError instances so that the caller
+    can report them and continue; a malformed JSON array can not be
+    resynchronised, so StreamItemError is raised instead.
+    """
+    chunks = _read_chunks(stream, chunk_size)
+    first = ''
+    for chunk in chunks:
+        first += chunk
+        if first.strip():
+            break
+    stripped = first.lstrip()
+    if not stripped:
+        return
+    if stripped.startswith('['):
+        yield from _iter_array(stripped, chunks)
+    else:
+        yield from _iter_ndjson(stripped, chunks)
+
+
+def to_ndjson(data) -> str:
+    """Render one NDJSON line."""
+    return _encoder.encode(data) + '\n'
@@ -0,0 +1,215 @@
+"""
+Idempotent synchronisation of a user's catalog with a product feed.
+
+Products are matched on (product_owner, sku) and upserted in batches with
+INSERT ... ON CONFLICT, together with their additional fields. Rows that
+did not change are not written, so syncing the same feed twice writes
+nothing the second time.
+
+Items may be partial: columns an item leaves out, other_fields included,
+keep their stored values, and are empty for new products. Columns sent as
+null are cleared.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from psycopg2.extras import execute_values
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .caching import items_cache
+from .models import ProductInformation
+from .other_fields import add_field_ids, new_field
+from .repricing import reprice_batch
+from .serializers import CreateProductSerializer
+from .streaming import StreamItemError
+
+PRODUCTS = ProductInformation._meta.db_table
+
+
+class SyncProductSerializer(CreateProductSerializer):
+    """
+    Product of a sync feed, identified by its sku.
+    """
+
+    sku = serializers.CharField(max_length=255)
+
+    def validate_sku(self, sku):
+        """Existing skus are updated, not rejected."""
+        return sku
+
+
+def sync_fields() -> list:
+    """Return product columns written by a sync, sku first and additional fields last."""
+    fields = [name for name, field in SyncProductSerializer().fields.items()
+              if name not in ('sku', 'other_fields') and not field.read_only]
+    return ['sku', *fields, 'other_fields']
+
+
+def upsert_products(user_id: int, products: list, fields: list) -> dict:
+    """
+    Insert or update products by sku, leaving unchanged rows untouched.
+    Returns sku -> True for inserted and False for updated products.
+    """
+    columns = [ProductInformation._meta.get_field(name).column for name in fields]
+    updates = ', '.join(f'{column} = EXCLUDED.{column}' for column in [*columns[1:], 'updated_at'])
+    current = ', '.join(f'p.{column}' for column in columns[1:])
+    excluded = ', '.join(f'EXCLUDED.{column}' for column in columns[1:])
+    sql = f"""
+        INSERT INTO {PRODUCTS} AS p (created_at, updated_at, product_owner_id, {', '.join(columns)})
+        VALUES %s
+        ON CONFLICT (product_owner_id, sku) DO UPDATE SET {updates}
+        WHERE ({current}) IS DISTINCT FROM ({excluded})
+        RETURNING p.sku, p.xmax = 0
+    """
+    placeholders = ['%s::jsonb' if name == 'other_fields' else '%s' for name in fields]
+    # Every row gets its own creation time, as rows sharing one would be paged by offset.
+    template = f"(clock_timestamp(), clock_timestamp(), {int(user_id)}, {', '.join(placeholders)})"
+    other_fields = ProductInformation._meta.get_field('other_fields')
+    with connection.cursor() as cursor:
+        rows = execute_values(cursor.cursor, sql,
+                              [[other_fields.get_prep_value(product[name]) if name == 'other_fields'
+                                else product.get(name) for name in fields]
+                               for product in products],
+                              template=template, page_size=len(products), fetch=True)
+    return dict(rows)
+
+
+def reconcile_fields(document: list, wanted: list) -> list:
+    """
+    Return document of additional fields equal to wanted with the fewest
+    changes: fields are matched by name and keep their id, only missing
+    fields are added and surplus ones are left out.
+    """
+    current = {}
+    for field in document:
+        current.setdefault(field['field_name'], []).append(field)
+    values = {}
+    added = []
+    for data in wanted:
+        matches = current.get(data['field_name'])
+        if matches:
+            values[matches.pop(0)['id']] = data['value']
+        else:
+            added.append(new_field(data))
+    return [{**field, 'value': values[field['id']]} for field in document
+            if field['id'] in values] + added
+
+
+def sync_batch(user_id: int, products: list, fields: list, report: dict) -> None:
+    """
+    Upsert one batch of validated products in a transaction. Columns and
+    additional fields missing from an item keep their stored values.
+    """
+    # A sku repeated within a batch can't be upserted twice, the last one wins.
+    products = list({product['sku']: product for product in products}.values())
+    with transaction.atomic():
+        stored = {row['sku']: row for row in (ProductInformation.objects.
+                                              select_for_update().
+                                              filter(product_owner=user_id,
+                                                     sku__in=[product['sku'] for product in products]).
+                                              values(*fields))}
+        for product in products:
+            row = stored.get(product['sku'], {'other_fields': []})
+            if 'other_fields' in product:
+                product['other_fields'] = reconcile_fields(row['other_fields'],
+                                                           product['other_fields'])
+            for name in fields:
+                product.setdefault(name, row.get(name))
+        add_field_ids([product['other_fields'] for product in products])
+
+        written = upsert_products(user_id, products, fields)
+        if written:
+            product_ids = list(ProductInformation.objects.
+                               filter(product_owner=user_id, sku__in=list(written)).
+                               values_list('id', flat=True))
+            reprice_batch(0, len(product_ids), product_ids=product_ids)
+
+    created = sum(written.values())
+    report['created'] += created
+    report['updated'] += len(written) - created
+    report['unchanged'] += len(products) - len(written)
+
+
+def remove_missing(user_id: int, skus: set, batch_size: int) -> int:
+    """
+    Delete user's products with a sku that is not in skus, in batches.
+    Raises ValueError for empty skus, which would delete every product.
+    """
+    if not skus:
+        raise ValueError('No skus to keep.')
+    deleted = 0
+    sql = f"""
+        WITH missing AS (
+            SELECT id FROM {PRODUCTS}
+            WHERE product_owner_id = %(user_id)s
+            AND sku IS NOT NULL AND NOT sku = ANY(%(skus)s)
+            LIMIT %(batch_size)s
+        )
+        DELETE FROM {PRODUCTS} WHERE id IN (SELECT id FROM missing)
+    """
+    skus = list(skus)
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, {'user_id': user_id, 'skus': skus, 'batch_size': batch_size})
+            count = cursor.rowcount
+            items_cache.invalidate(user_id)
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+def add_error(report: dict, index: int, errors) -> None:
+    """Count failed item, keeping its errors up to the configured maximum."""
+    report['failed'] += 1
+    if len(report['errors']) < settings.CALCULATOR_IMPORT_MAX_ERRORS:
+        report['errors'].append({'index': index, 'errors': errors})
+
+
+def sync_products(user_id: int, items, remove_missing_products: bool = False,
+                  batch_size: int = None) -> dict:
+    """
+    Synchronise user's catalog with feed items, committing every batch.
+    Invalid items are reported by index and skipped. With
+    remove_missing_products, products whose sku is not in the feed are
+    deleted once the whole feed was read; products without a sku are kept,
+    and nothing is deleted when part of the feed could not be read or no
+    sku was received, so an empty feed never empties the catalog.
+    """
+    batch_size = batch_size or settings.CALCULATOR_SYNC_BATCH_SIZE
+    validator = SyncProductSerializer()
+    fields = sync_fields()
+    report = {'created': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0,
+              'failed': 0, 'errors': []}
+    skus = set()
+    batch = []
+    complete = True
+    index = 0
+
+    try:
+        for item in items:
+            if isinstance(item, StreamItemError):
+                add_error(report, index, {'non_field_errors': [str(item)]})
+                # The sku of an unreadable item is unknown.
+                complete = False
+            else:
+                if isinstance(item, dict) and isinstance(item.get('sku'), str):
+                    # Products of invalid items are not removed either.
+                    skus.add(item['sku'])
+                try:
+                    batch.append(validator.run_validation(item))
+                except ValidationError as error:
+                    add_error(report, index, error.detail)
+            if len(batch) == batch_size:
+                sync_batch(user_id, batch, fields, report)
+                batch = []
+            index += 1
+    except StreamItemError as error:
+        # The rest of the body can't be read, so the feed is incomplete.
+        add_error(report, index, {'non_field_errors': [str(error)]})
+        complete = False
+    if batch:
+        sync_batch(user_id, batch, fields, report)
+
+    if remove_missing_products and complete and skus:
+        report['deleted'] = remove_missing(user_id, skus, batch_size)
+    return report
@@ -1,14 +1,97 @@
 import os
-from celery import shared_task
-from django.conf.global_settings import MEDIA_ROOT
-from django.contrib.auth import get_user_model
-from .import_export import write_to_csv
+from celery import chord, shared_task
+from django.conf import settings
+from .changes import purge_tombstones
+from .exports import (ExportSlotsFull, begin_export, fail_export, merge_export_shards,
+                      purge_expired_exports, release_planning_slot, renew_export_leases,
+                      write_shards, write_slotted_shard)
+from .import_export import import_from_csv
+from .repricing import reprice_products
+
+
+@shared_task(bind=True, max_retries=None)
+def generate_csv_task(self, job_id):
+    """
+    Celery task for writing the CSV file of an export job. Goes back to the
+    queue while the user's export slots are taken. Exports of several
+    shards are written by a chord of shard tasks taking a slot each,
+    merged by the last one.
+    """
+    try:
+        plan = begin_export(job_id)
+    except ExportSlotsFull as error:
+        raise self.retry(exc=error, countdown=settings.CALCULATOR_EXPORT_RETRY_DELAY)
+    if plan is None:
+        return None  # Written by an earlier run.
+    if len(plan['shards']) == 1:
+        return write_shards(plan)
+    plan = release_planning_slot(plan)
+    shards = [write_export_shard_task.si(plan, index) for index in range(len(plan['shards']))]
+    merge = merge_export_shards_task.si(plan).on_error(fail_export_task.si(plan))
+    try:
+        chord(shards)(merge)
+    except Exception:
+        fail_export(plan)
+        raise
+    return plan['file_path']
+
+
+@shared_task(bind=True, max_retries=None)
+def write_export_shard_task(self, plan, index):
+    """
+    Celery task for writing one shard of an export, returns its number of
+    rows. Goes back to the queue while the user's export slots are taken.
+    """
+    try:
+        return write_slotted_shard(plan, index)
+    except ExportSlotsFull as error:
+        raise self.retry(exc=error, countdown=settings.CALCULATOR_EXPORT_RETRY_DELAY)
+
+
+@shared_task
+def merge_export_shards_task(plan):
+    """Celery task for merging the shards of an export into its file."""
+    return merge_export_shards(plan)
+
+
+@shared_task
+def fail_export_task(plan):
+    """Celery task for cleaning up an export whose shard failed."""
+    fail_export(plan)
+
+
+@shared_task
+def renew_export_leases_task():
+    """Celery task for keeping the leases of exports with queued shards."""
+    return renew_export_leases()
+
+
+@shared_task
+def purge_exports_task():
+    """Celery task for deleting expired export files."""
+    return purge_expired_exports()
 
 
 @shared_task
-def generate_csv_task(user_id):
-    """Celery task for generating CSV file."""
-    user = get_user_model().objects.get(id=user_id)
-    file_path = os.path.join(MEDIA_ROOT, f'products_{user_id}.csv')
-    write_to_csv(user, file_path)
-    return file_path
+def reprice_products_task(user_id=None):
+    """Celery task for recalculating stored totals of user's or all products."""
+    return reprice_products(user_id)
+
+
+@shared_task
+def purge_tombstones_task():
+    """Celery task for deleting tombstones older than the retention period."""
+    return purge_tombstones()
+
+
+@shared_task(bind=True)
+def import_csv_task(self, user_id, file_path):
+    """Celery task for importing products from uploaded CSV file."""
+    def report_progress(report):
+        self.update_state(state='PROGRESS', meta={'user_id': user_id, **report})
+
+    try:
+        report = import_from_csv(user_id, file_path, on_progress=report_progress)
+    finally:
+        os.remove(file_path)
+    return {'user_id': user_id, **report}
@@ -0,0 +1,109 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from calculator.analytics import find_summary_drift, get_summary, rebuild_summaries
+from calculator.bulk import bulk_delete_products
+from calculator.models import AdditionalField, CatalogSummary, ProductInformation
+from calculator.repricing import reprice_products
+from calculator.sync import sync_products
+from calculator.tests.test_repricing import create_products
+
+URL_ANALYTICS = reverse('calculator:analytics_products')
+URL_ITEM = reverse('calculator:item-list')
+
+
+class CatalogSummaryTest(TestCase):
+    """Test catalog summaries are kept up to date by every write."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='analytics@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def assert_no_drift(self):
+        self.assertEqual(find_summary_drift(), [])
+
+    def test_summary_of_writes(self):
+        """Test creates, updates and deletes of every kind keep the summary exact."""
+        products = create_products(self.user, 20)
+        other_user = get_user_model().objects.create(email='other-analytics@example.com')
+        create_products(other_user, 5, seed=1)
+        reprice_products()
+        self.assert_no_drift()
+
+        self.client.post(URL_ITEM, {'name': 'New', 'quantity': 3, 'buying_price': '10',
+                                    'margin_percent': '150'}, format='json')
+        self.client.patch(reverse('calculator:item-detail', args=[products[0].pk]),
+                          {'quantity': 7, 'margin_percent': '-5'}, format='json')
+        field = AdditionalField.objects.filter(product__in=products).first()
+        self.client.patch(reverse('calculator:other-field-detail', args=[field.pk]),
+                          {'value': '99.5'}, format='json')
+        self.client.delete(reverse('calculator:item-detail', args=[products[1].pk]))
+        bulk_delete_products(self.user, [product.pk for product in products[2:5]])
+        sync_products(self.user.pk, [{'sku': 'SYNC-1', 'name': 'Synced', 'quantity': 2,
+                                      'buying_price': '5'}])
+        self.assert_no_drift()
+
+        summary = get_summary(self.user.pk)
+        products = ProductInformation.objects.filter(product_owner=self.user)
+        self.assertEqual(summary.product_count, products.count())
+        self.assertEqual(summary.inventory_value,
+                         products.aggregate(value=Sum(F('quantity') * F('expenses')))['value'])
+        self.assertEqual(summary.margin_below_0, products.filter(margin_percent__lt=0).count())
+        best = products.exclude(net_profit=None).order_by('-net_profit', '-id')[:5]
+        self.assertEqual([item['id'] for item in summary.top_products], [product.pk for product in best])
+
+    def test_endpoint(self):
+        """Test the summary is read with one query, empty for users without products."""
+        response = self.client.get(URL_ANALYTICS)
+        self.assertEqual(response.data['product_count'], 0)
+        self.assertEqual(response.data['top_products'], [])
+
+        ProductInformation.objects.create(name='Product', product_owner=self.user, quantity=4,
+                                          margin_percent=30, buying_price=10)
+        reprice_products(self.user.pk)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(URL_ANALYTICS)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['product_count'], 1)
+        product = ProductInformation.objects.get(product_owner=self.user)
+        self.assertEqual(response.data['inventory_value'], 4 * product.expenses)
+        self.assertEqual(response.data['projected_profit'], 4 * product.net_profit)
+        self.assertEqual(response.data['margin_distribution']['25-50'], 1)
+        self.assertEqual(response.data['top_products'][0]['net_profit'], float(product.net_profit))
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT')]), 1)
+
+    def test_user_delete(self):
+        """Test deleting a user with products deletes the summary."""
+        create_products(self.user, 3)
+
+        self.user.delete()
+
+        self.assertFalse(CatalogSummary.objects.exists())
+
+    def test_drift_check_and_rebuild(self):
+        """Test drift is found and repaired by a rebuild."""
+        create_products(self.user, 5)
+        CatalogSummary.objects.filter(pk=self.user.pk).update(product_count=1, top_products=[])
+
+        out = StringIO()
+        call_command('check_catalog_summary', stdout=out)
+        self.assertIn('1 summaries drifted', out.getvalue())
+
+        call_command('check_catalog_summary', '--repair', stdout=out)
+        self.assert_no_drift()
+        self.assertEqual(get_summary(self.user.pk).product_count, 5)
+
+        CatalogSummary.objects.all().delete()
+        self.assertEqual(rebuild_summaries(batch_size=1), get_user_model().objects.count())
+        self.assert_no_drift()
@@ -0,0 +1,190 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from calculator.bulk import bulk_update_products
+from calculator.models import AdditionalField, ProductInformation
+from calculator.repricing import change_other_field
+from calculator.tests.test_repricing import add_field, calculate_with_calculator, create_products
+
+URL_BULK = reverse('calculator:item-bulk-create')
+
+
+def product_item(number, **params):
+    """Create bulk create item with additional fields."""
+    item = {'name': f'Product {number}', 'sku': f'BULK-{number}', 'buying_price': '10.125',
+            'margin_percent': '20', 'marketplace_commission_percent': '5',
+            'other_fields': [{'field_name': 'advertising', 'value': '2.5'},
+                             {'field_name': 'tax_percent', 'value': '10'}]}
+    item.update(params)
+    return item
+
+
+class BulkProductsTest(TransactionTestCase):
+    """
+    Test bulk create, partial update and delete of items.
+    Bulk actions run outside of the request transaction, like in production.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='bulk@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def assert_totals_match_calculator(self, product_ids):
+        products = ProductInformation.objects.filter(pk__in=product_ids)
+        for product in products:
+            self.assertEqual((product.expenses, product.recommended_price, product.net_profit),
+                             calculate_with_calculator(product))
+
+    def count_queries(self, method, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(URL_BULK, data, format='json')
+        return response, len(queries)
+
+    def test_create_in_fixed_number_of_queries(self):
+        """Test products and fields are created with totals, queries don't grow with the batch."""
+        response, small = self.count_queries('post', [product_item(i) for i in range(2)])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response, large = self.count_queries('post', [product_item(i) for i in range(2, 50)])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(small, large)
+        self.assertEqual([item['sku'] for item in response.data], [f'BULK-{i}' for i in range(2, 50)])
+        self.assertEqual(len(response.data[0]['other_fields']), 2)
+        self.assertIsNotNone(response.data[0]['expenses'])
+        self.assertEqual(AdditionalField.objects.
+                         filter(product__product_owner=self.user).count(), 100)
+        self.assert_totals_match_calculator([item['id'] for item in response.data])
+
+    def test_create_all_or_nothing(self):
+        """Test invalid items are reported by index and nothing is created."""
+        ProductInformation.objects.create(name='Taken', sku='BULK-0', product_owner=self.user)
+        items = [product_item(0), product_item(1), product_item(2, name=''), product_item(1)]
+
+        response = self.client.post(URL_BULK, items, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([sorted(error) for error in response.data], [['sku'], [], ['name'], ['sku']])
+        self.assertEqual(ProductInformation.objects.filter(product_owner=self.user).count(), 1)
+
+    @override_settings(CALCULATOR_BULK_MAX_ITEMS=2)
+    def test_batch_size_limited(self):
+        """Test batches above the limit are rejected."""
+        response = self.client.post(URL_BULK, [product_item(i) for i in range(3)], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_partial_update_in_fixed_number_of_queries(self):
+        """Test products and their fields are updated and repriced in a fixed number of queries."""
+        products = create_products(self.user, 30)
+        fields = {field.product_id: field for field in
+                  AdditionalField.objects.filter(product__in=products)}
+
+        def other_fields(product):
+            changed = [{'id': fields[product.pk].pk, 'value': '7'}] if product.pk in fields else []
+            return [{'field_name': 'shipping', 'value': '1.5'}] + changed
+
+        def items(products):
+            return [{'id': product.pk, 'buying_price': '99.995', 'other_fields': other_fields(product)}
+                    for product in products]
+
+        response, small = self.count_queries('patch', items(products[:3]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, large = self.count_queries('patch', items(products[3:]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(small, large)
+        self.assertEqual({item['buying_price'] for item in response.data}, {Decimal('99.9950')})
+        self.assertEqual(AdditionalField.objects.
+                         filter(product__in=products, field_name='shipping').count(), 30)
+        for field in fields.values():
+            field.refresh_from_db()
+            self.assertEqual(field.value, Decimal('7'))
+        self.assert_totals_match_calculator([product.pk for product in products])
+
+    def test_partial_update_waits_for_concurrent_change(self):
+        """Test products are locked when read, so a concurrent field change isn't overwritten."""
+        product = ProductInformation.objects.create(name='Product', product_owner=self.user)
+        field = add_field(product, 'advertising', Decimal('1'))
+
+        def update():
+            try:
+                bulk_update_products(self.user, [{'id': product.pk, 'other_fields': [
+                    {'field_name': 'shipping', 'value': '2'}]}], {})
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            change_other_field(product.pk, field.pk, {'value': Decimal('5')})
+            thread = threading.Thread(target=update)
+            thread.start()
+            # The update reads the product while the change isn't committed.
+            time.sleep(0.3)
+        thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual([(field['field_name'], field['value']) for field in product.other_fields],
+                         [('advertising', Decimal('5')), ('shipping', Decimal('2'))])
+        self.assert_totals_match_calculator([product.pk])
+
+    def test_partial_update_other_users_product(self):
+        """Test other users' products are not found and nothing is updated."""
+        own = create_products(self.user, 1)[0]
+        other_user = get_user_model().objects.create(email='other-bulk@example.com')
+        other = create_products(other_user, 1)[0]
+
+        response = self.client.patch(URL_BULK, [{'id': own.pk, 'name': 'Renamed'},
+                                                {'id': other.pk, 'name': 'Renamed'}], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('id', response.data[1])
+        own.refresh_from_db()
+        self.assertEqual(own.name, 'Product 0')
+
+    def test_partial_update_sku_conflicts(self):
+        """Test a sku used by another product is rejected, swapping own sku is not."""
+        first, second = (ProductInformation.objects.create(name=sku, sku=sku, product_owner=self.user)
+                         for sku in ('A', 'B'))
+
+        response = self.client.patch(URL_BULK, [{'id': first.pk, 'sku': 'B'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.patch(URL_BULK, [{'id': first.pk, 'sku': 'C'},
+                                                {'id': second.pk, 'sku': 'A'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(CALCULATOR_BULK_DELETE_CHUNK_SIZE=2)
+    def test_delete_in_chunks(self):
+        """Test own products are deleted with one statement per chunk, with their fields."""
+        products = create_products(self.user, 5)
+        other_user = get_user_model().objects.create(email='other-bulk@example.com')
+        other = create_products(other_user, 1)[0]
+        ids = [product.pk for product in products[:4]] + [other.pk]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(URL_BULK, {'ids': ids}, format='json')
+
+        self.assertEqual(response.data, {'deleted': 4})
+        deletes = [query for query in queries
+                   if query['sql'].startswith('DELETE FROM "calculator_productinformation" ')]
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(list(ProductInformation.objects.filter(product_owner=self.user)), [products[4]])
+        self.assertTrue(ProductInformation.objects.filter(pk=other.pk).exists())
+        self.assertFalse(AdditionalField.objects.filter(product_id__in=ids[:4]).exists())
+
+    def test_delete_requires_ids(self):
+        """Test delete without ids is rejected."""
+        response = self.client.delete(URL_BULK, {'ids': []}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
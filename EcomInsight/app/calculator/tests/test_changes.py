@@ -0,0 +1,128 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from calculator.changes import purge_tombstones
+from calculator.models import ProductInformation, ProductTombstone
+from calculator.tests.test_repricing import add_field, create_products
+
+URL_CHANGES = reverse('calculator:item-changes')
+URL_ITEM = reverse('calculator:item-list')
+
+
+def detail_url(product_id):
+    return reverse('calculator:item-detail', args=[product_id])
+
+
+class ChangesFeedTest(TransactionTestCase):
+    """
+    Test the changes feed of items.
+    Changes are only reported once their transaction committed, so every
+    request commits like in production.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='changes@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.products = create_products(self.user, 3)
+
+    def changes(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get(URL_CHANGES, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_full_sync_without_cursor(self):
+        """Test all products are returned as items of the list."""
+        other_user = get_user_model().objects.create(email='other-changes@example.com')
+        create_products(other_user, 2)
+
+        data = self.changes()
+
+        items = self.client.get(URL_ITEM).data['results']
+        self.assertEqual([change['item'] for change in data['results']], items)
+        self.assertFalse(data['has_more'])
+        self.assertEqual(self.changes(data['cursor'])['results'], [])
+
+    def test_changes_since_cursor(self):
+        """Test updated, deleted and created products are reported in commit order."""
+        cursor = self.changes()['cursor']
+        updated, deleted, fields_changed = self.products
+        field = add_field(fields_changed, 'promotion', Decimal(1))
+
+        self.client.patch(detail_url(updated.pk), {'name': 'Renamed'}, format='json')
+        self.client.delete(detail_url(deleted.pk))
+        self.client.patch(reverse('calculator:other-field-detail', args=[field.pk]),
+                          {'field_name': 'marketing'}, format='json')
+        self.client.post(URL_ITEM, {'name': 'New'}, format='json')
+        created = ProductInformation.objects.get(name='New')
+
+        data = self.changes(cursor)
+
+        self.assertEqual([(change['id'], change['deleted']) for change in data['results']],
+                         [(updated.pk, False), (deleted.pk, True),
+                          (fields_changed.pk, False), (created.pk, False)])
+        self.assertEqual(data['results'][0]['item']['name'], 'Renamed')
+        self.assertNotIn('item', data['results'][1])
+        self.assertEqual(data['results'][2]['item']['other_fields'][-1]['field_name'], 'marketing')
+
+    def test_unchanged_values_not_reported(self):
+        """Test writes of the same values and repricing without changes are not changes."""
+        cursor = self.changes()['cursor']
+        product = self.products[0]
+
+        self.client.patch(detail_url(product.pk), {'name': product.name}, format='json')
+        ProductInformation.objects.filter(pk=product.pk).update(quantity=product.quantity)
+
+        self.assertEqual(self.changes(cursor)['results'], [])
+
+    def test_pages_in_order(self):
+        """Test changes are paged by cursor with a query count independent of the page."""
+        create_products(self.user, 7)
+        seen = []
+        cursor = None
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.changes(cursor, page_size=4)
+            self.assertLessEqual(len(queries), 5)
+            seen.extend(change['id'] for change in data['results'])
+            cursor = data['cursor']
+            if not data['has_more']:
+                break
+
+        self.assertEqual(seen, list(ProductInformation.objects.order_by('change_txid', 'id').
+                                    values_list('id', flat=True)))
+
+    def test_invalid_and_expired_cursors(self):
+        """Test invalid cursors are rejected and expired ones require a full sync."""
+        cursor = self.changes()['cursor']
+
+        response = self.client.get(URL_CHANGES, {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with patch('calculator.changes.time.time', return_value=time.time() + 60 * 60 * 24 * 31):
+            response = self.client.get(URL_CHANGES, {'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_purge_tombstones(self):
+        """Test tombstones older than the retention are purged."""
+        ProductInformation.objects.filter(pk__in=[product.pk for product in self.products]).delete()
+        self.assertEqual(ProductTombstone.objects.filter(product_owner=self.user).count(), 3)
+        ProductTombstone.objects.filter(product_id=self.products[0].pk).update(
+            deleted_at=timezone.now() - timedelta(days=31))
+
+        self.assertEqual(purge_tombstones(batch_size=1), 1)
+        self.assertEqual(set(ProductTombstone.objects.values_list('product_id', flat=True)),
+                         {product.pk for product in self.products[1:]})
@@ -1,23 +1,38 @@
 from django.contrib.auth import get_user_model
 from rest_framework import status
 from rest_framework.test import APIClient
-from django.test import TestCase
+from django.core.cache import cache
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
-from calculator.models import ProductInformation, ProductInformationAdditionalFields
+from calculator.models import AdditionalField, ProductInformation
+from calculator.other_fields import add_field_ids
 from calculator.serializers import ProductInfoSerializer, ProductInformationAdditionalFieldsSerializer
+from calculator.services import calculate_product
+from calculator.caching import calculation_cache, items_cache
+from calculator.repricing import change_other_field, find_drift, reprice_products
+from calculator.tests.test_repricing import add_field, calculate_with_calculator
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from decimal import Decimal
+from unittest.mock import patch
+import itertools
 import json
+import threading
+import time
 
 URL_ITEM = reverse('calculator:item-list')
 URL_POST = reverse('calculator:calculate')
 
+sku_numbers = itertools.count(123)
+
 
 def create_user(email='example@example.com', password='test1234'):
     return get_user_model().objects.create(email=email, password=password)
 
 
 def create_product_input(user=None, **params):
-    """Create test product input."""
+    """Create test product input, skus are unique per call."""
 
     defaults = {
         "other_fields":
@@ -27,7 +42,7 @@ def create_product_input(user=None, **params):
             }
         ,
         "name": "Test",
-        "sku": "Test-123",
+        "sku": f"Test-{next(sku_numbers)}",
         "quantity": 500,
         "margin_percent": 25,
         "buying_price": 50,
@@ -44,11 +59,9 @@ def create_product_input(user=None, **params):
 
     if user:
         defaults["product_owner"] = user
-        product = ProductInformation.objects.create(**defaults)
-        other_fields_data['product_id'] = product.id
-        other_fields = ProductInformationAdditionalFields.objects.create(**other_fields_data)
-        product.other_fields.add(other_fields)
-        return product
+        other_fields_data['value'] = Decimal(other_fields_data['value'])
+        defaults["other_fields"] = add_field_ids([[other_fields_data]])[0]
+        return ProductInformation.objects.create(**defaults)
     return defaults
 
 
@@ -90,7 +103,7 @@ class ProductInformationTest(TestCase):
         """Test patch request for unauthenticated user."""
         create_product_input(user=self.user)
         created_product = ProductInformation.objects.get(name='Test')
-        other_field = ProductInformationAdditionalFields.objects.get(product=created_product)
+        other_field = AdditionalField.objects.get(product=created_product)
 
         _id = other_field.id
         payload = {'field_name': 'updated marketing',
@@ -113,10 +126,10 @@ class ProductInformationTest(TestCase):
         create_product_input(user=self.user)
         create_product_input(user=self.user)
 
-        product_object = ProductInformation.objects.all()
+        product_object = ProductInformation.objects.order_by('created_at', 'id')
         serializer = ProductInfoSerializer(product_object, many=True)
         res = self.client.get(URL_ITEM)
-        self.assertEqual(res.data, serializer.data)
+        self.assertEqual(res.data['results'], serializer.data)
 
 
 class ProductInformationAuthenticatedUserTest(TestCase):
@@ -135,6 +148,32 @@ class ProductInformationAuthenticatedUserTest(TestCase):
         self.assertEqual(response.data['name'], product['name'])
         self.assertIn('other_fields', response.data)
 
+    def test_create_product_duplicate_sku(self):
+        """Test creating a product with a sku the user already has fails."""
+        create_product_input(user=self.user, sku='Taken-1')
+        response = self.client.post(URL_ITEM, {'name': 'Other', 'sku': 'Taken-1'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('sku', response.data)
+
+    def test_concurrent_duplicate_sku(self):
+        """Test a sku taken after it was validated fails like a taken sku."""
+        product = create_product_input(user=self.user, sku='Other-1')
+        create_product_input(user=self.user, sku='Taken-2')
+        with patch.object(ProductInfoSerializer, 'validate_sku', lambda serializer, sku: sku):
+            create = self.client.post(URL_ITEM, {'name': 'Other', 'sku': 'Taken-2'})
+            update = self.client.patch(detail_url(product.id), {'sku': 'Taken-2'})
+
+        for response in (create, update):
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data['sku'], ['Product with this sku already exists.'])
+        self.assertEqual(ProductInformation.objects.filter(sku='Taken-2').count(), 1)
+
+    def test_update_product_keeps_own_sku(self):
+        """Test updating a product with its own sku is allowed."""
+        product = create_product_input(user=self.user, sku='Own-1')
+        response = self.client.patch(detail_url(product.id), {'name': 'Renamed', 'sku': 'Own-1'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_read_product(self):
         """Test reading a product's details as an authenticated user."""
         product = create_product_input(user=self.user)
@@ -164,7 +203,7 @@ class ProductInformationAuthenticatedUserTest(TestCase):
         create_product_input(user=self.user, name='Second Product')
         response = self.client.get(URL_ITEM)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
 
     def test_filter_products_by_name(self):
         """Test filtering products by name as an authenticated user."""
@@ -172,8 +211,8 @@ class ProductInformationAuthenticatedUserTest(TestCase):
         create_product_input(user=self.user, name='Second Product')
         response = self.client.get(URL_ITEM, {'name': 'Second Product'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['name'], 'Second Product')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['name'], 'Second Product')
 
     def test_filter_products_by_sku(self):
         """Test filtering products by sku as an authenticated user."""
@@ -181,8 +220,8 @@ class ProductInformationAuthenticatedUserTest(TestCase):
         create_product_input(user=self.user, sku='Second Product')
         response = self.client.get(URL_ITEM, {'sku': 'Second Product'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['sku'], 'Second Product')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['sku'], 'Second Product')
 
     def test_add_other_fields(self):
         """Test post request for other fields."""
@@ -203,7 +242,7 @@ class ProductInformationAuthenticatedUserTest(TestCase):
         product.refresh_from_db()
 
         # Check if the new other_fields have been added
-        new_field_exists = ProductInformationAdditionalFields.objects.filter(
+        new_field_exists = AdditionalField.objects.filter(
             product=product,
             field_name=new_field_name,
             value=Decimal(new_value)
@@ -214,7 +253,7 @@ class ProductInformationAuthenticatedUserTest(TestCase):
     def test_patch_other_fields(self):
         """Test patch request for other fields."""
         product = create_product_input(user=self.user)
-        other_field = ProductInformationAdditionalFields.objects.get(product=product)
+        other_field = AdditionalField.objects.get(product=product)
         _id = product.id
         payload = {
             "other_fields":
@@ -231,15 +270,15 @@ class ProductInformationAuthenticatedUserTest(TestCase):
         product.refresh_from_db()
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(product.other_fields.get().field_name, 'updated')
-        self.assertEqual(product.other_fields.get().value, 5000)
+        self.assertEqual(AdditionalField.objects.get(product=product).field_name, 'updated')
+        self.assertEqual(AdditionalField.objects.get(product=product).value, 5000)
         self.assertEqual(product.name, 'Updated Test')
         self.assertEqual(product.sku, 'Updated-123')
 
     def test_put_other_fields(self):
         """Test put request for other fields."""
         product = create_product_input(user=self.user)
-        other_field = ProductInformationAdditionalFields.objects.get(product=product)
+        other_field = AdditionalField.objects.get(product=product)
         _id = product.id
         payload = {
             "other_fields":
@@ -256,16 +295,356 @@ class ProductInformationAuthenticatedUserTest(TestCase):
         product.refresh_from_db()
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(product.other_fields.get().field_name, 'updated')
-        self.assertEqual(product.other_fields.get().value, 5000)
+        self.assertEqual(AdditionalField.objects.get(product=product).field_name, 'updated')
+        self.assertEqual(AdditionalField.objects.get(product=product).value, 5000)
         self.assertEqual(product.name, 'Updated Test')
         self.assertEqual(product.sku, 'Updated-123')
 
     def test_delete_other_fields(self):
         """Test delete request for other fields."""
         product = create_product_input(user=self.user)
-        other_field = ProductInformationAdditionalFields.objects.get(product=product)
+        other_field = AdditionalField.objects.get(product=product)
         _id = product.id
         response = self.client.delete(detail_url(_id))
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertFalse(ProductInformation.objects.filter(id=product.id).exists())
+
+    def test_other_fields_document(self):
+        """Test fields keep ids and order in the product document, found by id per user."""
+        product = create_product_input(user=self.user)
+        field = product.other_fields[0]
+        response = self.client.patch(detail_url(product.id), {'other_fields': [
+            {'id': field['id'], 'value': '7.5'}, {'field_name': 'packaging', 'value': '2'}]},
+            format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        product.refresh_from_db()
+        self.assertEqual((product.other_fields[0]['id'], product.other_fields[0]['value']),
+                         (field['id'], Decimal('7.5')))
+        self.assertEqual(product.other_fields[1]['field_name'], 'packaging')
+        self.assertGreater(product.other_fields[1]['id'], field['id'])
+
+        other_client = APIClient()
+        other_client.force_authenticate(user=create_user(email='other-document@example.com'))
+        url = reverse('calculator:other-field-detail', args=[field['id']])
+        self.assertEqual(other_client.patch(url, {'value': '1'}, format='json').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.patch(url, {'value': '1'}, format='json').data['value'],
+                         Decimal('1'))
+
+
+class ProductUpdateWritesTest(TestCase):
+    """Test updates write only changed columns."""
+
+    def setUp(self):
+        self.user = create_user(email='writes@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.product = create_product_input(user=self.user)
+        self.field = AdditionalField.objects.get(product=self.product)
+        reprice_products(self.user.pk)
+        self.product.refresh_from_db()
+
+    def patch(self, payload):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(detail_url(self.product.id), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        writes = [query['sql'] for query in queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        return response, writes
+
+    def assert_totals_match_calculator(self):
+        product = ProductInformation.objects.get(pk=self.product.pk)
+        self.assertEqual((product.expenses, product.recommended_price, product.net_profit),
+                         calculate_with_calculator(product))
+        self.assertEqual(find_drift(self.user.pk), [])
+
+    def test_unchanged_values_not_written(self):
+        """Test sending the stored values writes nothing."""
+        response, writes = self.patch({
+            'name': self.product.name, 'buying_price': '50',
+            'other_fields': [{'id': self.field.id, 'value': '100'}]})
+
+        self.assertEqual(writes, [])
+        self.assertEqual(response['X-Rows-Touched'], '0')
+
+    def test_name_change_skips_recalculation(self):
+        """Test a change without cost inputs writes only that column."""
+        with patch('calculator.serializers.calculate_product') as calculate:
+            response, writes = self.patch({'name': 'Renamed'})
+
+        calculate.assert_not_called()
+        self.assertEqual(len(writes), 1)
+        self.assertIn('"name"', writes[0])
+        self.assertIn('"updated_at"', writes[0])
+        self.assertNotIn('"expenses"', writes[0])
+        self.assertEqual(response['X-Rows-Touched'], '1')
+
+    def test_cost_change_recalculates_totals(self):
+        """Test changed cost input updates totals with the stored inputs."""
+        response, writes = self.patch({'buying_price': '75.125'})
+
+        self.assertEqual(len(writes), 1)
+        self.assertNotIn('"name"', writes[0])
+        self.assertEqual(response['X-Rows-Touched'], '1')
+        self.assert_totals_match_calculator()
+
+    @override_settings(CALCULATOR_ARITHMETIC='decimal')
+    def test_configured_arithmetic(self):
+        """Test totals are recalculated with the configured arithmetic, like creates."""
+        with patch('calculator.serializers.calculate_product', wraps=calculate_product) as calculate:
+            self.patch({'buying_price': '75.125'})
+
+        calculate.assert_called_once()
+        self.assertEqual(calculate.call_args.args[0]['buying_price'], Decimal('75.125'))
+        self.assert_totals_match_calculator()
+
+    def test_other_field_changes(self):
+        """Test only changed fields are written, renames within a kind keep totals."""
+        response, writes = self.patch({'other_fields': [{'id': self.field.id, 'field_name': 'promotion'}]})
+        self.assertEqual(len(writes), 1)
+        self.assertIn('"other_fields"', writes[0])
+        self.assertNotIn('"expenses"', writes[0])
+
+        response, writes = self.patch({'other_fields': [{'id': self.field.id, 'value': '10.555'},
+                                                        {'field_name': 'tax_percent', 'value': '5'}]})
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(response['X-Rows-Touched'], '1')
+        self.assertEqual(len(response.data['other_fields']), 2)
+        self.assert_totals_match_calculator()
+
+
+class ConcurrentProductUpdateTest(TransactionTestCase):
+    """Test updates don't overwrite concurrent changes of the product."""
+
+    def test_update_waits_for_field_change(self):
+        """Test the product is locked when read, so a concurrent field change isn't overwritten."""
+        user = create_user(email='concurrent@example.com')
+        product = ProductInformation.objects.create(name='Product', product_owner=user)
+        field = add_field(product, 'advertising', Decimal('1'))
+        responses = []
+
+        def update():
+            client = APIClient()
+            client.force_authenticate(user=user)
+            try:
+                responses.append(client.patch(detail_url(product.pk), {'other_fields': [
+                    {'field_name': 'shipping', 'value': '2'}]}, format='json'))
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            change_other_field(product.pk, field.pk, {'value': Decimal('5')})
+            thread = threading.Thread(target=update)
+            thread.start()
+            # The update reads the product while the change isn't committed.
+            time.sleep(0.3)
+        thread.join()
+
+        self.assertEqual(responses[0].status_code, status.HTTP_200_OK)
+        product.refresh_from_db()
+        self.assertEqual([(field['field_name'], field['value']) for field in product.other_fields],
+                         [('advertising', Decimal('5')), ('shipping', Decimal('2'))])
+        self.assertEqual((product.expenses, product.recommended_price, product.net_profit),
+                         calculate_with_calculator(product))
+
+
+class CalculationCacheTest(TestCase):
+    """Test memoized results of the calculate endpoint."""
+
+    def setUp(self):
+        self.client = APIClient()
+        calculation_cache.clear()
+        cache.clear()
+
+    def test_repeated_input_skips_calculation(self):
+        """Test repeated input is served from the in-process cache."""
+        product = create_product_input(name='Cached')
+        with patch('calculator.views.calculate_product',
+                   wraps=calculate_product) as calculate:
+            first = self.client.post(URL_POST, product)
+            second = self.client.post(URL_POST, product)
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(calculate.call_count, 1)
+        self.assertEqual(calculation_cache.stats()['local_hits'], 1)
+
+    def test_stats_logged(self):
+        """Test counters of the process are logged once the interval passed."""
+        product = create_product_input(name='Logged')
+        self.client.post(URL_POST, product)
+        calculation_cache.stats_log.logged -= settings.CALCULATOR_CACHE_STATS_INTERVAL
+
+        with self.assertLogs('calculator.caching', 'INFO') as logs:
+            self.client.post(URL_POST, product)
+            self.client.post(URL_POST, product)
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('calculate cache of process', logs.output[0])
+        self.assertIn('"misses": 1', logs.output[0])
+
+    def test_shared_tier_hit(self):
+        """Test result is read from the shared cache when the local tier misses."""
+        product = create_product_input(name='Shared')
+        first = self.client.post(URL_POST, product)
+        calculation_cache.local.clear()
+
+        with patch('calculator.views.calculate_product') as calculate:
+            second = self.client.post(URL_POST, product)
+
+        self.assertEqual(first.data, second.data)
+        calculate.assert_not_called()
+        self.assertEqual(calculation_cache.stats()['shared_hits'], 1)
+
+    def test_cache_disabled(self):
+        """Test every request is calculated when the cache is disabled."""
+        product = create_product_input(name='Disabled')
+        settings = {'ENABLED': False, 'MAX_SIZE': 10, 'TIMEOUT': 60}
+        with override_settings(CALCULATOR_RESULT_CACHE=settings), \
+                patch('calculator.views.calculate_product',
+                      wraps=calculate_product) as calculate:
+            self.client.post(URL_POST, product)
+            self.client.post(URL_POST, product)
+
+        self.assertEqual(calculate.call_count, 2)
+
+
+class ItemsListCacheTest(TestCase):
+    """Test per-user cache of rendered item lists."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(email='cached@example.com')
+        self.other_user = create_user(email='other@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_repeated_list_served_from_cache(self):
+        """Test second request returns the cached bytes without querying items."""
+        create_product_input(user=self.user)
+        first = self.client.get(URL_ITEM)
+
+        with patch('calculator.views.get_all_items_for_auth_user') as query:
+            second = self.client.get(URL_ITEM)
+
+        query.assert_not_called()
+        self.assertEqual(first.content, second.content)
+
+    def test_write_bumps_generation(self):
+        """Test updates through the API are visible in the next list."""
+        product = create_product_input(user=self.user)
+        self.client.get(URL_ITEM)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(detail_url(product.id), {'name': 'Renamed'})
+        response = self.client.get(URL_ITEM)
+
+        self.assertEqual(json.loads(response.content)['results'][0]['name'], 'Renamed')
+
+    def test_write_does_not_affect_other_users(self):
+        """Test one user's write keeps other users' generations."""
+        generation = items_cache.generation(self.other_user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(URL_ITEM, create_product_input())
+
+        self.assertEqual(items_cache.generation(self.other_user.pk), generation)
+        self.assertNotEqual(items_cache.generation(self.user.pk), generation)
+
+    def test_filters_cached_separately(self):
+        """Test name filter gets its own cached page."""
+        create_product_input(user=self.user)
+        create_product_input(user=self.user, name='Second Product')
+        self.client.get(URL_ITEM)
+
+        response = self.client.get(URL_ITEM, {'name': 'Second Product'})
+        cached = self.client.get(URL_ITEM, {'name': 'Second Product'})
+
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(json.loads(cached.content), json.loads(response.content))
+
+
+class ItemsPaginationTest(TestCase):
+    """Test keyset pagination of items."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(email='paginated@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_cursor_pages(self):
+        """Test pages follow (created_at, id) order and stay stable under inserts."""
+        products = [create_product_input(user=self.user, name=f'Product {i}') for i in range(5)]
+
+        first = self.client.get(URL_ITEM, {'page_size': 2})
+        create_product_input(user=self.user, name='Inserted')
+        second = self.client.get(first.data['next'])
+
+        self.assertNotIn('count', first.data)
+        self.assertEqual([item['id'] for item in first.data['results']],
+                         [product.id for product in products[:2]])
+        self.assertEqual([item['id'] for item in second.data['results']],
+                         [product.id for product in products[2:4]])
+
+    def test_page_size_capped(self):
+        """Test requested page size is capped by the maximum."""
+        for i in range(3):
+            create_product_input(user=self.user, name=f'Product {i}')
+
+        with patch('calculator.pagination.ItemsCursorPagination.max_page_size', 2):
+            response = self.client.get(URL_ITEM, {'page_size': 100})
+
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+
+class ItemsSearchTest(TestCase):
+    """Test searching and filtering items."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(email='searching@example.com')
+        self.other_user = create_user(email='other@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_search_ranked_by_similarity(self):
+        """Test closest names come first and unrelated names are excluded."""
+        create_product_input(user=self.user, name='Blue lamp shade for desk')
+        exact = create_product_input(user=self.user, name='Blue lamp')
+        create_product_input(user=self.user, name='Red chair')
+
+        response = self.client.get(URL_ITEM, {'search': 'blue lamp'})
+
+        names = [item['name'] for item in response.data['results']]
+        self.assertEqual(names[0], exact.name)
+        self.assertEqual(len(names), 2)
+
+    def test_search_matches_typos(self):
+        """Test similar names match without an exact substring."""
+        create_product_input(user=self.user, name='Leather wallet')
+
+        response = self.client.get(URL_ITEM, {'search': 'lether wallet'})
+
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_search_and_filters_scoped_to_user(self):
+        """Test other users' products are never returned."""
+        create_product_input(user=self.other_user, name='Blue lamp', sku='LAMP-1')
+
+        for params in ({'search': 'blue lamp'}, {'name': 'lamp'}, {'sku': 'LAMP-1'}):
+            response = self.client.get(URL_ITEM, params)
+            self.assertEqual(response.data['results'], [])
+
+    def test_search_paginated(self):
+        """Test search results are split into cursor pages."""
+        for i in range(3):
+            create_product_input(user=self.user, name=f'Blue lamp {i}')
+
+        first = self.client.get(URL_ITEM, {'search': 'blue lamp', 'page_size': 2})
+        second = self.client.get(first.data['next'])
+
+        ids = [item['id'] for item in first.data['results'] + second.data['results']]
+        self.assertEqual(len(set(ids)), 3)
+        self.assertIsNone(second.data['next'])
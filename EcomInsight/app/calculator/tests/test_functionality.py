@@ -1,6 +1,10 @@
 from decimal import Decimal
-from django.test import TestCase
-from calculator.services import UserInputHandler, Calculator
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from calculator.services import (UserInputHandler, Calculator, BatchCalculator,
+                                 FixedPointCalculator, calculate_product, to_cents)
+from calculator import schema
+from calculator.caching import LRUCache
 
 
 class UserInputHandlerTest(TestCase):
@@ -70,6 +74,59 @@ class UserInputHandlerTest(TestCase):
                              output.sum_values)  # Assuming all non-percent fields are treated as sum values
 
 
+class FieldSchemaTest(TestCase):
+    """ Test for compiled field classification. """
+
+    def setUp(self):
+        schema.field_kind_cache.clear()
+
+    def test_model_fields_classified_at_import(self):
+        """ Test ProductInformation fields are classified without the cache. """
+        self.assertEqual(schema.field_kind('margin_percent'), schema.MARGIN)
+        self.assertEqual(schema.field_kind('marketplace_commission_percent'), schema.PERCENT)
+        self.assertEqual(schema.field_kind('buying_price'), schema.SUM)
+        self.assertEqual(schema.field_kind_cache.stats()['misses'], 0)
+
+    def test_other_field_names_cached(self):
+        """ Test additional field names are classified once and then hit the cache. """
+        data = {"other_fields": [{"field_name": "tax_percent", "value": Decimal('5')},
+                                 {"field_name": "marketing", "value": Decimal('15')}]}
+
+        UserInputHandler(data).parse_user_input()
+        output = UserInputHandler(data).parse_user_input()
+
+        self.assertListEqual([Decimal('5.00')], output.percent_values)
+        self.assertListEqual([Decimal('15.00')], output.sum_values)
+        stats = schema.field_kind_cache.stats()
+        self.assertEqual((stats['misses'], stats['hits']), (2, 2))
+
+    def test_other_field_named_margin_is_percent(self):
+        """ Test additional field named margin_percent is still a percent value. """
+        data = {"margin_percent": Decimal('10'),
+                "other_fields": [{"field_name": "margin_percent", "value": Decimal('5')}]}
+
+        output = UserInputHandler(data).parse_user_input()
+
+        self.assertListEqual([Decimal('5.00')], output.percent_values)
+
+    def test_invalid_field_name_type(self):
+        """ Test non string field names are rejected. """
+        data = {"other_fields": [{"field_name": 5, "value": Decimal('5')}]}
+
+        with self.assertRaises(TypeError):
+            UserInputHandler(data).parse_user_input()
+
+    def test_cache_eviction(self):
+        """ Test least recently used names are evicted. """
+        with patch.object(schema, 'field_kind_cache', LRUCache(maxsize=2)) as cache:
+            for name in ['a', 'b', 'a', 'c']:
+                schema.other_field_kind(name)
+
+            self.assertEqual(cache.stats()['evictions'], 1)
+            self.assertIsNotNone(cache.get('a'))
+            self.assertIsNone(cache.get('b'))
+
+
 class CalculationsTest(TestCase):
     """ Test for Calculator. Expenses, recommended price, and net profit calculations. """
 
@@ -141,3 +198,121 @@ class CalculationsTest(TestCase):
 
         net_profit = calculator.get_net_profit(total_expenses=total_expenses, recommended_price=recommended_price)
         self.assertEqual(net_profit, Decimal('25.00'))
+
+
+class FixedPointCalculatorTest(TestCase):
+    """ Test for FixedPointCalculator. Integer results must match Calculator. """
+
+    inputs = [
+        {"name": "Test", "sku": "SKU-1", "quantity": 3,
+         "buying_price": Decimal('10.0050'), "packaging": Decimal('0.0150'),
+         "marketplace_commission_percent": Decimal('6.125'), "margin_percent": Decimal('25'),
+         "other_fields": [{"field_name": "tax_percent", "value": Decimal('12.345')},
+                          {"field_name": "advertising", "value": Decimal('-3.335')}]},
+        {"buying_price": Decimal('142.0800'), "margin_percent": Decimal('-10.5555')},
+        {"buying_price": 10.05, "warehouse": '70.125', "margin_percent": 0.1},
+        {"buying_price": Decimal('99999.9999'), "a_percent": Decimal('99999.9999'),
+         "margin_percent": Decimal('99999.9999')},
+        {},
+    ]
+
+    def test_to_cents_rounds_half_even(self):
+        """ Test conversion to cents rounds like round(Decimal, 2). """
+        for value in ['0.005', '0.015', '-0.005', '-0.015', '2.675', '1.00001']:
+            self.assertEqual(Decimal(to_cents(Decimal(value))).scaleb(-2),
+                             round(Decimal(value), 2))
+
+    def test_matches_decimal_calculator(self):
+        """ Test results are identical to the Decimal path. """
+        for data in self.inputs:
+            with override_settings(CALCULATOR_ARITHMETIC='decimal'):
+                expected = calculate_product(data)
+            self.assertEqual(FixedPointCalculator(data).get_totals(), expected)
+
+    def test_calculate_product_uses_fixed_point(self):
+        """ Test calculate_product returns the same totals with fixed point arithmetic. """
+        data = self.inputs[0]
+        with override_settings(CALCULATOR_ARITHMETIC='fixed_point'):
+            fixed_point = calculate_product(data)
+        with override_settings(CALCULATOR_ARITHMETIC='decimal'):
+            decimal = calculate_product(data)
+        self.assertEqual(fixed_point, decimal)
+
+    def test_invalid_data_types(self):
+        """ Test handling of invalid other fields. """
+        data = {"other_fields": [{"field_name": "percent_value", "value": "invalid"}]}
+
+        with self.assertRaises(TypeError):
+            FixedPointCalculator(data)
+
+    def test_non_finite_inputs_skipped(self):
+        """ Test both backends skip infinities and NaNs, also in names. """
+        expected = FixedPointCalculator({"buying_price": Decimal('10'),
+                                         "margin_percent": Decimal('10')}).get_totals()
+        for value in ['NaN', 'sNaN', 'Infinity', '-inf']:
+            data = {"name": value, "sku": value, "buying_price": Decimal('10'),
+                    "packaging": value,
+                    "margin_percent": Decimal('10'),
+                    "other_fields": [{"field_name": "tax_percent", "value": Decimal(value)}]}
+            for backend in ['fixed_point', 'decimal']:
+                with override_settings(CALCULATOR_ARITHMETIC=backend):
+                    self.assertEqual(calculate_product(data), expected)
+
+
+class BatchCalculatorTest(TestCase):
+    """ Test for BatchCalculator. Vectorized results must match Calculator. """
+
+    def calculate_scalar(self, data):
+        lists = UserInputHandler(data).parse_user_input()
+        calculator = Calculator(sum_values=lists.sum_values,
+                                percent_values=lists.percent_values,
+                                user_input=data)
+        expenses = calculator.get_total_expenses()
+        recommended_price = calculator.get_recommended_price(expenses)
+        net_profit = calculator.get_net_profit(expenses, recommended_price)
+        return expenses, recommended_price, net_profit
+
+    def test_matches_calculator(self):
+        """ Test batch results match scalar results, including half-cent rounding. """
+        rows = [
+            {"buying_price": Decimal('10.0050'), "packaging": Decimal('0.0150'),
+             "marketplace_commission_percent": Decimal('6.125'), "margin_percent": Decimal('25')},
+            {"buying_price": Decimal('142.0800'), "packaging": Decimal('-50'),
+             "marketplace_commission_percent": Decimal('0'), "margin_percent": Decimal('-10.5555')},
+            {"buying_price": Decimal('99999.9999'), "packaging": Decimal('0.0049'),
+             "marketplace_commission_percent": Decimal('12.345'), "margin_percent": Decimal('0.0001')},
+        ]
+        columns = {field: [row[field] for row in rows] for field in rows[0]}
+
+        results = BatchCalculator(columns).calculate()
+
+        self.assertListEqual([self.calculate_scalar(row) for row in rows],
+                             list(zip(*results)))
+
+    def test_missing_values_count_as_zero(self):
+        """ Test None values are treated as zero. """
+        columns = {"buying_price": [Decimal('100'), None],
+                   "warehouse": [None, Decimal('50')],
+                   "margin_percent": [None, Decimal('10')]}
+
+        results = BatchCalculator(columns).calculate()
+
+        self.assertListEqual([Decimal('100.00'), Decimal('50.00')], results.expenses)
+        self.assertListEqual([Decimal('100.00'), Decimal('55.00')], results.recommended_price)
+        self.assertListEqual([Decimal('0.00'), Decimal('5.00')], results.net_profit)
+
+    def test_large_values_do_not_overflow(self):
+        """ Test calculation falls back to Python integers for very large products. """
+        data = {"buying_price": Decimal('99999.9999'),
+                "tax_percent": Decimal('99999.9999'),
+                "margin_percent": Decimal('99999.9999')}
+        columns = {field: [value] for field, value in data.items()}
+
+        results = BatchCalculator(columns).calculate()
+
+        self.assertEqual([self.calculate_scalar(data)], list(zip(*results)))
+
+    def test_columns_of_different_length(self):
+        """ Test columns must have the same number of rows. """
+        with self.assertRaises(ValueError):
+            BatchCalculator({"buying_price": [1, 2], "margin_percent": [1]})
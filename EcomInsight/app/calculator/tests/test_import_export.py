@@ -0,0 +1,512 @@
+import csv
+import os
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from app.celery_app import app as celery_app
+from calculator.downloads import byte_range
+from calculator.exports import (ExportSlotsFull, Lease, begin_export, fail_export, flight_lease,
+                                job_progress, merge_export_shards, plan_shards, purge_expired_exports,
+                                release_planning_slot, renew_export_leases, report_shard,
+                                start_export, write_export, write_export_shard, write_slotted_shard)
+from calculator.import_export import (import_from_csv, import_owner, iter_csv, iter_product_rows,
+                                      product_field_names, register_import)
+from calculator.models import AdditionalField, ExportJob, ProductInformation
+from calculator.tasks import generate_csv_task, import_csv_task
+from calculator.tests.test_repricing import add_field, calculate_with_calculator, create_products
+
+URL_IMPORT = reverse('calculator:import_csv')
+URL_EXPORT = reverse('calculator:export_csv')
+
+CSV = (
+    'name,sku,buying_price,margin_percent,marketplace_commission_percent,advertising,tax_percent\n'
+    'Mug,MUG-1,10.125,25,6,5,\n'
+    ',NO-NAME,1,1,1,,\n'
+    'Lamp,LAMP-1,abc,10,,,\n'
+    '"Chair, oak","CH\tAIR",100,30,,2.5,10\n'
+    'Table,TBL-1,50,20,,x,\n'
+)
+
+
+class ImportFromCSVTest(TestCase):
+    """Test chunked CSV import through staging tables."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='import@example.com', password='test1234')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, content):
+        file_path = os.path.join(self.directory.name, 'products.csv')
+        with open(file_path, 'w', newline='') as csvfile:
+            csvfile.write(content)
+        return file_path
+
+    def test_import(self):
+        """Test valid rows are imported with totals and invalid rows reported."""
+        progress = []
+
+        report = import_from_csv(self.user.pk, self.write_file(CSV), chunk_size=2,
+                                 on_progress=lambda report: progress.append(report['processed']))
+
+        self.assertEqual(progress, [2, 4, 5])
+        self.assertEqual((report['processed'], report['imported'], report['failed']), (5, 2, 3))
+        self.assertEqual([error['line'] for error in report['errors']], [3, 4, 6])
+        self.assertIn('name', report['errors'][0]['errors'])
+        self.assertIn('buying_price', report['errors'][1]['errors'])
+        self.assertIn('other_fields', report['errors'][2]['errors'])
+
+        products = ProductInformation.objects.filter(product_owner=self.user).order_by('id')
+        self.assertEqual([(product.name, product.sku) for product in products],
+                         [('Mug', 'MUG-1'), ('Chair, oak', 'CH\tAIR')])
+        self.assertEqual({(field['field_name'], field['value']) for field in products[1].other_fields},
+                         {('advertising', Decimal('2.5')), ('tax_percent', Decimal('10'))})
+        self.assertIsNone(products[0].packaging)
+        for product in products:
+            self.assertEqual((product.expenses, product.recommended_price, product.net_profit),
+                             calculate_with_calculator(product))
+
+    def test_duplicate_sku_reported(self):
+        """Test rows with a sku already used are skipped and reported."""
+        ProductInformation.objects.create(name='Mug', sku='MUG-1', product_owner=self.user)
+        content = CSV + 'Stool,TBL-2,5,5,,,\nBench,TBL-2,6,6,,,\n'
+
+        report = import_from_csv(self.user.pk, self.write_file(content), chunk_size=3)
+
+        self.assertEqual((report['imported'], report['failed']), (2, 5))
+        sku_errors = [error['line'] for error in report['errors'] if 'sku' in error['errors']]
+        self.assertEqual(sku_errors, [2, 8])
+        self.assertEqual(ProductInformation.objects.get(sku='TBL-2').name, 'Stool')
+
+    def test_export_round_trip(self):
+        """Test an exported catalog imports into the same products."""
+        owner = get_user_model().objects.create(email='exporter@example.com', password='test1234')
+        create_products(owner, 20)
+        file_path = self.write_file(''.join(iter_csv(owner)))
+
+        report = import_from_csv(self.user.pk, file_path, chunk_size=7)
+
+        self.assertEqual((report['imported'], report['failed']), (20, 0))
+        fields = ['name', 'buying_price', 'packaging', 'margin_percent']
+        self.assertEqual(
+            list(ProductInformation.objects.filter(product_owner=self.user).order_by('id').values_list(*fields)),
+            list(ProductInformation.objects.filter(product_owner=owner).order_by('id').values_list(*fields)))
+        self.assertEqual(
+            AdditionalField.objects.filter(product__product_owner=self.user).count(),
+            AdditionalField.objects.filter(product__product_owner=owner).count())
+
+    def test_rows_get_own_creation_times(self):
+        """Test imported rows don't share created_at, which leads the item list's cursor."""
+        content = 'name,buying_price\n' + ''.join(f'Product {i},{i}\n' for i in range(20))
+
+        import_from_csv(self.user.pk, self.write_file(content), chunk_size=10)
+
+        created = list(ProductInformation.objects.
+                       filter(product_owner=self.user).
+                       order_by('id').
+                       values_list('created_at', flat=True))
+        self.assertEqual(len(set(created)), 20)
+        self.assertEqual(created, sorted(created))
+
+    def test_task_removes_file(self):
+        """Test the Celery task imports the file and deletes it."""
+        file_path = self.write_file(CSV)
+
+        result = import_csv_task.apply(args=[self.user.pk, file_path]).get()
+
+        self.assertEqual((result['user_id'], result['imported']), (self.user.pk, 2))
+        self.assertFalse(os.path.exists(file_path))
+
+
+class ImportCSVViewTest(TestCase):
+    """Test CSV import endpoint."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='import-api@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    @patch('calculator.views.import_csv_task')
+    def test_upload_starts_task(self, task):
+        """Test uploaded file is stored and handed to the task."""
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(CALCULATOR_IMPORT_ROOT=os.path.join(directory, 'imports')):
+            response = self.client.post(URL_IMPORT, {'file': SimpleUploadedFile('products.csv', CSV.encode())},
+                                        format='multipart')
+
+            user_id, file_path = task.apply_async.call_args.kwargs['args']
+            task_id = task.apply_async.call_args.kwargs['task_id']
+            self.assertEqual(os.path.dirname(file_path), os.path.join(directory, 'imports'))
+            with open(file_path) as csvfile:
+                self.assertEqual(csvfile.read(), CSV)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {'task_id': task_id})
+        self.assertEqual(user_id, self.user.pk)
+        self.assertEqual(import_owner(task_id), self.user.pk)
+
+    def test_upload_requires_file(self):
+        """Test request without file is rejected."""
+        response = self.client.post(URL_IMPORT, {}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @patch('calculator.views.AsyncResult')
+    def test_progress_of_own_import_only(self, async_result):
+        """Test progress and failures are reported to the importing user only."""
+        register_import(self.user.pk, 'task-id')
+        async_result.return_value = MagicMock(state='PROGRESS',
+                                              info={'user_id': self.user.pk, 'processed': 10})
+
+        response = self.client.get(URL_IMPORT, {'task_id': 'task-id'})
+        self.assertEqual(response.data, {'status': 'PROGRESS', 'processed': 10})
+
+        async_result.return_value = MagicMock(state='FAILURE', info=ValueError('Broken file'))
+        response = self.client.get(URL_IMPORT, {'task_id': 'task-id'})
+        self.assertEqual(response.data, {'status': 'FAILURE', 'error': 'Broken file'})
+
+        self.client.force_authenticate(user=get_user_model().objects.create(email='intruder@example.com'))
+        response = self.client.get(URL_IMPORT, {'task_id': 'task-id'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(URL_IMPORT, {'task_id': 'unknown-task-id'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ExportJobTest(TestCase):
+    """Test exports are registered, reused while products are unchanged and purged."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='export@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings = override_settings(CALCULATOR_EXPORT_ROOT=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        create_products(self.user, 5)
+        self.run = MagicMock()
+
+    def test_reused_until_products_change(self):
+        """Test an unchanged catalog reuses the file, a changed one gets a new file."""
+        job, created = start_export(self.user, self.run)
+        self.assertTrue(created)
+        file_path = write_export(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.SUCCESS)
+        self.assertEqual(job.size, os.path.getsize(file_path))
+        with open(file_path, newline='') as csvfile:
+            self.assertEqual(csvfile.read(), ''.join(iter_csv(self.user)))
+        self.assertEqual(start_export(self.user, self.run), (job, False))
+
+        ProductInformation.objects.create(name='New', product_owner=self.user)
+        new_job, created = start_export(self.user, self.run)
+        self.assertTrue(created)
+        self.assertNotEqual(new_job.file_path, file_path)
+
+    def test_failed_export(self):
+        """Test a failed export leaves no file and isn't reused."""
+        job, _ = start_export(self.user, self.run)
+
+        with patch('calculator.exports.iter_product_rows', side_effect=OSError):
+            with self.assertRaises(OSError):
+                write_export(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.FAILURE)
+        self.assertEqual(os.listdir(self.root), [])
+        self.assertTrue(start_export(self.user, self.run)[1])
+
+    def test_single_flight(self):
+        """Test identical requests get the running export until it finishes."""
+        job, created = start_export(self.user, self.run)
+
+        self.assertEqual(start_export(self.user, self.run), (job, False))
+        self.run.assert_called_once_with(job)
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+        write_export(job.pk)
+        self.assertIsNone(flight_lease(job).holder())
+        self.assertEqual(start_export(self.user, self.run), (job, False))
+
+    def test_failed_start(self):
+        """Test an export whose task can't be started doesn't block the next one."""
+        with self.assertRaises(ConnectionError):
+            start_export(self.user, MagicMock(side_effect=ConnectionError))
+
+        job, created = start_export(self.user, self.run)
+        self.assertTrue(created)
+        self.assertEqual(ExportJob.objects.filter(status=ExportJob.Status.FAILURE).count(), 1)
+
+    @override_settings(CALCULATOR_EXPORT_USER_CONCURRENCY=1)
+    def test_user_slots(self):
+        """Test exports of a user wait for a free slot, other users' don't."""
+        job, _ = start_export(self.user, self.run)
+        running = Lease(f'exports:slot:{self.user.pk}:0', 'running-task')
+        self.assertTrue(running.acquire())
+
+        with self.assertRaises(ExportSlotsFull):
+            write_export(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.PENDING)
+
+        other_user = get_user_model().objects.create(email='other-slots@example.com')
+        other_job, _ = start_export(other_user, self.run)
+        write_export(other_job.pk)
+
+        running.release()
+        write_export(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.SUCCESS)
+        self.assertTrue(running.acquire())
+        running.release()
+
+    @patch('calculator.views.generate_csv_task')
+    def test_endpoint(self, task):
+        """Test export is started once, downloaded repeatedly by its owner only."""
+        response = self.client.post(URL_EXPORT)
+        job = ExportJob.objects.get(task_id=response.data['task_id'])
+        task.apply_async.assert_called_once_with(args=[job.pk], task_id=job.task_id)
+
+        response = self.client.get(URL_EXPORT, {'task_id': job.task_id})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        write_export(job.pk)
+        for _ in range(2):
+            response = self.client.get(URL_EXPORT, {'task_id': job.task_id})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b''.join(response.streaming_content).decode(), ''.join(iter_csv(self.user)))
+
+        response = self.client.post(URL_EXPORT)
+        self.assertEqual(response.data['task_id'], job.task_id)
+        task.apply_async.assert_called_once()
+
+        other_client = APIClient()
+        other_client.force_authenticate(get_user_model().objects.create(email='other-export@example.com'))
+        response = other_client.get(URL_EXPORT, {'task_id': job.task_id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_purge(self):
+        """Test expired jobs and old files without a job are deleted."""
+        expired, _ = start_export(self.user, self.run)
+        write_export(expired.pk)
+        ExportJob.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        ProductInformation.objects.create(name='New', product_owner=self.user)
+        kept, _ = start_export(self.user, self.run)
+        write_export(kept.pk)
+        orphan = os.path.join(self.root, 'products_0_orphan.csv')
+        open(orphan, 'w').close()
+        old = time.time() - 2 * 60 * 60 * 24
+        os.utime(orphan, (old, old))
+        os.utime(kept.file_path, (old, old))
+
+        self.assertEqual(purge_expired_exports(), 2)
+
+        self.assertEqual(list(ExportJob.objects.all()), [kept])
+        self.assertEqual(os.listdir(self.root), [os.path.basename(kept.file_path)])
+
+
+class ExportDownloadTest(TestCase):
+    """Test finished exports are handed to the proxy or streamed with byte ranges."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='download@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CALCULATOR_EXPORT_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        create_products(self.user, 5)
+        self.job, _ = start_export(self.user, MagicMock())
+        write_export(self.job.pk)
+        with open(self.job.file_path, 'rb') as csvfile:
+            self.content = csvfile.read()
+
+    def get(self, **headers):
+        return self.client.get(URL_EXPORT, {'task_id': self.job.task_id}, **headers)
+
+    @override_settings(CALCULATOR_EXPORT_SERVE='accel', CALCULATOR_EXPORT_ACCEL_URL='/static/media/exports/')
+    def test_accel_redirect(self):
+        """Test the proxy is told to send the file, the app sends no content."""
+        response = self.get()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/static/media/exports/' + os.path.basename(self.job.file_path))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="products.csv"')
+        self.assertEqual(response.content, b'')
+
+    @override_settings(CALCULATOR_EXPORT_SERVE='stream')
+    def test_stream_ranges(self):
+        """Test the app streams the whole file or a single requested range."""
+        response = self.get()
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+        response = self.get(HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_byte_range(self):
+        """Test Range headers are parsed like the proxy does."""
+        self.assertEqual(byte_range('bytes=0-', 100), (0, 99))
+        self.assertEqual(byte_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(byte_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(byte_range('bytes=-200', 100), (0, 99))
+        self.assertIsNone(byte_range(None, 100))
+        self.assertIsNone(byte_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(byte_range('items=0-1', 100))
+        for header in ('bytes=100-', 'bytes=5-4', 'bytes=-0'):
+            with self.assertRaises(ValueError):
+                byte_range(header, 100)
+
+
+@override_settings(CALCULATOR_EXPORT_SHARD_ROWS=3, CALCULATOR_EXPORT_MAX_SHARDS=8,
+                   CALCULATOR_EXPORT_USER_CONCURRENCY=8, CALCULATOR_EXPORT_CHUNK_SIZE=2)
+class ShardedExportTest(TestCase):
+    """Test large exports are written in id range shards and merged in order."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='shards@example.com', password='test1234')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings = override_settings(CALCULATOR_EXPORT_ROOT=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.products = create_products(self.user, 10)
+        self.job, _ = start_export(self.user, MagicMock())
+
+    def read(self, file_path):
+        with open(file_path, newline='') as csvfile:
+            return csvfile.read()
+
+    def test_plan(self):
+        """Test shards split products by id, the number of shards is capped."""
+        ids = [product.pk for product in self.products]
+        self.assertEqual(plan_shards(self.user), [[ids[0], ids[3], 3], [ids[3], ids[6], 3],
+                                                  [ids[6], ids[9], 3], [ids[9], None, 1]])
+        with override_settings(CALCULATOR_EXPORT_MAX_SHARDS=2):
+            self.assertEqual(plan_shards(self.user), [[ids[0], ids[5], 5], [ids[5], None, 5]])
+        with override_settings(CALCULATOR_EXPORT_SHARD_ROWS=10):
+            self.assertEqual(plan_shards(self.user), [[None, None, 10]])
+
+    def test_plan_capped_by_slots(self):
+        """Test exports aren't split into more shards than the user has slots."""
+        ids = [product.pk for product in self.products]
+        with override_settings(CALCULATOR_EXPORT_USER_CONCURRENCY=2):
+            self.assertEqual(plan_shards(self.user), [[ids[0], ids[5], 5], [ids[5], None, 5]])
+        with override_settings(CALCULATOR_EXPORT_USER_CONCURRENCY=1):
+            self.assertEqual(plan_shards(self.user), [[None, None, 10]])
+
+    def test_merged_like_single_export(self):
+        """Test the merged file equals an export of one cursor, with per shard progress."""
+        file_path = write_export(self.job.pk)
+
+        self.assertEqual(self.read(file_path), ''.join(iter_csv(self.user)))
+        self.assertEqual(os.listdir(self.root), [os.path.basename(file_path)])
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, ExportJob.Status.SUCCESS)
+        self.assertEqual(self.job.progress, [{'rows': 3, 'written': 3, 'done': True}] * 3 +
+                                            [{'rows': 1, 'written': 1, 'done': True}])
+
+    def test_running_progress(self):
+        """Test rows written by running shards are read from the cache."""
+        plan = begin_export(self.job.pk)
+        self.addCleanup(fail_export, plan)
+        report_shard(plan, 1, 2)
+
+        self.job.refresh_from_db()
+        self.assertEqual(job_progress(self.job)[:2], [{'rows': 3, 'written': 0, 'done': False},
+                                                      {'rows': 3, 'written': 2, 'done': False}])
+        write_export_shard(plan, 1)
+        self.job.refresh_from_db()
+        self.assertEqual(job_progress(self.job)[1], {'rows': 3, 'written': 3, 'done': True})
+
+    def test_columns_fixed_by_plan(self):
+        """Test fields added while shards are written don't change the columns."""
+        plan = begin_export(self.job.pk)
+        add_field(self.products[9], 'added_later', Decimal('1'))
+        ProductInformation.objects.create(name='Created later', product_owner=self.user)
+        for index in reversed(range(len(plan['shards']))):
+            write_export_shard(plan, index)
+        file_path = merge_export_shards(plan)
+
+        rows = list(csv.reader(self.read(file_path).splitlines()))
+        self.assertEqual(rows[0], product_field_names() + plan['other_names'])
+        self.assertNotIn('added_later', rows[0])
+        self.assertEqual([row[1] for row in rows[1:]],
+                         [f'Product {i}' for i in range(10)] + ['Created later'])
+        self.assertEqual({len(row) for row in rows}, {len(rows[0])})
+
+    def test_failed_shard(self):
+        """Test a failed shard fails the export, removes its files and frees its leases."""
+        with patch('calculator.exports.iter_product_rows',
+                   side_effect=[iter_product_rows(self.user, []), OSError]):
+            with self.assertRaises(OSError):
+                write_export(self.job.pk)
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, ExportJob.Status.FAILURE)
+        self.assertEqual(os.listdir(self.root), [])
+        job, created = start_export(self.user, MagicMock())
+        self.assertTrue(created)
+        write_export(job.pk)
+
+    @override_settings(CALCULATOR_EXPORT_USER_CONCURRENCY=2)
+    def test_shards_take_slots(self):
+        """Test shards written by tasks of their own each take one of the user's slots."""
+        plan = release_planning_slot(begin_export(self.job.pk))
+        self.addCleanup(fail_export, plan)
+        running = [Lease(f'exports:slot:{self.user.pk}:{slot}', 'running-task') for slot in range(2)]
+        for lease in running:
+            self.assertTrue(lease.acquire())
+
+        with self.assertRaises(ExportSlotsFull):
+            write_slotted_shard(plan, 0)
+        running[1].release()
+        self.assertEqual(write_slotted_shard(plan, 0), 5)
+        self.assertIsNone(running[1].holder())
+        running[0].release()
+
+    def test_leases_renewed_while_queued(self):
+        """Test flight leases of running exports are renewed, for a limited time."""
+        plan = release_planning_slot(begin_export(self.job.pk))
+        self.addCleanup(fail_export, plan)
+        flight = flight_lease(self.job)
+        flight.lock.redis.pexpire(flight.lock.name, 1000)
+
+        self.assertEqual(renew_export_leases(), 1)
+        self.assertGreater(flight.lock.redis.pttl(flight.lock.name), 1000)
+        with override_settings(CALCULATOR_EXPORT_TIMEOUT=0):
+            self.assertEqual(renew_export_leases(), 0)
+
+    def test_task_chord(self):
+        """Test the task writes shards with a chord merging them."""
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        generate_csv_task.apply(args=[self.job.pk]).get()
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, ExportJob.Status.SUCCESS)
+        self.assertEqual(self.read(self.job.file_path), ''.join(iter_csv(self.user)))
@@ -0,0 +1,269 @@
+import json
+import time
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from calculator.api_queries import get_all_items_for_auth_user, search_items
+from calculator.caching import items_cache
+from calculator.models import AdditionalField, ProductInformation
+from calculator.repricing import reprice_products
+from calculator.serializers import ProductInfoSerializer
+from calculator.tests.test_repricing import add_field, create_products
+
+URL_ITEM = reverse('calculator:item-list')
+URL_OTHER_FIELDS = reverse('calculator:other-field-list')
+
+
+class FastItemsListTest(TestCase):
+    """Test item lists render the same JSON as ProductInfoSerializer."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(email='listing@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        create_products(self.user, 30)
+        reprice_products(self.user.pk)
+        product = ProductInformation.objects.create(name='Ünïcode "quoted" ', sku=None,
+                                                    product_owner=self.user,
+                                                    buying_price=Decimal('0.0001'))
+        add_field(product, None, None)
+
+    def assert_same_as_serializer(self, response, queryset):
+        """Compare response bytes with the serializer rendering of queryset."""
+        data = json.loads(response.content)
+        ids = [item['id'] for item in data['results']]
+        products = {product.pk: product for product in queryset.filter(pk__in=ids)}
+        expected = {'next': data['next'],
+                    'previous': data['previous'],
+                    'results': ProductInfoSerializer([products[pk] for pk in ids], many=True).data}
+        self.assertEqual(response.content,
+                         JSONRenderer().render(expected, response.accepted_media_type))
+
+    def test_pages_match_serializer(self):
+        """Test every page equals the serializer output."""
+        response = self.client.get(URL_ITEM, {'page_size': 12})
+        pages = 0
+        while True:
+            self.assert_same_as_serializer(response, get_all_items_for_auth_user(self.user.pk))
+            pages += 1
+            next_url = json.loads(response.content)['next']
+            if not next_url:
+                break
+            response = self.client.get(next_url)
+
+        self.assertEqual(pages, 3)
+
+    def test_search_matches_serializer(self):
+        """Test ranked search results equal the serializer output."""
+        response = self.client.get(URL_ITEM, {'search': 'Product 1'})
+
+        self.assertTrue(json.loads(response.content)['results'])
+        self.assert_same_as_serializer(response, search_items('Product 1', self.user.pk))
+
+    def test_indented_response(self):
+        """Test requested indentation is kept."""
+        response = self.client.get(URL_ITEM, HTTP_ACCEPT='application/json; indent=2')
+
+        self.assertIn(b'\n  "next"', response.content)
+        self.assert_same_as_serializer(response, get_all_items_for_auth_user(self.user.pk))
+
+    def test_fixed_number_of_queries(self):
+        """Test products are read with their additional fields in one query."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(URL_ITEM, {'page_size': 31})
+
+        tables = [query['sql'].split(' FROM ')[1].split()[0] for query in queries
+                  if query['sql'].startswith('SELECT') and 'calculator_' in query['sql']]
+        self.assertEqual(tables, ['"calculator_productinformation"'])
+
+
+def detail_url(product_id):
+    return reverse('calculator:item-detail', args=[product_id])
+
+
+class SparseFieldsetsTest(TestCase):
+    """Test fields and exclude query parameters of item reads."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(email='fieldsets@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.product = create_products(self.user, 3)[0]
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        selects = [query['sql'] for query in queries
+                   if query['sql'].startswith('SELECT') and 'calculator_' in query['sql']]
+        return response, selects
+
+    def test_list_selected_fields(self):
+        """Test only selected columns are read and returned, without additional fields."""
+        response, selects = self.get(URL_ITEM, {'fields': 'sku,id,recommended_price'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([list(item) for item in response.data['results']],
+                         [['id', 'sku', 'recommended_price']] * 3)
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('"buying_price"', selects[0])
+
+    def test_list_excluded_fields(self):
+        """Test excluded fields are left out, additional fields are kept."""
+        response, selects = self.get(URL_ITEM, {'exclude': 'name,expenses'})
+
+        item = response.data['results'][0]
+        self.assertNotIn('name', item)
+        self.assertNotIn('expenses', item)
+        self.assertIn('other_fields', item)
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('"expenses"', selects[0])
+
+    def test_retrieve_selected_fields(self):
+        """Test detail reads only the selected fields."""
+        response, selects = self.get(detail_url(self.product.pk), {'fields': 'name,buying_price'})
+
+        self.assertEqual(response.data, {'name': 'Product 0', 'buying_price': self.product.buying_price})
+        self.assertEqual(len(selects), 1)
+        self.assertNotIn('"packaging"', selects[0])
+
+    def test_invalid_fields_rejected(self):
+        """Test unknown names and empty fieldsets are rejected."""
+        for params in ({'fields': 'sku,price'}, {'exclude': 'product_owner'},
+                       {'fields': 'id', 'exclude': 'id'}):
+            response = self.client.get(URL_ITEM, params)
+            self.assertEqual(response.status_code, 400, params)
+
+        response = self.client.get(detail_url(self.product.pk), {'fields': 'inputs_sum'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('fields', response.data)
+
+
+class ConditionalReadsTest(TestCase):
+    """Test ETag and Last-Modified validation of item reads."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(email='conditional@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.product = create_products(self.user, 3)[0]
+
+    def assert_not_modified(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries if 'calculator_' in query['sql']])
+        return response
+
+    def test_list_not_modified(self):
+        """Test a current copy is confirmed without running any query."""
+        response = self.client.get(URL_ITEM)
+        self.assertIn('private', response['Cache-Control'])
+
+        not_modified = self.assert_not_modified(URL_ITEM, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assert_not_modified(URL_ITEM, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+    def test_detail_not_modified(self):
+        """Test details are validated with their own ETag."""
+        response = self.client.get(detail_url(self.product.pk))
+
+        self.assert_not_modified(detail_url(self.product.pk), HTTP_IF_NONE_MATCH=response['ETag'])
+        etags = {response['ETag'],
+                 self.client.get(URL_ITEM)['ETag'],
+                 self.client.get(URL_ITEM, {'fields': 'id'})['ETag'],
+                 self.client.get(URL_ITEM, HTTP_ACCEPT='application/json; indent=2')['ETag']}
+        self.assertEqual(len(etags), 4)
+
+    def test_write_changes_validators(self):
+        """Test a write makes the client's copy stale."""
+        response = self.client.get(URL_ITEM)
+        later = time.time() + 10
+
+        with patch('calculator.caching.time.time', return_value=later), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(detail_url(self.product.pk), {'name': 'Renamed'}, format='json')
+
+        changed = self.client.get(URL_ITEM, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(changed.data['results'][0]['name'], 'Renamed')
+        changed = self.client.get(URL_ITEM, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(items_cache.last_modified(self.user.pk), int(later))
+
+    def test_writes_in_same_second(self):
+        """Test a copy read between two writes in the same second is stale after the second."""
+        now = time.time() + 10
+        with patch('calculator.caching.time.time', return_value=now):
+            items_cache.bump(self.user.pk)
+            response = self.client.get(URL_ITEM)
+            items_cache.bump(self.user.pk)
+
+            changed = self.client.get(URL_ITEM, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(items_cache.last_modified(self.user.pk), int(now) + 1)
+
+    def test_other_field_change_bumps_updated_at(self):
+        """Test renaming an additional field bumps the product's updated_at."""
+        field = add_field(self.product, 'advertising', Decimal(1))
+        updated_at = ProductInformation.objects.get(pk=self.product.pk).updated_at
+
+        response = self.client.patch(reverse('calculator:other-field-detail', args=[field.pk]),
+                                     {'field_name': 'promotion'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(ProductInformation.objects.get(pk=self.product.pk).updated_at, updated_at)
+
+
+class OtherFieldsListTest(TestCase):
+    """Test additional fields are listed in pages of products, through the owner column."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='other-fields@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        create_products(self.user, 20)
+        create_products(get_user_model().objects.create(email='other-owner@example.com'), 5)
+
+    def test_pages_in_product_order(self):
+        """Test pages hold every field of the user once, by product and id, in both directions."""
+        expected = list(AdditionalField.objects.
+                        filter(product__product_owner=self.user).
+                        order_by('product_id', 'id').
+                        values_list('id', flat=True))
+        pages = []
+        response = self.client.get(URL_OTHER_FIELDS, {'page_size': 7})
+        while True:
+            pages.append([field['id'] for field in response.data['results']])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertGreater(len(pages), 2)
+        self.assertEqual([field_id for page in pages for field_id in page], expected)
+        for page in reversed(pages[:-1]):
+            response = self.client.get(response.data['previous'])
+            self.assertEqual([field['id'] for field in response.data['results']], page)
+
+    def test_owner_filtered_without_join(self):
+        """Test the list filters the view's owner column, for the index on products with fields."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(URL_OTHER_FIELDS)
+
+        selects = [query['sql'] for query in queries if 'calculator_additional_field' in query['sql']]
+        self.assertEqual(len(selects), 1)
+        self.assertIn('"calculator_additional_field"."product_owner_id" =', selects[0])
+        self.assertNotIn('JOIN', selects[0])
@@ -0,0 +1,246 @@
+import random
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from calculator.models import AdditionalField, ProductInformation
+from calculator.other_fields import add_field_ids
+from calculator.repricing import find_drift, reprice_products
+from calculator.schema import INPUT_FIELDS
+from calculator.services import Calculator, UserInputHandler
+from calculator.tasks import reprice_products_task
+
+
+def create_user(email='repricing@example.com'):
+    return get_user_model().objects.create(email=email, password='test1234')
+
+
+def random_value(rng, low, high):
+    """Return random value with 4 decimal places, often a tie at cents."""
+    value = Decimal(rng.randint(low * 10000, high * 10000)).scaleb(-4)
+    if rng.random() < 0.3:
+        value = value.quantize(Decimal('0.01')) + Decimal('0.005')
+    return value
+
+
+def create_products(user, count, seed=0):
+    """Create products with random inputs and additional fields."""
+    rng = random.Random(seed)
+    products = [ProductInformation(name=f'Product {i}',
+                                   product_owner=user,
+                                   quantity=rng.randint(0, 100),
+                                   buying_price=random_value(rng, 0, 500),
+                                   transportation=random_value(rng, -10, 50),
+                                   packaging=rng.choice([None, random_value(rng, 0, 20)]),
+                                   warehouse=random_value(rng, 0, 20),
+                                   marketplace_commission_percent=random_value(rng, 0, 30),
+                                   margin_percent=random_value(rng, -20, 200))
+                for i in range(count)]
+    documents = add_field_ids([[{'field_name': name, 'value': random_value(rng, 0, 40)}
+                                for name in rng.sample(['advertising', 'tax_percent', 'storage',
+                                                        'vat_percent'], rng.randint(0, 4))]
+                               for _ in products])
+    for product, document in zip(products, documents):
+        product.other_fields = document
+    return ProductInformation.objects.bulk_create(products)
+
+
+def add_field(product, field_name, value):
+    """Add additional field to the stored document of product."""
+    product.other_fields = add_field_ids([[*product.other_fields,
+                                           {'field_name': field_name, 'value': value}]])[0]
+    product.save(update_fields=['other_fields'])
+    return AdditionalField.objects.get(pk=product.other_fields[-1]['id'])
+
+
+def calculate_with_calculator(product):
+    """Calculate totals of stored product with UserInputHandler and Calculator."""
+    user_input = {name: getattr(product, name) for name in INPUT_FIELDS
+                  if getattr(product, name) is not None}
+    user_input['margin_percent'] = product.margin_percent
+    user_input['other_fields'] = product.other_fields
+    lists = UserInputHandler(user_input).parse_user_input()
+    calculate = Calculator(sum_values=lists.sum_values,
+                           percent_values=lists.percent_values,
+                           user_input=user_input)
+    expenses = calculate.get_total_expenses()
+    recommended_price = calculate.get_recommended_price(expenses)
+    net_profit = calculate.get_net_profit(expenses, recommended_price)
+    return expenses, recommended_price, net_profit
+
+
+class RepriceProductsTest(TestCase):
+    """Test set-based recalculation of stored totals."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.other_user = create_user(email='other-repricing@example.com')
+
+    def test_matches_calculator(self):
+        """Test stored totals equal Calculator results for every product."""
+        create_products(self.user, 200)
+
+        updated = reprice_products(self.user.pk, batch_size=37)
+
+        self.assertEqual(updated, 200)
+        products = ProductInformation.objects.all()
+        for product in products:
+            self.assertEqual(
+                (product.expenses, product.recommended_price, product.net_profit),
+                calculate_with_calculator(product),
+                product.pk)
+
+    def test_scoped_to_user(self):
+        """Test only the given user's products are repriced."""
+        create_products(self.user, 3)
+        other = create_products(self.other_user, 3, seed=1)
+
+        reprice_products(self.user.pk)
+
+        self.assertFalse(ProductInformation.objects.filter(
+            pk__in=[product.pk for product in other], expenses__isnull=False).exists())
+        self.assertFalse(ProductInformation.objects.filter(
+            product_owner=self.user, expenses__isnull=True).exists())
+
+    def test_all_users_in_batches(self):
+        """Test all products are repriced across batch boundaries."""
+        create_products(self.user, 5)
+        create_products(self.other_user, 5, seed=1)
+
+        with patch('calculator.repricing.items_cache') as items_cache, \
+                self.captureOnCommitCallbacks(execute=True):
+            updated = reprice_products(batch_size=2)
+
+        self.assertEqual(updated, 10)
+        self.assertFalse(ProductInformation.objects.filter(expenses__isnull=True).exists())
+        invalidated = {call.args[0] for call in items_cache.invalidate.call_args_list}
+        self.assertEqual(invalidated, {self.user.pk, self.other_user.pk})
+
+    def test_product_without_inputs(self):
+        """Test products with only null inputs get zero totals."""
+        product = ProductInformation.objects.create(name='Empty', product_owner=self.user)
+
+        reprice_products(self.user.pk)
+
+        product.refresh_from_db()
+        self.assertEqual((product.expenses, product.recommended_price, product.net_profit),
+                         (0, 0, 0))
+
+    def test_task_and_command(self):
+        """Test Celery task and management command reprice products."""
+        create_products(self.user, 2)
+
+        self.assertEqual(reprice_products_task(self.user.pk), 2)
+        out = StringIO()
+        call_command('reprice_products', '--user', str(self.user.pk), stdout=out)
+        self.assertIn('Repriced 2 products', out.getvalue())
+
+
+def other_field_url(field_id):
+    return reverse('calculator:other-field-detail', args=[field_id])
+
+
+class OtherFieldsTotalsTest(TestCase):
+    """Test additional field changes update product totals incrementally."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.product = create_products(self.user, 1)[0]
+        self.field = add_field(self.product, 'advertising', Decimal('10.125'))
+        reprice_products(self.user.pk)
+
+    def assert_totals_match_calculator(self):
+        product = ProductInformation.objects.get(pk=self.product.pk)
+        self.assertEqual((product.expenses, product.recommended_price, product.net_profit),
+                         calculate_with_calculator(product))
+        self.assertEqual(find_drift(self.user.pk), [])
+
+    def test_update_applies_delta(self):
+        """Test changed value is applied without recalculating the product."""
+        with patch('calculator.repricing.reprice_batch') as reprice_batch:
+            response = self.client.patch(other_field_url(self.field.pk), {'value': '25.335'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        reprice_batch.assert_not_called()
+        self.assert_totals_match_calculator()
+
+    def test_rename_to_percent(self):
+        """Test renaming a sum field into a percent field moves its value."""
+        self.client.patch(other_field_url(self.field.pk), {'field_name': 'ads_percent'})
+
+        self.assert_totals_match_calculator()
+
+    def test_delete_removes_value(self):
+        """Test deleted field is subtracted from the totals."""
+        response = self.client.delete(other_field_url(self.field.pk))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assert_totals_match_calculator()
+
+    def test_product_without_sums_recalculated(self):
+        """Test products without stored sums are recalculated in full."""
+        ProductInformation.objects.filter(pk=self.product.pk).update(
+            inputs_sum=None, inputs_percent=None, expenses=None)
+
+        self.client.patch(other_field_url(self.field.pk), {'value': '1'})
+
+        self.assert_totals_match_calculator()
+
+    def test_field_locked(self):
+        """Test changed field is read from its locked product."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.patch(other_field_url(self.field.pk), {'value': '1'})
+            self.client.delete(other_field_url(self.field.pk))
+
+        locked = [query['sql'] for query in queries
+                  if 'FOR UPDATE' in query['sql'] and 'productinformation' in query['sql']]
+        self.assertEqual(len(locked), 2)
+        self.assert_totals_match_calculator()
+
+    def test_other_users_fields_hidden(self):
+        """Test fields of other users' products can't be changed."""
+        self.client.force_authenticate(user=create_user(email='intruder@example.com'))
+
+        response = self.client.patch(other_field_url(self.field.pk), {'value': '1'})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CheckTotalsTest(TestCase):
+    """Test detection and repair of drifted totals."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.products = create_products(self.user, 5)
+        reprice_products(self.user.pk)
+
+    def test_find_and_repair_drift(self):
+        """Test changed inputs are reported and repaired by the command."""
+        drifted = self.products[1]
+        ProductInformation.objects.filter(pk=drifted.pk).update(buying_price=Decimal('1'))
+        self.assertEqual(find_drift(self.user.pk, batch_size=2), [drifted.pk])
+
+        out = StringIO()
+        call_command('check_totals', '--repair', stdout=out)
+
+        self.assertIn('1 products drifted', out.getvalue())
+        self.assertIn('Repaired 1 products', out.getvalue())
+        self.assertEqual(find_drift(), [])
+
+    def test_no_drift(self):
+        """Test consistent catalog reports no drift."""
+        out = StringIO()
+        call_command('check_totals', stdout=out)
+
+        self.assertIn('No drift found', out.getvalue())
@@ -0,0 +1,211 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+from decimal import Decimal
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from calculator.import_export import iter_csv, iter_csv_rows, iter_product_rows, product_field_names, write_to_csv
+from calculator.models import ProductInformation
+from calculator.streaming import StreamItemError, iter_json_items
+from calculator.tests.test_repricing import add_field, create_products
+
+URL_BATCH = reverse('calculator:calculate_batch')
+URL_EXPORT_STREAM = reverse('calculator:export_csv_stream')
+
+
+def product_input(**params):
+    """Create calculator input."""
+    defaults = {
+        "name": "Test",
+        "margin_percent": 25,
+        "buying_price": 50,
+        "transportation": 5,
+        "packaging": 10,
+        "warehouse": 20,
+        "marketplace_commission_percent": 6,
+    }
+    defaults.update(params)
+    return defaults
+
+
+class IterJsonItemsTest(SimpleTestCase):
+    """Test incremental parsing of JSON array and NDJSON bodies."""
+
+    def parse(self, body, chunk_size=3):
+        return list(iter_json_items(io.BytesIO(body.encode()), chunk_size=chunk_size))
+
+    def test_json_array(self):
+        """Test items of a JSON array split across many chunks."""
+        items = [{"a": 1, "b": "ü"}, {"c": [1, 2]}, 12345, "text"]
+        self.assertEqual(self.parse(json.dumps(items)), items)
+
+    def test_ndjson(self):
+        """Test NDJSON lines, ignoring blank lines."""
+        body = '{"a": 1}\n\n{"b": 2}\n{"c": 3}'
+        self.assertEqual(self.parse(body), [{"a": 1}, {"b": 2}, {"c": 3}])
+
+    def test_invalid_ndjson_line(self):
+        """Test invalid NDJSON line is yielded as an error and parsing continues."""
+        items = self.parse('{"a": 1}\n{broken\n{"b": 2}\n')
+        self.assertEqual(items[0], {"a": 1})
+        self.assertIsInstance(items[1], StreamItemError)
+        self.assertEqual(items[2], {"b": 2})
+
+    def test_malformed_json_array(self):
+        """Test malformed JSON array raises after yielding valid items."""
+        items = iter_json_items(io.BytesIO(b'[{"a": 1} {"b": 2}]'))
+        self.assertEqual(next(items), {"a": 1})
+        with self.assertRaises(StreamItemError):
+            next(items)
+
+    def test_empty_body(self):
+        """Test empty body yields nothing."""
+        self.assertEqual(self.parse('  '), [])
+        self.assertEqual(self.parse('[ ]'), [])
+
+
+class SumAllExpencesBatchTest(TestCase):
+    """Test batch calculate endpoint."""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def post(self, body, content_type):
+        res = self.client.generic('POST', URL_BATCH, body, content_type=content_type)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(res.streaming_content).decode().splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_json_array_results_match_single_endpoint(self):
+        """Test each result matches the single calculate endpoint."""
+        products = [product_input(), product_input(buying_price=75, margin_percent=10)]
+
+        results = self.post(json.dumps(products), 'application/json')
+
+        self.assertEqual(len(results), 2)
+        for index, (product, result) in enumerate(zip(products, results)):
+            single = self.client.post(reverse('calculator:calculate'), product, format='json')
+            self.assertEqual(result['index'], index)
+            self.assertEqual(result['expenses'], single.json()['expenses'])
+            self.assertEqual(result['recommended_price'], single.json()['recommended_price'])
+            self.assertEqual(result['net_profit'], single.json()['net_profit'])
+
+    def test_ndjson_inline_errors(self):
+        """Test invalid rows are reported inline without failing the batch."""
+        body = '\n'.join([json.dumps(product_input()),
+                          '{not json',
+                          json.dumps(product_input(buying_price='abc')),
+                          json.dumps(product_input())])
+
+        results = self.post(body, 'application/x-ndjson')
+
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        self.assertIn('expenses', results[0])
+        self.assertIn('errors', results[1])
+        self.assertIn('buying_price', results[2]['errors'])
+        self.assertIn('expenses', results[3])
+
+
+class StreamExportCSVTest(TestCase):
+    """Test CSV export streamed from a server-side cursor."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='export@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.products = []
+        for i, names in enumerate([['vat_percent', 'advertising'], [], ['advertising']]):
+            product = ProductInformation.objects.create(product_owner=self.user, name=f'Product {i}',
+                                                        buying_price=Decimal(10 + i))
+            for name in names:
+                add_field(product, name, Decimal(i + 1))
+            self.products.append(product)
+        other_user = get_user_model().objects.create(email='other-export@example.com', password='test1234')
+        other = ProductInformation.objects.create(product_owner=other_user, name='Hidden')
+        add_field(other, 'secret', Decimal(1))
+
+    def read_csv(self, content):
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_stream(self):
+        """Test header and rows of user's products only."""
+        response = self.client.get(URL_EXPORT_STREAM)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = self.read_csv(b''.join(response.streaming_content).decode())
+        self.assertEqual(rows[0], product_field_names() + ['advertising', 'vat_percent'])
+        self.assertEqual(len(rows), 4)
+        name = rows[0].index('name')
+        self.assertEqual([row[name] for row in rows[1:]], ['Product 0', 'Product 1', 'Product 2'])
+        self.assertEqual([row[-2:] for row in rows[1:]],
+                         [['1.0000', '1.0000'], ['', ''], ['3.0000', '']])
+        self.assertEqual(rows[1][rows[0].index('product_owner')], 'export@example.com')
+
+    def test_queries_independent_of_catalog_size(self):
+        """Test header and rows are read with one query each."""
+        with CaptureQueriesContext(connection) as queries:
+            list(iter_csv(self.user, chunk_size=1))
+
+        reads = [query for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(reads), 2)
+
+    def test_file_export_matches_stream(self):
+        """Test the Celery file export writes the streamed CSV."""
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'products.csv')
+            write_to_csv(self.user, file_path)
+            with open(file_path, newline='') as csvfile:
+                self.assertEqual(csvfile.read(), ''.join(iter_csv(self.user, chunk_size=1)))
+
+
+class StreamExportTransactionTest(TransactionTestCase):
+    """Test streamed rows are read in a transaction after the request's one ended."""
+
+    def test_rows_read_in_transaction(self):
+        """Test the cursor is read in a transaction, so it isn't declared WITH HOLD."""
+        user = get_user_model().objects.create(email='stream@example.com', password='test1234')
+        create_products(user, 3)
+
+        rows = iter_product_rows(user, [], chunk_size=1)
+        self.assertFalse(connection.in_atomic_block)
+        with CaptureQueriesContext(connection) as queries:
+            next(rows)
+            self.assertTrue(connection.in_atomic_block)
+            self.assertEqual(len(list(rows)), 2)
+
+        self.assertFalse(connection.in_atomic_block)
+        declare = next(query['sql'] for query in queries if query['sql'].startswith('DECLARE'))
+        self.assertIn('WITHOUT HOLD', declare)
+
+    def test_header_read_with_rows(self):
+        """Test products committed after the header was read are left out of the rows."""
+        user = get_user_model().objects.create(email='stream@example.com', password='test1234')
+        create_products(user, 2)
+
+        def create_late_product():
+            try:
+                add_field(create_products(user, 1, seed=1)[0], 'late', '1')
+            finally:
+                connection.close()
+
+        rows = iter_csv_rows(user, chunk_size=1)
+        header = next(rows)
+        thread = threading.Thread(target=create_late_product)
+        thread.start()
+        thread.join()
+
+        self.assertNotIn('late', header)
+        self.assertEqual(len(list(rows)), 2)
+        self.assertEqual(ProductInformation.objects.filter(product_owner=user).count(), 3)
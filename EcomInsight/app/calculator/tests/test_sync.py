@@ -0,0 +1,188 @@
+import json
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from calculator.models import AdditionalField, ProductInformation
+from calculator.streaming import StreamItemError
+from calculator.sync import sync_products
+from calculator.tests.test_repricing import calculate_with_calculator
+
+URL_SYNC = reverse('calculator:sync_products')
+
+
+def feed_item(sku, **params):
+    """Create feed item."""
+    item = {'sku': sku, 'name': f'Product {sku}', 'buying_price': '10.50',
+            'margin_percent': '20', 'other_fields': [{'field_name': 'advertising', 'value': '2'}]}
+    item.update(params)
+    return item
+
+
+class SyncProductsTest(TestCase):
+    """Test upserting products by sku."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='sync@example.com', password='test1234')
+
+    def products(self):
+        return ProductInformation.objects.filter(product_owner=self.user).order_by('sku')
+
+    def test_sync_is_idempotent(self):
+        """Test products are created once and an unchanged feed writes nothing."""
+        feed = [feed_item(f'SKU-{i}') for i in range(5)]
+
+        first = sync_products(self.user.pk, feed, batch_size=2)
+        ids = list(self.products().values_list('id', flat=True))
+        fields = list(AdditionalField.objects.values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            second = sync_products(self.user.pk, feed, batch_size=2)
+
+        self.assertEqual((first['created'], first['updated'], first['unchanged']), (5, 0, 0))
+        self.assertEqual((second['created'], second['updated'], second['unchanged']), (0, 0, 5))
+        self.assertEqual(list(self.products().values_list('id', flat=True)), ids)
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))])
+        self.assertEqual(list(AdditionalField.objects.values_list('id', flat=True)), fields)
+
+    def test_update_reconciles_other_fields(self):
+        """Test changed products are updated and fields rewritten minimally."""
+        sync_products(self.user.pk, [feed_item('A', other_fields=[
+            {'field_name': 'advertising', 'value': '2'},
+            {'field_name': 'storage', 'value': '3'},
+            {'field_name': 'tax_percent', 'value': '5'}])])
+        kept = AdditionalField.objects.get(field_name='advertising')
+        changed = AdditionalField.objects.get(field_name='tax_percent')
+
+        report = sync_products(self.user.pk, [feed_item('A', name='Renamed', other_fields=[
+            {'field_name': 'advertising', 'value': '2'},
+            {'field_name': 'tax_percent', 'value': '7'},
+            {'field_name': 'packing', 'value': '1'}])])
+
+        self.assertEqual((report['created'], report['updated']), (0, 1))
+        product = self.products().get()
+        self.assertEqual(product.name, 'Renamed')
+        fields = {field['field_name']: (field['id'], field['value']) for field in product.other_fields}
+        self.assertEqual(set(fields), {'advertising', 'tax_percent', 'packing'})
+        self.assertEqual(fields['advertising'], (kept.id, Decimal('2')))
+        self.assertEqual(fields['tax_percent'], (changed.id, Decimal('7')))
+        self.assertEqual((product.expenses, product.recommended_price, product.net_profit),
+                         calculate_with_calculator(product))
+
+    def test_other_fields_kept_when_omitted(self):
+        """Test items without other_fields leave the product's fields alone."""
+        sync_products(self.user.pk, [feed_item('A')])
+        item = feed_item('A')
+        del item['other_fields']
+
+        report = sync_products(self.user.pk, [item])
+
+        self.assertEqual(report['unchanged'], 1)
+        self.assertEqual(AdditionalField.objects.count(), 1)
+
+    def test_omitted_columns_kept(self):
+        """Test columns missing from an item keep their values, null ones are cleared."""
+        sync_products(self.user.pk, [feed_item('A', packaging='1.5', warehouse='3')])
+
+        report = sync_products(self.user.pk, [{'sku': 'A', 'name': 'Renamed', 'warehouse': None}])
+
+        self.assertEqual(report['updated'], 1)
+        product = self.products().get()
+        self.assertEqual((product.name, product.buying_price, product.margin_percent),
+                         ('Renamed', Decimal('10.5'), Decimal('20')))
+        self.assertEqual((product.packaging, product.warehouse), (Decimal('1.5'), None))
+        self.assertEqual(len(product.other_fields), 1)
+        self.assertEqual((product.expenses, product.recommended_price, product.net_profit),
+                         calculate_with_calculator(product))
+
+    def test_omitted_columns_empty_when_created(self):
+        """Test new products get empty columns for those missing from their item."""
+        sync_products(self.user.pk, [{'sku': 'A', 'name': 'Bare'}, feed_item('B'), feed_item('C')],
+                      batch_size=3)
+
+        product = self.products().get(sku='A')
+        self.assertEqual((product.buying_price, product.other_fields), (None, []))
+        created = list(self.products().order_by('id').values_list('created_at', flat=True))
+        self.assertEqual(len(set(created)), 3)
+
+    def test_remove_missing(self):
+        """Test products missing from the feed are deleted on request."""
+        sync_products(self.user.pk, [feed_item('A'), feed_item('B'), feed_item('C')])
+        ProductInformation.objects.create(product_owner=self.user, name='No sku')
+        other_user = get_user_model().objects.create(email='other-sync@example.com', password='test1234')
+        sync_products(other_user.pk, [feed_item('B')])
+
+        report = sync_products(self.user.pk, [feed_item('A'), feed_item('C', buying_price='x')],
+                               remove_missing_products=True, batch_size=1)
+
+        self.assertEqual((report['deleted'], report['failed']), (1, 1))
+        self.assertEqual(list(self.products().values_list('sku', flat=True)), ['A', 'C', None])
+        self.assertTrue(ProductInformation.objects.filter(product_owner=other_user, sku='B').exists())
+
+    def test_unreadable_item_prevents_removal(self):
+        """Test nothing is deleted when an item of the feed can't be read."""
+        sync_products(self.user.pk, [feed_item('A'), feed_item('B')])
+
+        report = sync_products(self.user.pk, [feed_item('A'), StreamItemError('Invalid JSON')],
+                               remove_missing_products=True)
+
+        self.assertEqual((report['deleted'], report['failed']), (0, 1))
+        self.assertEqual(report['errors'][0]['index'], 1)
+        self.assertEqual(self.products().count(), 2)
+
+    def test_feed_without_skus_prevents_removal(self):
+        """Test an empty feed or one without skus deletes nothing."""
+        sync_products(self.user.pk, [feed_item('A'), feed_item('B')])
+
+        for feed in ([], [{'name': 'No sku'}]):
+            report = sync_products(self.user.pk, feed, remove_missing_products=True)
+            self.assertEqual(report['deleted'], 0)
+        self.assertEqual(self.products().count(), 2)
+
+    def test_repeated_sku_last_wins(self):
+        """Test the last of repeated skus in a batch is kept."""
+        report = sync_products(self.user.pk, [feed_item('A', name='First'), feed_item('A', name='Last')])
+
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(self.products().get().name, 'Last')
+
+    def test_invalid_items_reported(self):
+        """Test invalid items are skipped with their index."""
+        report = sync_products(self.user.pk, [feed_item('A'), {'name': 'No sku'}, 'text'])
+
+        self.assertEqual((report['created'], report['failed']), (1, 2))
+        self.assertEqual([error['index'] for error in report['errors']], [1, 2])
+        self.assertIn('sku', report['errors'][0]['errors'])
+
+
+class SyncProductsViewTest(TestCase):
+    """Test catalog sync endpoint."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(email='sync-api@example.com', password='test1234')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_ndjson_feed(self):
+        """Test NDJSON feed is upserted and missing products removed."""
+        ProductInformation.objects.create(product_owner=self.user, name='Old', sku='OLD')
+        body = '\n'.join(json.dumps(feed_item(sku)) for sku in ['A', 'B'])
+
+        response = self.client.generic('POST', URL_SYNC + '?remove_missing=true', body,
+                                       content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['created'], response.data['deleted']), (2, 1))
+        self.assertEqual(set(ProductInformation.objects.values_list('sku', flat=True)), {'A', 'B'})
+
+    def test_requires_authentication(self):
+        """Test anonymous users can't sync."""
+        response = APIClient().post(URL_SYNC, [], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
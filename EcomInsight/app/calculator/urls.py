@@ -1,13 +1,19 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import SumAllExpences, ItemsViewSet, ImportExportCSV
+from .views import SumAllExpences, SumAllExpencesBatch, ItemsViewSet, OtherFields, ImportExportCSV, StreamExportCSV, ImportCSV, SyncProducts, CatalogAnalytics
 
 router = DefaultRouter()
 router.register('items', ItemsViewSet, basename='item')
+router.register('other-fields', OtherFields, basename='other-field')
 
 app_name = 'calculator'
 urlpatterns = [
     path('calculate/', SumAllExpences.as_view(), name='calculate'), # API for unauthenticated users.
+    path('calculate/batch/', SumAllExpencesBatch.as_view(), name='calculate_batch'), # API for unauthenticated users.
     path('export/products/csv/', ImportExportCSV.as_view(), name='export_csv'), # API for authenticated users.
+    path('export/products/csv/stream/', StreamExportCSV.as_view(), name='export_csv_stream'), # API for authenticated users.
+    path('import/products/csv/', ImportCSV.as_view(), name='import_csv'), # API for authenticated users.
+    path('sync/products/', SyncProducts.as_view(), name='sync_products'), # API for authenticated users.
+    path('analytics/products/', CatalogAnalytics.as_view(), name='analytics_products'), # API for authenticated users.
     path('', include(router.urls))
 ]
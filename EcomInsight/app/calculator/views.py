@@ -1,13 +1,24 @@
+import io
 import os
+import uuid
+from functools import partial
 from celery.result import AsyncResult
-from django.core.cache import cache
+from django.conf import settings
 from rest_framework import status
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from rest_framework.decorators import action
 from rest_framework.views import APIView
+from rest_framework.parsers import MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from .services import Calculator, UserInputHandler
+from .caching import calculation_cache, items_cache
+from .services import calculate_product
 from rest_framework import viewsets, mixins
-from .models import ProductInformationAdditionalFields
+from .models import AdditionalField, ExportJob
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from drf_spectacular.utils import (extend_schema_view,
@@ -16,12 +27,34 @@ from drf_spectacular.utils import (extend_schema_view,
                                    OpenApiTypes)
 from .serializers import (ProductInfoSerializer,
                           ProductInformationAdditionalFieldsSerializer,
-                          CreateProductSerializer, CsvSerializer)
+                          CreateProductSerializer, CsvSerializer,
+                          CsvImportSerializer, CatalogSummarySerializer)
 from .api_queries import (get_all_items,
+                          only_item_fields,
                           get_items_by_name,
                           get_items_by_sku,
+                          search_items,
                           get_all_items_for_auth_user)
-from .tasks import generate_csv_task
+from .listing import product_values, selected_fields, serialize_items
+from .other_fields import find_field
+from .repricing import change_other_field
+from .bulk import (BulkCreateProductSerializer,
+                   BulkDeleteSerializer,
+                   BulkUpdateProductSerializer,
+                   bulk_create_products,
+                   bulk_delete_products,
+                   bulk_update_products)
+from .pagination import (ItemsCursorPagination,
+                         OtherFieldsCursorPagination,
+                         SearchCursorPagination)
+from .changes import ChangesQuerySerializer, changes_since
+from .analytics import get_summary
+from .streaming import StreamItemError, iter_json_items, to_ndjson
+from .sync import SyncProductSerializer, sync_products
+from .downloads import download_response
+from .exports import job_progress, start_export
+from .import_export import import_owner, iter_csv, register_import
+from .tasks import generate_csv_task, import_csv_task
 
 
 class SumAllExpences(APIView):
@@ -42,22 +75,74 @@ class SumAllExpences(APIView):
                                            context={'request': request})
 
         if serializer.is_valid(raise_exception=True):
-            kwargs = serializer.validated_data
-
-            # Parse user input data and prepare for further calculations.
-            lists = UserInputHandler(kwargs).parse_user_input()
             # Calculate expenses, recommended price and net profit.
-            calculate = Calculator(sum_values=lists.sum_values,
-                                   percent_values=lists.percent_values,
-                                   user_input=kwargs)
+            totals = calculation_cache.get_or_calculate(serializer.validated_data,
+                                                        calculate_product)
+
+            return Response({'expenses': totals.expenses,
+                             'recommended_price': totals.recommended_price,
+                             'net_profit': totals.net_profit})
+
+
+class SumAllExpencesBatch(APIView):
+    """
+    View to calculate many user inputs in one request.
+    Accepts a JSON array or NDJSON body and streams one NDJSON line per input,
+    in input order, as soon as it is calculated. Invalid inputs are reported
+    inline with their index and do not fail the rest of the batch.
+    """
+
+    serializer_class = ProductInfoSerializer
+
+    def calculate_item(self, index, item):
+        """Validate and calculate one input of the batch."""
+
+        if isinstance(item, StreamItemError):
+            return {'index': index, 'errors': {'non_field_errors': [str(item)]}}
+
+        serializer = ProductInfoSerializer(data=item,
+                                           context={'request': self.request})
+        if not serializer.is_valid():
+            return {'index': index, 'errors': serializer.errors}
+        try:
+            totals = calculate_product(serializer.validated_data)
+        except TypeError as error:
+            return {'index': index, 'errors': {'non_field_errors': [str(error)]}}
+        return {'index': index, **totals._asdict()}
+
+    def stream_results(self, stream):
+        """Yield NDJSON result lines for items read from the request body."""
+
+        index = 0
+        try:
+            for item in iter_json_items(stream):
+                yield to_ndjson(self.calculate_item(index, item))
+                index += 1
+        except StreamItemError as error:
+            yield to_ndjson({'index': index, 'errors': {'non_field_errors': [str(error)]}})
+
+    @extend_schema(request=ProductInfoSerializer(many=True),
+                   responses={(200, 'application/x-ndjson'): OpenApiTypes.STR})
+    def post(self, request):
+        """Post request to handle batch calculator input from user."""
+
+        stream = request.stream or io.BytesIO()
+        return StreamingHttpResponse(self.stream_results(stream),
+                                     content_type='application/x-ndjson')
 
-            expenses = calculate.get_total_expenses()
-            recommended_price = calculate.get_recommended_price(expenses)
-            net_profit = calculate.get_net_profit(expenses, recommended_price)
 
-            return Response({'expenses': expenses,
-                             'recommended_price': recommended_price,
-                             'net_profit': net_profit})
+FIELDSET_PARAMETERS = [
+    OpenApiParameter(
+        'fields',
+        OpenApiTypes.STR,
+        description='Comma separated item fields to return',
+    ),
+    OpenApiParameter(
+        'exclude',
+        OpenApiTypes.STR,
+        description='Comma separated item fields to leave out',
+    ),
+]
 
 
 @extend_schema_view(
@@ -73,8 +158,15 @@ class SumAllExpences(APIView):
                 OpenApiTypes.STR,
                 description='Sku of the product to filter',
             ),
+            OpenApiParameter(
+                'search',
+                OpenApiTypes.STR,
+                description='Search products by name, ranked by similarity',
+            ),
+            *FIELDSET_PARAMETERS,
         ]
-    )
+    ),
+    retrieve=extend_schema(parameters=FIELDSET_PARAMETERS),
 )
 class ItemsViewSet(viewsets.ModelViewSet, mixins.UpdateModelMixin, ):
     """Perform CRUD operations for items."""
@@ -83,6 +175,7 @@ class ItemsViewSet(viewsets.ModelViewSet, mixins.UpdateModelMixin, ):
     serializer_class = ProductInfoSerializer
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = ItemsCursorPagination
 
     def get_serializer_class(self, *args, **kwargs):
         """Get serializer class."""
@@ -97,22 +190,188 @@ class ItemsViewSet(viewsets.ModelViewSet, mixins.UpdateModelMixin, ):
         user = self.request.user.pk
         name = self.request.query_params.get('name')
         sku = self.request.query_params.get('sku')
+        search = self.request.query_params.get('search')
 
-        cache_key = 'Items'
-        cached_queryset = cache.get(cache_key)
+        if search:
+            queryset = search_items(search, user)
+        elif name:
+            queryset = get_items_by_name(name, user)
+        elif sku:
+            queryset = get_items_by_sku(sku, user)
+        else:
+            queryset = get_all_items_for_auth_user(user)
+        if self.action in ('list', 'retrieve'):
+            queryset = only_item_fields(queryset, self.item_fields)
+        elif self.action in ('update', 'partial_update'):
+            # Locked until the request's transaction ends, the update writes
+            # back the additional fields document merged with the request.
+            queryset = queryset.select_for_update()
+        return queryset
 
+    @property
+    def item_fields(self):
+        """Item fields selected with the fields and exclude query parameters."""
 
-        queryset = get_all_items_for_auth_user(user)
+        if not hasattr(self, '_item_fields'):
+            self._item_fields = selected_fields(self.request.query_params)
+        return self._item_fields
 
-        if name:
-            return get_items_by_name(name)
-        if sku:
-            return get_items_by_sku(sku)
-        if cached_queryset is not None:
-            return cached_queryset
+    def get_serializer(self, *args, **kwargs):
+        """Get serializer, limited to the selected item fields on reads."""
 
-        cache.set(cache_key, queryset, timeout=60 * 5)
-        return queryset
+        serializer = super().get_serializer(*args, **kwargs)
+        if self.action in ('list', 'retrieve'):
+            fields = getattr(serializer, 'child', serializer).fields
+            for name in list(fields):
+                if name not in self.item_fields:
+                    fields.pop(name)
+        return serializer
+
+    @property
+    def paginator(self):
+        """Paginate search results by rank, other lists by creation."""
+
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('search'):
+                self._paginator = SearchCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def conditional_read(self, request, read):
+        """
+        Return 304 when the client's copy is current, else the response of
+        read(). Validators come from the user's change metadata, so neither
+        is checked by running the query. Only JSON responses are validated.
+        """
+
+        if not isinstance(request.accepted_renderer, JSONRenderer):
+            return read()
+
+        user = request.user.pk
+        etag = items_cache.etag(user, request.path, request.accepted_media_type,
+                                sorted(request.query_params.lists()))
+        last_modified = items_cache.last_modified(user)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = read()
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            # Clients keep their copy but revalidate it, shared caches don't store it.
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve item, answering conditional requests."""
+
+        return self.conditional_read(request, partial(super().retrieve, request, *args, **kwargs))
+
+    def list(self, request, *args, **kwargs):
+        """List items, answering conditional requests."""
+
+        return self.conditional_read(request, partial(self.list_cached, request, *args, **kwargs))
+
+    def list_cached(self, request, *args, **kwargs):
+        """List items, serving rendered JSON pages from the user's cache."""
+
+        if not isinstance(request.accepted_renderer, JSONRenderer):
+            return super().list(request, *args, **kwargs)
+
+        key = items_cache.page_key(request.user.pk,
+                                   request.accepted_media_type,
+                                   sorted(request.query_params.lists()))
+        content = items_cache.get(key)
+        if content is not None:
+            return HttpResponse(content, content_type=request.accepted_media_type)
+
+        def cache_content(rendered_response):
+            if rendered_response.status_code == status.HTTP_200_OK:
+                items_cache.set(key, rendered_response.content)
+
+        response = self.list_values(request)
+        response.add_post_render_callback(cache_content)
+        return response
+
+    def list_values(self, request):
+        """
+        List items read as values() rows, serialized without building
+        serializer fields per item. Renders the same JSON as the serializer.
+        """
+
+        queryset = self.filter_queryset(self.get_queryset())
+        ordering = [name.lstrip('-') for name in self.paginator.ordering]
+        columns = dict.fromkeys([*product_values(self.item_fields), *ordering])
+        page = self.paginate_queryset(queryset.values(*columns))
+        return self.get_paginated_response(serialize_items(page, self.item_fields))
+
+    def update(self, request, *args, **kwargs):
+        """Update item, reporting the number of written rows in a header."""
+
+        response = super().update(request, *args, **kwargs)
+        response['X-Rows-Touched'] = self.rows_touched
+        return response
+
+    def perform_update(self, serializer):
+        """Update item, keeping the number of written rows."""
+
+        super().perform_update(serializer)
+        self.rows_touched = serializer.rows_touched
+
+    def perform_destroy(self, instance):
+        """Delete item and invalidate owner's cached lists."""
+
+        items_cache.invalidate(instance.product_owner_id)
+        super().perform_destroy(instance)
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        """Let bulk actions commit their own transactions."""
+
+        view = super().as_view(actions, **initkwargs)
+        if actions and 'bulk_create' in actions.values():
+            view = transaction.non_atomic_requests(view)
+        return view
+
+    @extend_schema(parameters=[ChangesQuerySerializer], responses={200: OpenApiTypes.OBJECT})
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """List items created, updated or deleted since a cursor, oldest change first."""
+
+        query = ChangesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(changes_since(request.user.pk,
+                                      query.validated_data.get('cursor'),
+                                      query.validated_data.get('page_size')))
+
+    @extend_schema(request=BulkCreateProductSerializer(many=True),
+                   responses={201: ProductInfoSerializer(many=True)})
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        """Create a list of items, all or none of them."""
+
+        products = bulk_create_products(request.user, request.data, self.get_serializer_context())
+        return Response(ProductInfoSerializer(products, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+    @extend_schema(request=BulkUpdateProductSerializer(many=True),
+                   responses={200: ProductInfoSerializer(many=True)})
+    @bulk_create.mapping.patch
+    def bulk_partial_update(self, request):
+        """Partially update a list of items identified by id, all or none of them."""
+
+        products = bulk_update_products(request.user, request.data, self.get_serializer_context())
+        return Response(ProductInfoSerializer(products, many=True).data)
+
+    @extend_schema(request=BulkDeleteSerializer, responses={200: OpenApiTypes.OBJECT})
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request):
+        """Delete items by id in chunks."""
+
+        serializer = BulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        deleted = bulk_delete_products(request.user, serializer.validated_data['ids'])
+        return Response({'deleted': deleted})
 
 
 class OtherFields(mixins.UpdateModelMixin,
@@ -122,15 +381,68 @@ class OtherFields(mixins.UpdateModelMixin,
     """View to list, update and delete other fields."""
 
     serializer_class = ProductInformationAdditionalFieldsSerializer
-    queryset = ProductInformationAdditionalFields.objects.all()
+    queryset = AdditionalField.objects.all()
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    pagination_class = OtherFieldsCursorPagination
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        """Get fields of the user's products."""
+
+        return self.queryset.filter(product_owner=self.request.user.pk)
+
+    def get_object(self):
+        """Get field of the user's products through the index on their documents."""
+
+        field = find_field(self.request.user.pk, int(self.kwargs[self.lookup_field]))
+        if field is None:
+            raise Http404
+        self.check_object_permissions(self.request, field)
+        return field
+
+    def perform_update(self, serializer):
+        """Update field in its product's document together with the product's totals."""
+
+        changes = {name: value for name, value in serializer.validated_data.items()
+                   if name in ('field_name', 'value')}
+        field = change_other_field(serializer.instance.product_id, serializer.instance.pk, changes)
+        if field is None:
+            raise Http404
+        serializer.instance = AdditionalField(product_id=serializer.instance.product_id, **field)
+
+    def perform_destroy(self, instance):
+        """Delete field from its product's document and totals."""
+
+        change_other_field(instance.product_id, instance.pk)
+
+
+class StreamExportCSV(APIView):
+    """
+    View to download user's products as CSV generated while it is sent.
+    Memory use is bounded by the cursor chunk size, so the Celery export is
+    only needed when a download would take too long for one request.
+    """
+
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
 
+    @extend_schema(responses={(200, 'text/csv'): OpenApiTypes.STR})
+    def get(self, request):
+        """Get request streaming the CSV file."""
+
+        response = StreamingHttpResponse(iter_csv(request.user), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="products.csv"'
+        return response
 
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class ImportExportCSV(APIView):
     """
     Class for operations related to CSV files.
-    Post method creates a celery task to generate a CSV file and returns the task ID.
+    Post method creates a celery task to generate a CSV file and returns the task ID,
+    the ID of a running or finished export of the same products when there is one.
+    Export jobs are committed when created, so concurrent requests find them.
     Get method checks the status of a CSV generation task and returns the file if ready.
     """
 
@@ -156,24 +468,137 @@ class ImportExportCSV(APIView):
         task_id = request.query_params.get('task_id')
         if not task_id:
             return Response({'error': 'No task_id provided'}, status=400)
-        # Getting task result.
-        task_result = AsyncResult(task_id)
+        job = ExportJob.objects.filter(owner=request.user, task_id=task_id).first()
+        if job is None:
+            return Response({'error': 'Export not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        if task_result.state == 'SUCCESS':
-            file_path = task_result.get()
-            with open(file_path, 'rb') as f:
-                response = HttpResponse(f, content_type='text/csv')
-                response['Content-Disposition'] = 'attachment; filename="products.csv"'
-            os.remove(file_path)  # Remove file after download to save space.
-            return response
-        else:
-            return Response({'status': 'Processing'}, status=status.HTTP_102_PROCESSING)
+        if job.status == ExportJob.Status.SUCCESS:
+            # The file is kept until the job expires, for repeated downloads.
+            try:
+                return download_response(request, job.file_path, 'products.csv', 'text/csv')
+            except FileNotFoundError:
+                return Response({'error': 'Export not found'}, status=status.HTTP_404_NOT_FOUND)
+        if job.status == ExportJob.Status.FAILURE:
+            return Response({'status': 'Failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        # Rows written by every shard of the file, empty while waiting for a worker.
+        return Response({'status': 'Processing', 'shards': job_progress(job)},
+                        status=status.HTTP_202_ACCEPTED)
 
     def post(self, request):
         """
         POST method to start CSV generation.
-        This method triggers a Celery task to generate a CSV file.
+        This method triggers a Celery task to generate a CSV file, unless
+        an earlier export of the same products is running or finished.
         """
-        user_id = request.user.id
-        task = generate_csv_task.delay(user_id)
-        return Response({'task_id': task.id}, status=status.HTTP_200_OK)
+        job, _ = start_export(request.user, lambda job: generate_csv_task.apply_async(
+            args=[job.pk], task_id=job.task_id))
+        return Response({'task_id': job.task_id}, status=status.HTTP_200_OK)
+
+
+class ImportCSV(APIView):
+    """
+    View to import products from a CSV file.
+    Post method stores the uploaded file and starts a celery task importing it.
+    Get method reports progress, row errors and the result of the import.
+    """
+
+    serializer_class = CsvImportSerializer
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(name='task_id', description='Task ID of the CSV import', required=True, type=str)
+        ],
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    def get(self, request):
+        """GET method to check the status of a CSV import."""
+
+        task_id = request.query_params.get('task_id')
+        if not task_id:
+            return Response({'error': 'No task_id provided'}, status=status.HTTP_400_BAD_REQUEST)
+        # Checked before reading the result, failures included.
+        if import_owner(task_id) != request.user.pk:
+            return Response({'error': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        task_result = AsyncResult(task_id)
+
+        if task_result.state == 'FAILURE':
+            return Response({'status': task_result.state, 'error': str(task_result.info)})
+        if not isinstance(task_result.info, dict):
+            return Response({'status': task_result.state})
+
+        report = dict(task_result.info)
+        report.pop('user_id', None)
+        return Response({'status': task_result.state, **report})
+
+    @extend_schema(request=CsvImportSerializer, responses={202: CsvImportSerializer})
+    def post(self, request):
+        """POST method to upload a CSV file and start its import."""
+
+        serializer = CsvImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        os.makedirs(settings.CALCULATOR_IMPORT_ROOT, exist_ok=True)
+        file_path = os.path.join(settings.CALCULATOR_IMPORT_ROOT,
+                                 f'import_{request.user.pk}_{uuid.uuid4().hex}.csv')
+        with open(file_path, 'wb') as destination:
+            for chunk in serializer.validated_data['file'].chunks():
+                destination.write(chunk)
+        task_id = str(uuid.uuid4())
+        register_import(request.user.pk, task_id)
+        import_csv_task.apply_async(args=[request.user.pk, file_path], task_id=task_id)
+        return Response({'task_id': task_id}, status=status.HTTP_202_ACCEPTED)
+
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class SyncProducts(APIView):
+    """
+    View to synchronise user's catalog with a product feed.
+    Accepts a JSON array or NDJSON body of products identified by sku,
+    fields left out of an item keep their stored values.
+    Products are created or updated in batches, each committed on its own,
+    so a feed can simply be sent again after a failure.
+    """
+
+    serializer_class = SyncProductSerializer
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        request=SyncProductSerializer(many=True),
+        parameters=[
+            OpenApiParameter(
+                'remove_missing',
+                OpenApiTypes.BOOL,
+                description='Delete products whose sku is not in the feed',
+            ),
+        ],
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    def post(self, request):
+        """Post request to upsert products of the feed."""
+
+        remove_missing = request.query_params.get('remove_missing', '').lower() in ('1', 'true')
+        stream = request.stream or io.BytesIO()
+        report = sync_products(request.user.pk, iter_json_items(stream), remove_missing)
+        return Response(report)
+
+
+class CatalogAnalytics(APIView):
+    """
+    View to get totals across user's catalog.
+    Totals are kept up to date on every write, so reading them takes the
+    same time for any catalog size.
+    """
+
+    serializer_class = CatalogSummarySerializer
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(responses={200: CatalogSummarySerializer})
+    def get(self, request):
+        """Get request returning the summary of user's catalog."""
+
+        return Response(CatalogSummarySerializer(get_summary(request.user.pk)).data)
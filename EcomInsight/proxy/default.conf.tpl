@@ -1,6 +1,18 @@
 server {
     listen ${LISTEN_PORT};
 
+    # Export files are only sent for X-Accel-Redirect responses of the app,
+    # which checked the user's access. Range requests are served by nginx.
+    location /static/media/exports/ {
+        internal;
+        alias /vol/static/media/exports/;
+    }
+
+    # Uploaded imports are only read by workers.
+    location /static/media/imports/ {
+        deny all;
+    }
+
     location /static {
         alias /vol/static;
     }
@@ -10,4 +22,4 @@ server {
         include                 /etc/nginx/uwsgi_params;
         client_max_body_size    10M;
     }
-}
\ No newline at end of file
+}